@@ -82,6 +82,20 @@ def recreate_open_dataset(dv_from, dv_to):
     Return False if no data can be read (you may need to re-open the dataset)
     """
     
+    # copy the whole dataset in one go if both data vaults support it
+    if hasattr(dv_from, 'export_dataset') and hasattr(dv_to, 'import_dataset'):
+        chunk = dv_from.export_dataset(0)
+        offset = len(chunk)
+        while chunk:
+            next_chunk = dv_from.export_dataset(offset)
+            offset += len(next_chunk)
+            if next_chunk:
+                dv_to.import_chunk(chunk)
+            else:
+                dv_to.import_dataset(chunk)
+            chunk = next_chunk
+        return True
+
     # read data and parameters
     data = dv_from.get()
     if not len(data) or not len(data[0]):
@@ -41,7 +41,8 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 import labrad.util
 import labrad.wrappers
 
-from datavault import SessionStore
+from datavault import SessionStore, backend, search
+from datavault.executor import IO_THREADS, IOExecutor
 from datavault.server import DataVault
 
 
@@ -81,6 +82,52 @@ def load_settings(cxn, name):
         print 'To change this, edit the registry keys and restart the server.'
     returnValue(datadir)
 
+@inlineCallbacks
+def load_options(cxn, name):
+    """Load optional tuning settings from the registry.
+
+    These are stored as keys in the server's registry directory, next to the
+    'Repository' directory, and are all optional.  Returns a dict with an
+    entry for each key that was found.
+    """
+    path = ['', 'Servers', name]
+    reg = cxn.registry
+    yield reg.cd(path, True)
+    (dirs, keys) = yield reg.dir()
+    options = {}
+    for key in ['Storage Policy', 'Metadata Flush Delay', 'No Atime',
+                'IO Threads', 'Max Open Files', 'CSV Cache Bytes',
+                'Search Index']:
+        if key in keys:
+            options[key] = yield reg.get(key)
+    returnValue(options)
+
+def configure(session_store, options):
+    """Apply options loaded from the registry to the session store."""
+    if 'Storage Policy' in options:
+        session_store.storage_policy = backend.parse_storage_policy(
+                options['Storage Policy'])
+    if 'Metadata Flush Delay' in options:
+        session_store.metadata_flush_delay = float(
+                options['Metadata Flush Delay'])
+    if 'No Atime' in options:
+        session_store.noatime = bool(options['No Atime'])
+    if 'Max Open Files' in options:
+        backend.get_file_pool().max_open = int(options['Max Open Files'])
+    if 'CSV Cache Bytes' in options:
+        backend.get_data_cache().max_bytes = int(options['CSV Cache Bytes'])
+    if options.get('Search Index'):
+        session_store.search_index = search.open_existing_index(
+                session_store.datadir)
+        if session_store.search_index is None:
+            print 'Search index not found; searching is disabled.'
+            print 'To build it, run: python -m datavault.search {}'.format(
+                    session_store.datadir)
+    threads = int(options.get('IO Threads', IO_THREADS))
+    if threads > 0:
+        session_store.io_executor = IOExecutor(threads)
+        session_store.io_executor.start()
+
 def main(argv=sys.argv):
     @inlineCallbacks
     def start():
@@ -88,8 +135,10 @@ def main(argv=sys.argv):
         cxn = yield labrad.wrappers.connectAsync(
             host=opts['host'], port=int(opts['port']), password=opts['password'])
         datadir = yield load_settings(cxn, opts['name'])
+        options = yield load_options(cxn, opts['name'])
         yield cxn.disconnect()
         session_store = SessionStore(datadir, hub=None)
+        configure(session_store, options)
         server = DataVault(session_store)
         session_store.hub = server
 
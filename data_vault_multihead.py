@@ -48,7 +48,8 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 from labrad import constants, protocol, util
 import labrad.wrappers
 
-from datavault import SessionStore
+from datavault import METADATA_FLUSH_DELAY, SessionStore, backend, search
+from datavault.executor import IO_THREADS, IOExecutor
 from datavault.server import DataVaultMultiHead
 
 def lock_path(d):
@@ -196,20 +197,47 @@ class DataVaultServiceHost(MultiService):
         'onTagsUpdated',
         'onDataAvailable',
         'onNewParameter',
-        'onCommentsAvailable'
+        'onCommentsAvailable',
+        'onDataPushed'
     ]
 
-    def __init__(self, path, managers):
+    def __init__(self, path, managers, storage_policy=None,
+                 metadata_flush_delay=None, noatime=False,
+                 io_threads=IO_THREADS, max_open_files=backend.MAX_OPEN_FILES,
+                 csv_cache_bytes=backend.CSV_CACHE_BYTES, search_index=False):
         MultiService.__init__(self)
         self.path = path
         self.managers = managers
         self.servers = set()
         self.session_store = SessionStore(path, self)
+        if storage_policy:
+            self.session_store.storage_policy = backend.parse_storage_policy(
+                    storage_policy)
+        if metadata_flush_delay is not None:
+            self.session_store.metadata_flush_delay = metadata_flush_delay
+        self.session_store.noatime = noatime
+        if search_index:
+            self.session_store.search_index = search.open_existing_index(path)
+            if self.session_store.search_index is None:
+                print 'Search index not found; searching is disabled.'
+                print 'To build it, run: python -m datavault.search {}'.format(
+                        path)
+        backend.get_file_pool().max_open = max_open_files
+        backend.get_data_cache().max_bytes = csv_cache_bytes
+        if io_threads > 0:
+            self.session_store.io_executor = IOExecutor(io_threads)
+            self.session_store.io_executor.start()
         for signal in self.signals:
             self.wrapSignal(signal)
         for host, port, password in managers:
             self.add_server(host, port, password)
 
+    def stopService(self):
+        # write out any data still buffered in memory
+        d = self.session_store.flush()
+        d.addCallback(lambda _: MultiService.stopService(self))
+        return d
+
     def connect(self, server):
         self.servers.add(server)
 
@@ -322,11 +350,23 @@ def load_settings_registry(cxn):
     p.get("Repository", 's', key="repo")
     p.get("Managers", "*(sws)", key="managers")
     p.get("Node", "s", False, "", key="node")
+    p.get("Storage Policy", "s", False, "", key="storage")
+    p.get("Metadata Flush Delay", "v", False, METADATA_FLUSH_DELAY,
+          key="flush_delay")
+    p.get("No Atime", "b", False, False, key="noatime")
+    p.get("IO Threads", "w", False, IO_THREADS, key="io_threads")
+    p.get("Max Open Files", "w", False, backend.MAX_OPEN_FILES,
+          key="max_open_files")
+    p.get("CSV Cache Bytes", "v", False, backend.CSV_CACHE_BYTES,
+          key="csv_cache_bytes")
+    p.get("Search Index", "b", False, False, key="search_index")
     ans = yield p.send()
     if ans.node and (ans.node != util.getNodeName()):
         raise RuntimeError('Node name "%s" from registry does not match current host "%s"' % (ans.node, util.getNodeName()))
     cxn.disconnect()
-    returnValue((ans.repo, ans.managers))
+    returnValue((ans.repo, ans.managers, ans.storage, ans.flush_delay,
+                 ans.noatime, ans.io_threads, ans.max_open_files,
+                 int(ans.csv_cache_bytes), ans.search_index))
 
 def load_settings_cmdline(argv):
     if len(argv) < 3:
@@ -344,10 +384,12 @@ def load_settings_cmdline(argv):
         else:
             port = int(port)
         managers.append((host, port, password))
-    return path, managers
+    return (path, managers, '', METADATA_FLUSH_DELAY, False, IO_THREADS,
+            backend.MAX_OPEN_FILES, backend.CSV_CACHE_BYTES, False)
 
 def start_server(args):
-    path, managers = args
+    (path, managers, storage_policy, flush_delay, noatime, io_threads,
+     max_open_files, csv_cache_bytes, search_index) = args
     if not os.path.exists(path):
         raise Exception('data path %s does not exist' % path)
     if not os.path.isdir(path):
@@ -363,7 +405,10 @@ def start_server(args):
 
     lock_path(path)
     managers = [parseManagerInfo(m) for m in managers]
-    service = DataVaultServiceHost(path, managers)
+    service = DataVaultServiceHost(path, managers, storage_policy,
+                                   flush_delay, noatime, io_threads,
+                                   max_open_files, csv_cache_bytes,
+                                   search_index)
     service.startService()
 
 def main(argv=sys.argv):
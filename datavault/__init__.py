@@ -1,15 +1,77 @@
 import base64
+import bisect
 from datetime import datetime
+import json
 import os
+import shutil
+import tarfile
+import tempfile
+import time
 import re
 import collections
+from StringIO import StringIO
+import thread
 import weakref
 
+import numpy as np
+from twisted.internet import defer, reactor
+
 from labrad import types as T
 
 from . import backend, errors, util
 
 
+## Write-behind buffering of added data.
+#
+# Rows added to a dataset are held in memory and written to the backend in a
+# single batch once any of these limits is reached.  Buffered rows are
+# always visible to readers.
+
+WRITE_BUFFER_ROWS = 1000 # flush after this many buffered rows
+WRITE_BUFFER_BYTES = 1 << 20 # flush after this many buffered bytes
+WRITE_BUFFER_DELAY = 1.0 # flush at most this many seconds after an add
+
+## Push streaming.
+#
+# Contexts can subscribe to have rows pushed to them in a signal as they are
+# written, instead of being notified and then reading the rows with 'get'.
+# Rows are pushed once per write buffer flush, so fast writers are coalesced
+# into few signals.  A context that has fallen more than its maximum number
+# of rows behind is notified instead, and reads to catch up; pushing resumes
+# once it has.
+
+PUSH_MAX_ROWS = 10000 # default maximum number of rows in a single push
+
+# rows read at a time when computing a decimated view of a dataset
+DECIMATE_CHUNK_ROWS = 1 << 16
+
+# rows read at a time when computing column statistics and histograms
+STATS_CHUNK_ROWS = 1 << 16
+
+
+## Deferred metadata writes.
+#
+# Access times of sessions and datasets are only marked dirty when they are
+# opened, and written out together by the session store after this delay
+# (or on shutdown).  Real modifications such as new datasets and tags are
+# still written immediately.  A delay of zero writes access times through
+# immediately; in noatime mode they are not written at all.
+
+METADATA_FLUSH_DELAY = 10.0 # seconds
+
+
+## Dataset export.
+#
+# An exported dataset is a tar archive holding a JSON manifest with the
+# title and tags, and the dataset's files renamed to 'dataset' plus their
+# usual extension (see DATASET_FILE_EXTENSIONS).  Derived files such as the
+# row index of CSV datasets are rebuilt on import rather than copied.
+
+EXPORT_MANIFEST = 'manifest.json'
+EXPORT_BASENAME = 'dataset'
+DATASET_FILE_EXTENSIONS = ['.hdf5', '.csv', '.dvb', '.ini']
+
+
 ## Filename translation.
 
 _encodings = [
@@ -51,6 +113,71 @@ def time_from_str(s):
     return datetime.strptime(s, TIME_FORMAT)
 
 
+## Directory index.
+#
+# Each session caches a sorted listing of its directory, which is only
+# rebuilt when the directory's mtime changes.  A listing taken within this
+# many seconds of the last change is not trusted, since a filesystem with
+# coarse timestamps may not advance the mtime for a second change.
+
+INDEX_MTIME_SLACK = 2.0
+
+_re_dataset_num = re.compile(r'^(\d+) - ')
+
+class DirectoryIndex(object):
+    """Sorted listing of the subdirectories and datasets in a directory.
+
+    Keeps dataset names sorted along with a name -> backend type map
+    ('csv', 'dvb' or 'hdf5') and a sorted list of dataset numbers, so that
+    datasets can be looked up by number with a binary search.
+    """
+
+    # backend types, in the order backend.open_backend looks for them
+    PRECEDENCE = ('csv', 'dvb', 'hdf5')
+
+    def __init__(self, files):
+        self.dirs = sorted(filename_decode(s[:-4]) for s in files
+                           if s.endswith('.dir'))
+        self.types = {}
+        for s in files:
+            base, _, ext = s.rpartition('.')
+            if ext in self.PRECEDENCE:
+                name = filename_decode(base)
+                # as in backend.open_backend
+                if (name not in self.types or self.PRECEDENCE.index(ext) <
+                        self.PRECEDENCE.index(self.types[name])):
+                    self.types[name] = ext
+        self.datasets = sorted(self.types)
+        numbered = sorted((num, name) for name, num in
+                          ((n, self._number(n)) for n in self.datasets)
+                          if num is not None)
+        self.numbers = [num for num, _ in numbered]
+        self.numbered = [name for _, name in numbered]
+
+    @staticmethod
+    def _number(name):
+        m = _re_dataset_num.match(name)
+        return int(m.group(1)) if m else None
+
+    def add(self, name, kind):
+        """Add a newly-created dataset to the index."""
+        if name not in self.types:
+            bisect.insort(self.datasets, name)
+            num = self._number(name)
+            if num is not None:
+                i = bisect.bisect_right(self.numbers, num)
+                self.numbers.insert(i, num)
+                self.numbered.insert(i, name)
+        self.types[name] = kind
+
+    def lookup(self, num):
+        """Get the name of the dataset with the given number, or None."""
+        i = bisect.bisect_left(self.numbers, num)
+        if i < len(self.numbers) and self.numbers[i] == num:
+            return self.numbered[i]
+        return None
+
+
 ## variable parsing
 
 _re_label = re.compile(r'^([^\[(]*)') # matches up to the first [ or (
@@ -83,14 +210,69 @@ DATA_URL_PREFIX = 'data:application/labrad;base64,'
 
 
 class SessionStore(object):
-    def __init__(self, datadir, hub):
+    def __init__(self, datadir, hub, reactor=reactor):
         self._sessions = weakref.WeakValueDictionary()
         self.datadir = datadir
         self.hub = hub
+        self.reactor = reactor
+        # storage policy for new datasets that don't specify their own
+        self.storage_policy = backend.DEFAULT_STORAGE_POLICY
+        # see METADATA_FLUSH_DELAY
+        self.metadata_flush_delay = METADATA_FLUSH_DELAY
+        self.noatime = False
+        self._dirty = set() # sessions and datasets with unsaved metadata
+        self._metadata_call = None
+        # search.SearchIndex kept up to date with new datasets, tags and
+        # parameters, or None if searching is not enabled
+        self.search_index = None
+        # executor.IOExecutor to run dataset I/O in, or None to run it on
+        # the reactor thread
+        self.io_executor = None
 
     def get_all(self):
         return self._sessions.values()
 
+    def runIO(self, key, f, *args, **kw):
+        """Call f(*args, **kw) in the I/O executor, returning a Deferred.
+
+        Calls with the same key run one at a time, in order.  Without an
+        executor the call is made right away, and errors are raised.
+        """
+        if self.io_executor is None:
+            return defer.succeed(f(*args, **kw))
+        return self.io_executor.run(key, f, *args, **kw)
+
+    def flush(self):
+        """Write any buffered data and metadata to disk.
+
+        Returns a Deferred that fires once the data has been written.
+        """
+        d = defer.DeferredList([session.flush() for session in self.get_all()])
+        self.flushMetadata()
+        return d
+
+    def markDirty(self, obj):
+        """Schedule a call to obj.flushMetadata to save its metadata.
+
+        Objects marked dirty are kept alive until they have been flushed.
+        """
+        if self.metadata_flush_delay <= 0:
+            obj.flushMetadata()
+            return
+        self._dirty.add(obj)
+        if self._metadata_call is None:
+            self._metadata_call = self.reactor.callLater(
+                    self.metadata_flush_delay, self.flushMetadata)
+
+    def flushMetadata(self):
+        """Save the metadata of all objects that have been marked dirty."""
+        if self._metadata_call is not None and self._metadata_call.active():
+            self._metadata_call.cancel()
+        self._metadata_call = None
+        dirty, self._dirty = self._dirty, set()
+        for obj in dirty:
+            obj.flushMetadata()
+
     def exists(self, path):
         """Check whether a session exists on disk for a given path.
 
@@ -125,9 +307,12 @@ class Session(object):
         """Initialization that happens once when session object is created."""
         self.path = path
         self.hub = hub
+        self.session_store = session_store
         self.dir = filedir(datadir, path)
         self.infofile = os.path.join(self.dir, 'session.ini')
         self.datasets = weakref.WeakValueDictionary()
+        self._index = None
+        self._index_mtime = None
 
         if not os.path.exists(self.dir):
             os.makedirs(self.dir)
@@ -136,15 +321,19 @@ class Session(object):
             parent_session = session_store.get(path[:-1])
             hub.onNewDir(path[-1], parent_session.listeners)
 
+            if session_store.search_index is not None:
+                session_store.search_index.addSession(path)
+
         if os.path.exists(self.infofile):
             self.load()
+            self.access()
         else:
             self.counter = 1
-            self.created = self.modified = datetime.now()
+            self.created = self.modified = self.accessed = datetime.now()
             self.session_tags = {}
             self.dataset_tags = {}
+            self.save()
 
-        self.access() # update current access time and save
         self.listeners = set()
 
     def load(self):
@@ -191,17 +380,43 @@ class Session(object):
             S.write(f)
 
     def access(self):
-        """Update last access time and save."""
+        """Update last access time, to be saved later by the session store."""
+        if self.session_store.noatime:
+            return
         self.accessed = datetime.now()
+        self.session_store.markDirty(self)
+
+    def flushMetadata(self):
         self.save()
 
+    def flush(self):
+        """Write any buffered data in this session's datasets to disk.
+
+        Returns a Deferred that fires once the data has been written.
+        """
+        return defer.DeferredList([dataset.flush()
+                                   for dataset in self.datasets.values()])
+
+    def _getIndex(self):
+        """Get the directory index, rebuilding it if the directory changed."""
+        mtime = os.stat(self.dir).st_mtime
+        if self._index is None or mtime != self._index_mtime:
+            self._index = DirectoryIndex(os.listdir(self.dir))
+            self._setIndexMtime(mtime)
+        return self._index
+
+    def _setIndexMtime(self, mtime):
+        # don't trust an mtime that may yet be bumped within the same tick
+        if time.time() - mtime > INDEX_MTIME_SLACK:
+            self._index_mtime = mtime
+        else:
+            self._index_mtime = None
+
     def listContents(self, tagFilters):
         """Get a list of directory names in this directory."""
-        files = os.listdir(self.dir)
-        dirs = [filename_decode(s[:-4]) for s in files if s.endswith('.dir')]
-        csv_datasets = [filename_decode(s[:-4]) for s in files if s.endswith('.ini') and s.lower() != 'session.ini' ]
-        hdf5_datasets = [filename_decode(s[:-5]) for s in files if s.endswith('.hdf5')]
-        datasets = sorted(csv_datasets + hdf5_datasets)
+        index = self._getIndex()
+        dirs = list(index.dirs)
+        datasets = list(index.datasets)
         # apply tag filters
         def include(entries, tag, tags):
             """Include only entries that have the specified tag."""
@@ -219,50 +434,204 @@ class Session(object):
                 filter = include
             dirs = filter(dirs, tag, self.session_tags)
             datasets = filter(datasets, tag, self.dataset_tags)
-        return sorted(dirs), sorted(datasets)
+        return dirs, datasets
 
     def listDatasets(self):
         """Get a list of dataset names in this directory."""
-        files = os.listdir(self.dir)
-        filenames = []
-        for s in files:
-            base, _, ext = s.rpartition('.')
-            if ext in ['csv', 'hdf5']:
-                filenames.append(filename_decode(base))
-        return sorted(filenames)
+        return list(self._getIndex().datasets)
 
-    def newDataset(self, title, independents, dependents, extended=False):
+    def _newName(self, title):
+        """Get a numbered name for a new dataset."""
         num = self.counter
         self.counter += 1
         self.modified = datetime.now()
+        return '%05d - %s' % (num, title)
+
+    def _indexDataset(self, dataset):
+        """Add a new dataset to the search index, if there is one.
+
+        The dataset must have just been opened, so that no I/O job can be
+        using its files yet.
+        """
+        search_index = self.session_store.search_index
+        if search_index is None:
+            return
+        meta = dataset.data
+        params = [(p, meta.getParameter(p)) for p in meta.getParamNames()]
+        search_index.addDataset(self.path, dataset.name, dataset.getTitle(),
+                                meta.getCreationTime(),
+                                dataset.getIndependents(),
+                                dataset.getDependents(), params,
+                                sorted(self.dataset_tags.get(dataset.name, [])))
+
+    def newDataset(self, title, independents, dependents, extended=False,
+                   storage=None):
+        return self._newDataset(title, independents=independents,
+                                dependents=dependents, extended=extended,
+                                storage=storage)
+
+    def newGridDataset(self, title, axes, dependents, storage=None):
+        """Create a dataset on a grid (see backend.GridHDF5Data).
+
+        axes are given as (label, unit, values), with no values for a first
+        axis that grows.
+        """
+        return self._newDataset(title, axes=axes, dependents=dependents,
+                                storage=storage)
 
-        name = '%05d - %s' % (num, title)
-        dataset = Dataset(self, name, title, create=True,
-                          independents=independents,
-                          dependents=dependents,
-                          extended=extended)
+    def _newDataset(self, title, **kw):
+        name = self._newName(title)
+        index = self._getIndex()
+        dataset = Dataset(self, name, title, create=True, **kw)
         self.datasets[name] = dataset
+        if isinstance(dataset.data, backend.BinaryData):
+            index.add(name, 'dvb')
+        else:
+            index.add(name, 'hdf5')
+        self._setIndexMtime(os.stat(self.dir).st_mtime)
         self.access()
+        self.save()
+        self._indexDataset(dataset)
 
         # notify listeners about the new dataset
         self.hub.onNewDataset(name, self.listeners)
         return dataset
 
+    def _stageFiles(self, sources):
+        """Write the files of a new dataset to a temporary directory here.
+
+        sources maps file extensions to file objects to copy the contents
+        of each file from.  This only does file I/O, so it may be called
+        in the I/O executor.  Returns (directory, kind) to pass on to
+        _addDatasetFiles.
+        """
+        if '.dvb' in sources and '.ini' in sources:
+            kind = 'dvb'
+        elif '.hdf5' in sources:
+            kind = 'hdf5'
+        elif '.csv' in sources and '.ini' in sources:
+            kind = 'csv'
+        else:
+            raise errors.DatasetImportError('no dataset files found')
+        tmpdir = tempfile.mkdtemp(prefix='.new-', dir=self.dir)
+        try:
+            for ext, src in sources.items():
+                filename = os.path.join(tmpdir, EXPORT_BASENAME + ext)
+                with open(filename, 'wb') as f:
+                    shutil.copyfileobj(src, f)
+        except Exception:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+        return tmpdir, kind
+
+    def _addDatasetFiles(self, title, staged, tags):
+        """Create a new dataset from the files written by _stageFiles."""
+        tmpdir, kind = staged
+        name = self._newName(title)
+        index = self._getIndex()
+        file_base = os.path.join(self.dir, filename_encode(name))
+        try:
+            for filename in os.listdir(tmpdir):
+                ext = os.path.splitext(filename)[1]
+                os.rename(os.path.join(tmpdir, filename), file_base + ext)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        if tags:
+            self.dataset_tags[name] = set(tags)
+        dataset = Dataset(self, name)
+        self.datasets[name] = dataset
+        index.add(name, kind)
+        self._setIndexMtime(os.stat(self.dir).st_mtime)
+        self.access()
+        self.save()
+        self._indexDataset(dataset)
+
+        # notify listeners about the new dataset
+        self.hub.onNewDataset(name, self.listeners)
+        return dataset
+
+    def exportDataset(self, dataset, fileobj):
+        """Write a dataset in this session and its tags to fileobj.
+
+        The dataset is written as a tar archive that can be read back with
+        importDataset, on this or another data vault.  The archive is
+        written in the I/O executor; returns a Deferred.
+        """
+        manifest = json.dumps({
+            'title': dataset.getTitle(),
+            'tags': sorted(self.dataset_tags.get(dataset.name, [])),
+        })
+        def write():
+            dataset.sync()
+            with tarfile.open(fileobj=fileobj, mode='w') as tar:
+                info = tarfile.TarInfo(EXPORT_MANIFEST)
+                info.size = len(manifest)
+                info.mtime = time.time()
+                tar.addfile(info, StringIO(manifest))
+                for ext, filename in dataset.files():
+                    tar.add(filename, arcname=EXPORT_BASENAME + ext)
+        return dataset.runIO(write)
+
+    def importDataset(self, fileobj):
+        """Create a new dataset from an archive written by exportDataset.
+
+        The archive is read in the I/O executor.  Returns a Deferred that
+        fires with the new dataset.
+        """
+        def read():
+            try:
+                tar = tarfile.open(fileobj=fileobj, mode='r')
+            except tarfile.TarError as e:
+                raise errors.DatasetImportError(str(e))
+            with tar:
+                try:
+                    manifest = json.load(tar.extractfile(EXPORT_MANIFEST))
+                except (KeyError, ValueError) as e:
+                    raise errors.DatasetImportError(
+                            'bad manifest: {}'.format(e))
+                sources = {}
+                for member in tar.getmembers():
+                    base, ext = os.path.splitext(member.name)
+                    if (member.isfile() and base == EXPORT_BASENAME and
+                            ext in DATASET_FILE_EXTENSIONS):
+                        sources[ext] = tar.extractfile(member)
+                title = manifest.get('title', 'untitled').encode('utf-8')
+                tags = [t.encode('utf-8') for t in manifest.get('tags', [])]
+                return title, self._stageFiles(sources), tags
+        d = self.session_store.runIO(self, read)
+        d.addCallback(lambda args: self._addDatasetFiles(*args))
+        return d
+
+    def copyDataset(self, dataset, dest):
+        """Copy a dataset in this session and its tags to session dest.
+
+        The files are copied in the I/O executor, after any buffered data
+        is written.  Returns a Deferred that fires with the copy.
+        """
+        title = dataset.getTitle()
+        tags = sorted(self.dataset_tags.get(dataset.name, []))
+        def copy():
+            dataset.sync()
+            sources = {}
+            try:
+                for ext, filename in dataset.files():
+                    sources[ext] = open(filename, 'rb')
+                return dest._stageFiles(sources)
+            finally:
+                for f in sources.values():
+                    f.close()
+        d = dataset.runIO(copy)
+        d.addCallback(lambda staged: dest._addDatasetFiles(title, staged, tags))
+        return d
+
     def openDataset(self, name):
+        index = self._getIndex()
         # first lookup by number if necessary
         if isinstance(name, (int, long)):
-            for oldName in self.listDatasets():
-                num = int(oldName[:5])
-                if name == num:
-                    name = oldName
-                    break
-        # if it's still a number, we didn't find the set
-        if isinstance(name, (int, long)):
-            raise errors.DatasetNotFoundError(name)
-
-        filename = filename_encode(name)
-        file_base = os.path.join(self.dir, filename)
-        if not (os.path.exists(file_base + '.csv') or os.path.exists(file_base + '.hdf5')):
+            num, name = name, index.lookup(name)
+            if name is None:
+                raise errors.DatasetNotFoundError(num)
+        elif name not in index.types:
             raise errors.DatasetNotFoundError(name)
 
         if name in self.datasets:
@@ -312,6 +681,11 @@ class Session(object):
         dataUpdates = updateTagDict(tags, datasets, self.dataset_tags)
 
         self.access()
+        self.save()
+        search_index = self.session_store.search_index
+        if search_index is not None:
+            for name, entryTags in dataUpdates:
+                search_index.setTags(self.path, name, entryTags)
         if len(sessUpdates) + len(dataUpdates):
             # fire a message about the new tags
             msg = (sessUpdates, dataUpdates)
@@ -322,29 +696,93 @@ class Session(object):
         dataTags = [(d, sorted(self.dataset_tags.get(d, []))) for d in datasets]
         return sessTags, dataTags
 
+class PushListener(object):
+    """State of a context that has new rows of a dataset pushed to it.
+
+    pos is the next row to push.  advance is called with the new position
+    after each push, so the context can keep its read position in step.
+    """
+    def __init__(self, pos, columns=None, max_rows=PUSH_MAX_ROWS,
+                 advance=None):
+        self.pos = pos
+        self.columns = columns
+        self.max_rows = max_rows
+        self.advance = advance
+        self.reading = False # whether rows for a push are being read
+
+
 class Dataset(object):
     """
     This object basically takes care of listeners and notifications.
     All the actual data or metadata access is proxied through to a
     backend object.
+
+    Added data is buffered in memory and written to the backend in batches
+    (see WRITE_BUFFER_ROWS, WRITE_BUFFER_BYTES and WRITE_BUFFER_DELAY).
+    Listeners are notified once per batch, and reads that reach into the
+    buffered rows flush the buffer first, so readers always see all rows.
+
+    If the session store has an I/O executor, every access to the backend
+    after the dataset is opened happens in its worker threads, one at a
+    time and in order: writes of buffered data, reads made with readData
+    and runIO, and parameters, comments and access times.  Methods doing
+    such I/O return a Deferred then, and their result directly without an
+    executor.  The title and variables never change, so they are read
+    once when the dataset is opened.  Everything else, including the
+    buffer and listeners, stays on the reactor thread.
     """
-    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False):
+    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False, storage=None, axes=None, reactor=reactor):
         self.hub = session.hub
+        self.session_store = session.session_store
+        self.session_path = session.path
         self.name = name
+        self.reactor = reactor
         file_base = os.path.join(session.dir, filename_encode(name))
+        self.file_base = file_base
         self.listeners = set() # contexts that want to hear about added data
+        self.push_listeners = {} # contexts that get added data pushed to them
         self.param_listeners = set()
         self.comment_listeners = set()
 
-        if create:
+        self._buffer = [] # added data not yet written to the backend
+        self._buffer_rows = 0
+        self._buffer_bytes = 0
+        self._flush_call = None
+        self._writing_rows = 0 # rows being written by the I/O executor
+        self._write_error = None # failure of a write, for the next caller
+        self._io_thread = None # thread running an I/O call for this dataset
+
+        # statistics and histograms over rows from some start to the end
+        # of the dataset, which are extended as rows are added
+        self._stats_cache = {}
+
+        if create and axes is not None:
+            axes = [backend.Axis(label, unit, values)
+                    for label, unit, values in axes]
+            dep = [self.makeDependent(d, False) for d in dependents]
+            self.data = backend.create_grid_backend(file_base, title, axes,
+                                                    dep, storage)
+            self.save()
+        elif create:
             indep = [self.makeIndependent(i, extended) for i in independents]
             dep = [self.makeDependent(d, extended) for d in dependents]
-            self.data = backend.create_backend(file_base, title, indep, dep, extended)
+            self.data = backend.create_backend(file_base, title, indep, dep,
+                                               extended, storage)
             self.save()
         else:
             self.data = backend.open_backend(file_base)
             self.load()
             self.access()
+        self._rows = len(self.data) # rows written to the backend
+        self._title = self.data.getTitle()
+        # read the variables and row dtype, which are cached from then on
+        self.data.getRowType()
+        self.data.dtype
+
+    @property
+    def session(self):
+        """The session for the directory holding this dataset."""
+        return self.session_store.get(self.session_path)
 
     def save(self):
         self.data.save()
@@ -352,14 +790,41 @@ class Dataset(object):
     def load(self):
         self.data.load()
 
+    def files(self):
+        """Get (extension, filename) for each file holding this dataset."""
+        return [(ext, self.file_base + ext) for ext in DATASET_FILE_EXTENSIONS
+                if os.path.exists(self.file_base + ext)]
+
+    def sync(self):
+        """Write all metadata, and data given to the backend, to the files.
+
+        Call this in an I/O job, such as with runIO, which writes the
+        buffered data to the backend first.
+        """
+        self.save()
+        self.data.file.flush()
+
+    def getTitle(self):
+        return self._title
+
     def version(self):
         v = self.data.version
         return '.'.join(str(x) for x in v)
 
     def access(self):
-        """Update time of last access for this dataset."""
-        self.data.access()
-        self.save()
+        """Update time of last access for this dataset.
+
+        The access time is written when the session store flushes metadata,
+        so it is only accurate to within the flush delay.
+        """
+        if not self.session_store.noatime:
+            self.session_store.markDirty(self)
+
+    def flushMetadata(self):
+        def write():
+            self.data.access()
+            self.save()
+        return self._io(write)
 
     def makeIndependent(self, label, extended):
         """Add an independent variable to this dataset."""
@@ -394,41 +859,447 @@ class Dataset(object):
         return self.data.getTransposeType()
 
     def addParameter(self, name, data, saveNow=True):
-        self.data.addParam(name, data)
-        if saveNow:
-            self.save()
-
-        # notify all listening contexts
-        self.hub.onNewParameter(None, self.param_listeners)
-        self.param_listeners = set()
-        return name
+        """Add a parameter.  Returns its name."""
+        d = self._addParameters([(name, data)], saveNow)
+        d.addCallback(lambda _: name)
+        return util.sync_result(d)
 
     def addParameters(self, params, saveNow=True):
-        for name, data in params:
-            self.data.addParam(name, data)
-        if saveNow:
-            self.save()
-
-        # notify all listening contexts
-        self.hub.onNewParameter(None, self.param_listeners)
-        self.param_listeners = set()
+        return util.sync_result(self._addParameters(params, saveNow))
+
+    def _addParameters(self, params, saveNow):
+        def write():
+            for name, data in params:
+                self.data.addParam(name, data)
+            if saveNow:
+                self.save()
+        def added(_):
+            self._indexParameters(params)
+
+            # notify all listening contexts
+            self.hub.onNewParameter(None, self.param_listeners)
+            self.param_listeners = set()
+        d = self._io(write)
+        d.addCallback(added)
+        return d
+
+    def _indexParameters(self, params):
+        search_index = self.session_store.search_index
+        if search_index is not None:
+            search_index.addParams(self.session_path, self.name, params)
 
     def getParameter(self, name, case_sensitive=True):
-        return self.data.getParameter(name, case_sensitive)
+        return util.sync_result(self._io(self.data.getParameter, name,
+                                         case_sensitive))
 
     def getParamNames(self):
-        return self.data.getParamNames()
+        return util.sync_result(self._io(self.data.getParamNames))
+
+    def getParameters(self):
+        """Get (name, value) for all parameters."""
+        def read():
+            return [(name, self.data.getParameter(name))
+                    for name in self.data.getParamNames()]
+        return util.sync_result(self._io(read))
 
     def addData(self, data):
-        # append the data to the file
-        self.data.addData(data)
+        self._checkWriteError()
+        if self.isGrid():
+            raise errors.GridDataError(
+                    'rows cannot be added to a grid; use put slab')
+        # check the row format now, since the backend only sees the data
+        # when the buffer is flushed
+        names = getattr(data, 'dtype', np.dtype(float)).names
+        if names is not None and len(names) != len(self.data.dtype):
+            raise errors.BadDataError(len(self.data.dtype), len(names))
+
+        self._buffer.append(data)
+        self._buffer_rows += len(data)
+        self._buffer_bytes += getattr(data, 'nbytes', 0)
+        if (self._buffer_rows >= WRITE_BUFFER_ROWS or
+                self._buffer_bytes >= WRITE_BUFFER_BYTES):
+            self._startFlush()
+        elif self._flush_call is None:
+            self._flush_call = self.reactor.callLater(WRITE_BUFFER_DELAY,
+                                                      self._startFlush)
+
+    def _inIO(self):
+        """Check whether we are in an I/O call for this dataset."""
+        return self._io_thread == thread.get_ident()
+
+    def _io(self, f, *args, **kw):
+        """Call f(*args, **kw) in the I/O executor, returning a Deferred.
+
+        Calls for this dataset run one at a time, in order.  Without an
+        executor the call is made right away, and errors are raised.
+        """
+        def call():
+            self._io_thread = thread.get_ident()
+            try:
+                with backend.pin_files():
+                    return f(*args, **kw)
+            finally:
+                self._io_thread = None
+        executor = self.session_store.io_executor
+        if executor is None:
+            return defer.succeed(call())
+        return executor.run(self, call)
+
+    def runIO(self, f, *args, **kw):
+        """Call f(*args, **kw) in the I/O executor after writing buffered data.
+
+        f may use the synchronous methods of the dataset, which then see
+        the rows added before this call.  Returns a Deferred.
+        """
+        self._startFlush()
+        return self._io(f, *args, **kw)
+
+    def _startFlush(self):
+        """Flush without waiting for the write.
+
+        If the write fails, the error is raised by the next add or read.
+        """
+        self.flush().addErrback(lambda failure: None)
+
+    def _checkWriteError(self):
+        """Raise the error of a failed write of buffered rows, once.
 
-        # notify all listening contexts
+        The error belongs to the reactor thread, so this does nothing in an
+        I/O call.
+        """
+        if self._inIO():
+            return
+        failure, self._write_error = self._write_error, None
+        if failure is not None:
+            raise errors.DataWriteError(self.name,
+                                        failure.getErrorMessage())
+
+    def flush(self):
+        """Write buffered data to the backend and notify listeners.
+
+        Returns a Deferred that fires once the data has been written.  If
+        the write fails, the rows not written are put back in the buffer,
+        to be written by the next flush.
+        """
+        if self._inIO():
+            return defer.succeed(None) # the buffer belongs to the reactor
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if not self._buffer:
+            return defer.succeed(None)
+        buffered = self._buffer
+        rows = self._buffer_rows
+        self._buffer = []
+        self._buffer_rows = 0
+        self._buffer_bytes = 0
+        self._writing_rows += rows
+        done = [0] # number of buffered chunks written
+
+        def write():
+            # append the data to the file, as a single batch where possible
+            batches = [(chunk, 1) for chunk in buffered]
+            if len(buffered) > 1:
+                try:
+                    batches = [(np.concatenate(buffered), len(buffered))]
+                except (TypeError, ValueError):
+                    pass # differing dtypes; write chunks one at a time
+            for chunk, n in batches:
+                self.data.addData(chunk)
+                done[0] += n
+
+        def written(result):
+            self._writing_rows -= rows
+            return result
+
+        def notify(_):
+            self._rows += rows
+            self._notifyData()
+
+        def failed(failure):
+            # keep the rows that were not written ahead of any added since
+            unwritten = buffered[done[0]:]
+            unwritten_rows = sum(len(chunk) for chunk in unwritten)
+            self._rows += rows - unwritten_rows
+            self._buffer[:0] = unwritten
+            self._buffer_rows += unwritten_rows
+            self._buffer_bytes += sum(getattr(chunk, 'nbytes', 0)
+                                      for chunk in unwritten)
+            self._write_error = failure
+            return failure
+
+        d = defer.maybeDeferred(self._io, write)
+        d.addBoth(written)
+        d.addCallbacks(notify, failed)
+        return d
+
+    def _notifyData(self):
+        """Tell listening contexts that rows were written."""
         self.hub.onDataAvailable(None, self.listeners)
         self.listeners = set()
+        for context, listener in self.push_listeners.items():
+            self._push(context, listener)
+
+    def isGrid(self):
+        return isinstance(self.data, backend.GridHDF5Data)
+
+    def _gridData(self):
+        if not self.isGrid():
+            raise errors.GridDataError('not a grid dataset')
+        return self.data
+
+    def getAxes(self):
+        """Get (label, unit, values) for each axis of a grid dataset."""
+        grid = self._gridData()
+        def read():
+            return [(i.label, i.unit, values) for i, values
+                    in zip(grid.getIndependents(), grid.getAxisValues())]
+        return util.sync_result(self._io(read))
+
+    def writeSlab(self, offset, data, axis_values=None):
+        """Write a block of values into a grid dataset, in the I/O executor.
+
+        See backend.GridHDF5Data.writeSlab.  Listeners are notified once the
+        block is written, as when rows are added, since the row view of the
+        grid may have grown.  Returns a Deferred.
+        """
+        grid = self._gridData()
+        def write():
+            grid.writeSlab(offset, data, axis_values)
+            return len(grid)
+        def notify(rows):
+            self._rows = rows
+            self._stats_cache.clear() # written points may have changed
+            self._notifyData()
+        d = self._io(write)
+        d.addCallback(notify)
+        return d
+
+    def readSlice(self, slices, dependents=None):
+        """Read a block of a grid dataset in the I/O executor.
+
+        See backend.GridHDF5Data.getSlice.  Returns a Deferred.
+        """
+        return self._io(self._gridData().getSlice, slices, dependents)
+
+    def addPushListener(self, context, listener):
+        """Push new rows to context instead of notifying it."""
+        self.listeners.discard(context)
+        self.push_listeners[context] = listener
+        self.keepStreaming(context, listener.pos)
+
+    def removePushListener(self, context):
+        self.push_listeners.pop(context, None)
+
+    def _push(self, context, listener):
+        """Push rows from listener.pos to the end to a context.
+
+        If there are more rows than the listener takes in one push, or
+        they cannot be read, the context is notified that data is available
+        instead.
+        """
+        if self._buffer or self._writing_rows:
+            self._startFlush() # which pushes to all listeners once written
+            return
+        if listener.reading:
+            return # pushed again once the read finishes
+        start = listener.pos
+        count = self._rows - start
+        if count <= 0:
+            return
+        if count > listener.max_rows:
+            self.hub.onDataAvailable(None, [context])
+            return
+        listener.reading = True
+        d = defer.maybeDeferred(self._io, self.data.getData, count, start,
+                                False, True, listener.columns)
+        def send((rows, pos)):
+            listener.reading = False
+            if self.push_listeners.get(context) is not listener:
+                return # pushing stopped during the read
+            if listener.pos == start: # else the context read them with get
+                listener.pos = start + count
+                if listener.advance is not None:
+                    listener.advance(listener.pos)
+                self.hub.onDataPushed((start, rows), [context])
+            self._push(context, listener) # rows written during the read
+        def failed(failure):
+            # the context reads the rows itself, and sees the error then
+            listener.reading = False
+            self.hub.onDataAvailable(None, [context])
+        d.addCallbacks(send, failed)
+
+    def hasMore(self, pos):
+        """Check whether there is data at or after pos, including buffered rows."""
+        return pos < self.numRows()
+
+    def _flushForRead(self, limit, start):
+        """Flush buffered rows if a read of limit rows from start needs them."""
+        if not self._buffer or self._inIO():
+            return
+        if limit is not None and (
+                limit == 0 or start + limit <= self._rows + self._writing_rows):
+            return # the read can be served entirely from the backend
+        self._startFlush()
+
+    def getData(self, limit, start, transpose=False, simpleOnly=False,
+                columns=None):
+        """Get up to limit rows from start.
+
+        columns optionally selects the columns to return, by index.
+        """
+        self._flushForRead(limit, start)
+        self._checkWriteError()
+        return self.data.getData(limit, start, transpose, simpleOnly, columns)
+
+    def readData(self, limit, start, transpose=False, simpleOnly=False,
+                 columns=None):
+        """Get up to limit rows from start, reading in the I/O executor.
+
+        Like getData, but returns a Deferred.
+        """
+        self._flushForRead(limit, start)
+        self._checkWriteError()
+        return self._io(self.data.getData, limit, start, transpose,
+                        simpleOnly, columns)
 
-    def getData(self, limit, start, transpose=False, simpleOnly=False):
-        return self.data.getData(limit, start, transpose, simpleOnly)
+    def findColumn(self, column):
+        """Get the index of a column given by index, label or legend.
+
+        Labels of independent variables are matched first, then legends and
+        labels of dependent variables.
+        """
+        indep = self.getIndependents()
+        dep = self.getDependents()
+        if isinstance(column, (int, long)):
+            if 0 <= column < len(indep) + len(dep):
+                return column
+        else:
+            names = ([(i, v.label) for i, v in enumerate(indep)] +
+                     [(len(indep) + i, v.legend) for i, v in enumerate(dep)] +
+                     [(len(indep) + i, v.label) for i, v in enumerate(dep)])
+            for idx, name in names:
+                if name == column:
+                    return idx
+        raise errors.ColumnNotFoundError(column)
+
+    def findRange(self, column, lo, hi):
+        """Find the rows whose value in a sorted column is in [lo, hi].
+
+        Returns (start, stop) row positions.  Only HDF5 datasets are supported.
+        """
+        if not hasattr(self.data, 'findRange'):
+            raise errors.RangeQueryError(
+                    'Range queries are only supported for HDF5 datasets.')
+        self._startFlush()
+        return self.data.findRange(column, lo, hi)
+
+    def _columnValues(self, column, start, stop):
+        """Yield the values of a column from start to stop, in chunks."""
+        transpose = isinstance(self.data, backend.ExtendedHDF5Data)
+        pos = start
+        while pos < stop:
+            data, newpos = self.getData(min(STATS_CHUNK_ROWS, stop - pos), pos,
+                                        transpose=transpose, columns=[column])
+            if newpos == pos:
+                break
+            values = np.asarray(data[0] if transpose else np.asarray(data)[:, 0])
+            if values.dtype.kind not in 'biuf' or values.ndim != 1:
+                raise errors.ColumnTypeError(column)
+            yield values.astype(float)
+            pos = newpos
+
+    def _aggregate(self, key, params, column, start, stop, make, update):
+        """Compute an aggregate of a column over rows from start to stop.
+
+        make creates an empty accumulator and update adds a chunk of values
+        to it.  Aggregates that run to the end of the dataset (stop is None)
+        are cached under key along with the number of rows they cover, so
+        that later calls only process rows added since.  A cached aggregate
+        computed with different params is started over.
+        """
+        nrows = self.numRows()
+        if stop is not None:
+            acc = make()
+            for values in self._columnValues(column, start, min(stop, nrows)):
+                update(acc, values)
+            return acc
+        covered, cached_params, acc = self._stats_cache.get(key, (start, None, None))
+        if acc is None or cached_params != params:
+            covered, acc = start, make()
+        for values in self._columnValues(column, covered, nrows):
+            update(acc, values)
+        self._stats_cache[key] = (max(covered, nrows), params, acc)
+        return acc
+
+    def getStatistics(self, column, start=0, stop=None):
+        """Get (count, mean, std, min, max) of a column over a row range."""
+        acc = self._aggregate(('stats', column, start), None, column, start,
+                              stop, util.RunningStats, util.RunningStats.update)
+        return acc.result()
+
+    def getHistogram(self, column, bins, low=None, high=None, start=0,
+                     stop=None):
+        """Get (edges, counts) of a histogram of a column over a row range.
+
+        The bins are evenly spaced from low to high, which default to the
+        minimum and maximum of the column over the range.  NaNs and values
+        outside [low, high] are not counted.
+        """
+        if low is None or high is None:
+            count, _, _, lo, hi = self.getStatistics(column, start, stop)
+            if not count:
+                lo, hi = 0.0, 1.0
+            elif lo == hi:
+                lo, hi = lo - 0.5, hi + 0.5
+            low = lo if low is None else low
+            high = hi if high is None else high
+        edges = np.linspace(low, high, bins + 1)
+        def update(counts, values):
+            counts += np.histogram(values[~np.isnan(values)], edges)[0]
+        counts = self._aggregate(('histogram', column, start, bins),
+                                 (low, high), column, start, stop,
+                                 lambda: np.zeros(bins, dtype=int), update)
+        return edges, counts.copy()
+
+    def numRows(self):
+        """Get the number of rows in the dataset, including buffered rows.
+
+        In an I/O call, only rows that have been written are counted.
+        """
+        if self._inIO():
+            return len(self.data)
+        return self._rows + self._writing_rows + self._buffer_rows
+
+    def getDecimated(self, points, method, start, columns=None):
+        """Get the rows from start on, reduced for plotting.
+
+        The bin size is chosen so that the whole dataset would reduce to
+        about the given number of points (see util.decimate for the methods).
+        Bins start at start, so a client can fetch just the reduced tail of
+        a growing dataset; the bin size grows with the dataset.  Rows are
+        read in chunks of whole bins to bound memory use.
+        """
+        nrows = self.numRows()
+        if method == 'minmax':
+            points = points // 2 # two rows per bin
+        binsize = max(1, -(-nrows // max(points, 1)))
+        chunk = binsize * max(1, DECIMATE_CHUNK_ROWS // binsize)
+        if columns is None:
+            ncols = len(self.getIndependents()) + len(self.getDependents())
+        else:
+            ncols = len(columns)
+        parts = [np.zeros((0, ncols))]
+        pos = start
+        while pos < nrows:
+            data, newpos = self.getData(min(chunk, nrows - pos), pos,
+                                        simpleOnly=True, columns=columns)
+            if newpos == pos:
+                break
+            parts.append(util.decimate(data, binsize, method))
+            pos = newpos
+        return np.concatenate(parts), pos
 
     def keepStreaming(self, context, pos):
         # keepStreaming does something a bit odd and has a confusing name (ERJ)
@@ -445,7 +1316,16 @@ class Dataset(object):
         # 
         # If a client reads, but not to the end of the dataset, it is immediately notified that
         # there is more data for it to read, and then removed from the set of notifiers.
-        if self.data.hasMore(pos):
+        #
+        # Clients that have rows pushed to them (see addPushListener) instead get any rows
+        # after pos pushed right away, and the rest as they are added.
+        if context in self.push_listeners:
+            listener = self.push_listeners[context]
+            listener.pos = pos
+            if self.hasMore(pos):
+                self._push(context, listener)
+            return
+        if self.hasMore(pos):
             if context in self.listeners:
                 self.listeners.remove(context)
             self.hub.onDataAvailable(None, [context])
@@ -453,21 +1333,29 @@ class Dataset(object):
             self.listeners.add(context)
 
     def addComment(self, user, comment):
-        self.data.addComment(user, comment)
-        self.save()
-
-        # notify all listening contexts
-        self.hub.onCommentsAvailable(None, self.comment_listeners)
-        self.comment_listeners = set()
+        def write():
+            self.data.addComment(user, comment)
+            self.save()
+        def added(_):
+            # notify all listening contexts
+            self.hub.onCommentsAvailable(None, self.comment_listeners)
+            self.comment_listeners = set()
+        d = self._io(write)
+        d.addCallback(added)
+        return util.sync_result(d)
 
     def getComments(self, limit, start):
-        return self.data.getComments(limit, start)
+        return util.sync_result(self._io(self.data.getComments, limit, start))
 
     def keepStreamingComments(self, context, pos):
-        if pos < self.data.numComments():
-            if context in self.comment_listeners:
-                self.comment_listeners.remove(context)
-            self.hub.onCommentsAvailable(None, [context])
-        else:
-            self.comment_listeners.add(context)
+        def check(count):
+            if pos < count:
+                if context in self.comment_listeners:
+                    self.comment_listeners.remove(context)
+                self.hub.onCommentsAvailable(None, [context])
+            else:
+                self.comment_listeners.add(context)
+        d = self._io(self.data.numComments)
+        d.addCallback(check)
+        return util.sync_result(d)
 
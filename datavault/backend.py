@@ -1,13 +1,23 @@
 import base64
 import collections
+import contextlib
 import datetime
+import errno
 import os
 import re
+import struct
 import sys
+import threading
 import time
+import weakref
 
 import h5py
-from twisted.internet import reactor
+from twisted.internet import reactor, task
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # not on Windows, where binary datasets are not locked
 
 try:
     import numpy as np
@@ -25,12 +35,59 @@ from . import errors, util
 
 Independent = collections.namedtuple('Independent', ['label', 'shape', 'datatype', 'unit'])
 Dependent = collections.namedtuple('Dependent', ['label', 'legend', 'shape', 'datatype', 'unit'])
+# The columns of an HDF5 dataset, which do not change once it is created.
+# row_type and transpose_type are the labrad type tags of a row and of the
+# columns (see HDF5MetaData.getRowType and getTransposeType).
+ColumnInfo = collections.namedtuple('ColumnInfo',
+    ['independents', 'dependents', 'row_type', 'transpose_type'])
+# An axis of a grid dataset (see GridHDF5Data).  values are the coordinates
+# along the axis, or empty for a first axis that grows as data is written.
+Axis = collections.namedtuple('Axis', ['label', 'unit', 'values'])
+
+# How the rows of a new HDF5 dataset are laid out on disk.
+#
+# chunk_rows:       rows per HDF5 chunk, or None to let h5py choose.
+# compression:      None, 'gzip' or 'lzf'.
+# compression_opts: gzip level (0-9); ignored for other filters.
+# shuffle:          apply the byte-shuffle filter before compression.
+# growth:           factor by which the allocated size grows when an append
+#                   does not fit.  1.0 allocates exactly the rows added.
+# format:           'hdf5', or 'binary' to store simple (non-extended)
+#                   datasets in the version 4 format of BinaryData, in which
+#                   case the other entries do not apply.
+# swmr:             write HDF5 files in single-writer/multiple-reader mode,
+#                   so that other processes can read them while they are
+#                   written (see HDF5Data).  growth does not apply.
+StoragePolicy = collections.namedtuple('StoragePolicy',
+    ['chunk_rows', 'compression', 'compression_opts', 'shuffle', 'growth',
+     'format', 'swmr'])
+
+DEFAULT_STORAGE_POLICY = StoragePolicy(chunk_rows=None, compression=None,
+                                       compression_opts=None, shuffle=False,
+                                       growth=1.0, format='hdf5', swmr=False)
 
 TIME_FORMAT = '%Y-%m-%d, %H:%M:%S'
 PRECISION = 12 # digits of precision to use when saving data
 DATA_FORMAT = '%%.%dG' % PRECISION
 FILE_TIMEOUT_SEC = 60 # how long to keep datafiles open if not accessed
+MAX_OPEN_FILES = 256 # default limit on open datafiles; see FilePool
+FILE_SWEEP_INTERVAL = 1.0 # seconds between sweeps for idle datafiles
+FILE_EVICT_MIN_IDLE = 1.0 # don't evict datafiles used more recently than this
 DATA_TIMEOUT = 300 # how long to keep data in memory if not accessed
+CSV_CACHE_BYTES = 1 << 30 # default memory budget for csv data; see DataCache
+DATA_SWEEP_INTERVAL = 1.0 # seconds between sweeps for idle in-memory data
+DATA_EVICT_MIN_IDLE = 1.0 # don't evict data used more recently than this
+CSV_BLOCK_SIZE = 4 << 20 # bytes of csv data to read and parse at a time
+CSV_INDEX_STRIDE = 1024 # rows between entries in the csv row index
+RANGE_INDEX_STRIDE = 1024 # rows between samples in an HDF5 range index
+RANGE_INDEX_CHUNK = 1 << 18 # rows read at a time when building a range index
+BINARY_EXTENSION = '.dvb' # data file of version 4 datasets; see BinaryData
+BINARY_MAGIC = 'DVBINARY'
+BINARY_HEADER = struct.Struct('<8s3iIQ') # magic, version, columns, row count
+BINARY_ROW_COUNT = struct.Struct('<Q') # the row count, at the end of the header
+BINARY_HEADER_SIZE = 64 # bytes before the first row
+BINARY_CHECKPOINT_ROWS = 10000 # rows between checkpoints of the row count
+COMPACT_CHUNK_ROWS = 1 << 16 # rows copied at a time by compact_binary
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
 
 def time_to_str(t):
@@ -62,38 +119,366 @@ def labrad_urldecode(data_url):
         raise ValueError("Trying to labrad_urldecode data that doesn't start "
                          "with prefix: {}".format(DATA_URL_PREFIX))
 
+def parse_storage_policy(spec, default=DEFAULT_STORAGE_POLICY):
+    """Parse a storage policy from a string like 'chunk=1024, gzip=4, shuffle'.
+
+    Recognized entries are:
+        chunk=N         rows per chunk ('auto' lets h5py choose)
+        compression=X   'gzip', 'lzf' or 'none'
+        gzip[=L]        shorthand for compression=gzip with level L
+        lzf             shorthand for compression=lzf
+        shuffle[=B]     enable (or disable) the shuffle filter
+        growth=G        geometric over-allocation factor, at least 1
+        format=F        'hdf5' or 'binary' (see BinaryData)
+        swmr[=B]        write HDF5 files in SWMR mode (requires HDF5 1.10)
+    Entries that are not given are taken from default.
+    """
+    policy = default
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, _, value = item.partition('=')
+        key = key.strip().lower()
+        value = value.strip()
+        try:
+            if key == 'chunk':
+                rows = None if value.lower() in ('', 'auto') else int(value)
+                if rows is not None and rows < 1:
+                    raise ValueError(value)
+                policy = policy._replace(chunk_rows=rows)
+            elif key == 'compression':
+                value = value.lower()
+                if value in ('', 'none'):
+                    policy = policy._replace(compression=None, compression_opts=None)
+                elif value in ('gzip', 'lzf'):
+                    policy = policy._replace(compression=value)
+                else:
+                    raise ValueError(value)
+            elif key == 'gzip':
+                level = int(value) if value else None
+                if level is not None and not 0 <= level <= 9:
+                    raise ValueError(value)
+                policy = policy._replace(compression='gzip', compression_opts=level)
+            elif key == 'lzf':
+                policy = policy._replace(compression='lzf', compression_opts=None)
+            elif key == 'shuffle':
+                flag = value.lower() not in ('0', 'false', 'no', 'off')
+                policy = policy._replace(shuffle=flag)
+            elif key == 'growth':
+                growth = float(value)
+                if growth < 1:
+                    raise ValueError(value)
+                policy = policy._replace(growth=growth)
+            elif key == 'format':
+                value = value.lower()
+                if value not in ('hdf5', 'binary'):
+                    raise ValueError(value)
+                policy = policy._replace(format=value)
+            elif key == 'swmr':
+                flag = value.lower() not in ('0', 'false', 'no', 'off')
+                if flag and h5py.version.hdf5_version_tuple < (1, 10):
+                    raise ValueError('SWMR requires HDF5 1.10')
+                policy = policy._replace(swmr=flag)
+            else:
+                raise ValueError("Unknown storage option '{}'".format(key))
+        except ValueError:
+            raise ValueError("Invalid storage policy entry '{}'".format(item))
+    return policy
+
+class FilePool(object):
+    """Keeps track of the open SelfClosingFiles, and limits their number.
+
+    Open files are kept in order of last access.  When more than max_open
+    files are open, the least recently used ones are closed.  A single
+    periodic sweep closes files that have not been accessed within their
+    timeout.  Files pinned by an I/O job (see pin_files) are never closed
+    by the pool, and files accessed within the last FILE_EVICT_MIN_IDLE
+    seconds are not evicted; the limit can then be exceeded until the next
+    sweep.  OpenFiles, which stay open, count against the limit too.
+
+    Files may be accessed from any thread.  Use get_file_pool to get the
+    pool shared by all files that use the same reactor.
+    """
+    def __init__(self, max_open=MAX_OPEN_FILES,
+                 sweep_interval=FILE_SWEEP_INTERVAL, reactor=reactor):
+        self.max_open = max_open
+        self.reactor = reactor
+        self._open = collections.OrderedDict() # file -> time of last access
+        self._kept = weakref.WeakSet() # OpenFiles, which the pool can't close
+        self._lock = threading.RLock()
+        self.hits = 0 # accesses to files that were open
+        self.misses = 0 # accesses that had to open the file
+        self.evictions = 0 # files closed to stay within max_open
+        self.expirations = 0 # files closed after their timeout
+        self.sweep_interval = sweep_interval
+        self._sweeper = task.LoopingCall(self.sweep)
+        self._sweeper.clock = reactor
+        self.start()
+
+    def access(self, f):
+        """Get the open file object of SelfClosingFile f, opening it if needed."""
+        with self._lock:
+            now = self.reactor.seconds()
+            if f._file is not None:
+                self.hits += 1
+                del self._open[f]
+                self._open[f] = now
+                self._pin(f)
+                return f._file
+            self.misses += 1
+            f._file = f.opener(*f.open_args, **f.open_kw)
+            self._open[f] = now
+            self._pin(f)
+            self._evict(now)
+            return f._file
+
+    def _pin(self, f):
+        files = getattr(_pinned, 'files', None)
+        if files is not None and f not in files:
+            files.append(f)
+            f.pins += 1
+
+    def keep(self, f):
+        """Count OpenFile f, which stays open, against max_open."""
+        with self._lock:
+            self._kept.add(f)
+            self._evict(self.reactor.seconds())
+
+    def forget(self, f):
+        """Stop counting OpenFile f, once it is closed."""
+        with self._lock:
+            self._kept.discard(f)
+
+    def unpin(self, f):
+        """Release a pin on SelfClosingFile f taken by an I/O job."""
+        with self._lock:
+            f.pins -= 1
+
+    def close(self, f):
+        """Close SelfClosingFile f if it is open."""
+        with self._lock:
+            if f._file is not None:
+                self._close(f)
+
+    def close_all(self):
+        """Close all open files, except those pinned by I/O jobs."""
+        with self._lock:
+            for f in self._open.keys():
+                if not f.pins:
+                    self._close(f)
+
+    def _close(self, f):
+        del self._open[f]
+        try:
+            for callback in f.callbacks:
+                callback(f)
+        finally:
+            f._file.close()
+            f._file = None
+
+    def _evict(self, now):
+        for f, last in self._open.items():
+            if (len(self._open) + len(self._kept) <= self.max_open or
+                    now - last < FILE_EVICT_MIN_IDLE):
+                break
+            if not f.pins:
+                self._close(f)
+                self.evictions += 1
+
+    def sweep(self):
+        """Close files that have timed out, or that are over the limit."""
+        with self._lock:
+            now = self.reactor.seconds()
+            for f, last in self._open.items():
+                if now - last >= f.timeout and not f.pins:
+                    self._close(f)
+                    self.expirations += 1
+            self._evict(now)
+
+    def start(self):
+        """Start the periodic sweep, if it is not running."""
+        if not self._sweeper.running:
+            self._sweeper.start(self.sweep_interval, now=False)
+
+    def stop(self):
+        """Stop the periodic sweep.  Open files are left open."""
+        if self._sweeper.running:
+            self._sweeper.stop()
+
+    def stats(self):
+        """Get (open, max_open, hits, misses, evictions, expirations)."""
+        with self._lock:
+            return (len(self._open) + len(self._kept), self.max_open,
+                    self.hits, self.misses, self.evictions, self.expirations)
+
+_file_pools = weakref.WeakKeyDictionary()
+
+_pinned = threading.local() # files pinned by the I/O job of each thread
+
+@contextlib.contextmanager
+def pin_files():
+    """Keep the files accessed in this thread open until the block ends.
+
+    I/O jobs run in this block, since they may hold on to h5py objects or
+    file objects while other threads access other files.  Blocks may be
+    nested; the files are released when the outermost one ends.
+    """
+    if getattr(_pinned, 'files', None) is not None:
+        yield
+        return
+    files = _pinned.files = []
+    try:
+        yield
+    finally:
+        _pinned.files = None
+        for f in files:
+            f.pool.unpin(f)
+
+def get_file_pool(reactor=reactor):
+    """Get the FilePool for files whose timeouts run on the given reactor."""
+    pool = _file_pools.get(reactor)
+    if pool is None:
+        pool = _file_pools[reactor] = FilePool(reactor=reactor)
+    return pool
+
+class DataCache(object):
+    """Keeps track of the csv datasets held in memory, and limits their size.
+
+    Owners of in-memory data report each access, along with the number of
+    bytes they hold, and are kept in order of last access.  When the total
+    exceeds max_bytes, the data of the least recently used owners is
+    dropped by calling their _drop_data method.  A single periodic sweep
+    drops data that has not been accessed within its owner's timeout.  As
+    in FilePool, data accessed within the last DATA_EVICT_MIN_IDLE seconds
+    is not evicted, so the budget can be exceeded until the next sweep.
+
+    Use get_data_cache to get the cache shared by all datasets that use the
+    same reactor.
+    """
+    def __init__(self, max_bytes=CSV_CACHE_BYTES,
+                 sweep_interval=DATA_SWEEP_INTERVAL, reactor=reactor):
+        self.max_bytes = max_bytes
+        self.reactor = reactor
+        self._entries = collections.OrderedDict() # owner -> (bytes, last access)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0 # accesses to data that was in memory
+        self.misses = 0 # accesses that had to load the data
+        self.evictions = 0 # datasets dropped to stay within max_bytes
+        self.expirations = 0 # datasets dropped after their timeout
+        self.sweep_interval = sweep_interval
+        self._sweeper = task.LoopingCall(self.sweep)
+        self._sweeper.clock = reactor
+        self.start()
+
+    def access(self, owner, nbytes):
+        """Record an access to the data of owner, which holds nbytes."""
+        with self._lock:
+            if owner in self._entries:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._set(owner, nbytes)
+            self._evict(self.reactor.seconds())
+
+    def resize(self, owner, nbytes):
+        """Record that the data of owner has grown or shrunk to nbytes."""
+        with self._lock:
+            if owner in self._entries:
+                self._set(owner, nbytes)
+                self._evict(self.reactor.seconds())
+
+    def discard(self, owner):
+        """Forget the data of owner, without dropping it."""
+        with self._lock:
+            if owner in self._entries:
+                self._bytes -= self._entries.pop(owner)[0]
+
+    def _set(self, owner, nbytes):
+        self.discard(owner)
+        self._entries[owner] = (nbytes, self.reactor.seconds())
+        self._bytes += nbytes
+
+    def _drop(self, owner):
+        self.discard(owner)
+        owner._drop_data()
+
+    def _evict(self, now):
+        for owner, (nbytes, last) in self._entries.items():
+            if (self._bytes <= self.max_bytes or
+                    now - last < DATA_EVICT_MIN_IDLE):
+                break
+            self._drop(owner)
+            self.evictions += 1
+
+    def sweep(self):
+        """Drop data that has timed out, or that is over the budget."""
+        with self._lock:
+            now = self.reactor.seconds()
+            for owner, (nbytes, last) in self._entries.items():
+                if now - last >= owner.timeout:
+                    self._drop(owner)
+                    self.expirations += 1
+            self._evict(now)
+
+    def start(self):
+        """Start the periodic sweep, if it is not running."""
+        if not self._sweeper.running:
+            self._sweeper.start(self.sweep_interval, now=False)
+
+    def stop(self):
+        """Stop the periodic sweep.  Data in memory is kept."""
+        if self._sweeper.running:
+            self._sweeper.stop()
+
+    def stats(self):
+        """Get (datasets, bytes, max_bytes, hits, misses, evictions, expirations)."""
+        with self._lock:
+            return (len(self._entries), self._bytes, self.max_bytes,
+                    self.hits, self.misses, self.evictions, self.expirations)
+
+_data_caches = weakref.WeakKeyDictionary()
+
+def get_data_cache(reactor=reactor):
+    """Get the DataCache for data whose timeouts run on the given reactor."""
+    cache = _data_caches.get(reactor)
+    if cache is None:
+        cache = _data_caches[reactor] = DataCache(reactor=reactor)
+    return cache
+
+def list_nbytes(rows, ncols):
+    """Estimate the memory used by a list of ncols-long lists of floats."""
+    row_bytes = sys.getsizeof([]) + ncols * (8 + sys.getsizeof(0.0))
+    return sys.getsizeof(rows) + len(rows) * row_bytes
+
 class SelfClosingFile(object):
     """A container for a file object that manages the underlying file handle.
 
     The file will be opened on demand when this container is called, then
-    closed automatically if not accessed within a specified timeout.
+    closed automatically if not accessed within a specified timeout, or
+    sooner if too many files are open.  By default, the file belongs to the
+    shared FilePool for the reactor.
     """
     def __init__(self, opener=open, open_args=(), open_kw={},
-                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor):
+                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor,
+                 pool=None):
         self.opener = opener
         self.open_args = open_args
         self.open_kw = open_kw
         self.timeout = timeout
         self.callbacks = []
-        self.reactor = reactor
+        self.pool = pool if pool is not None else get_file_pool(reactor)
+        self.pins = 0 # I/O jobs using the open file; see pin_files
+        self._file = None
         if touch:
             self.__call__()
 
     def __call__(self):
-        if not hasattr(self, '_file'):
-            self._file = self.opener(*self.open_args, **self.open_kw)
-            self._fileTimeoutCall = self.reactor.callLater(
-                    self.timeout, self._fileTimeout)
-        else:
-            self._fileTimeoutCall.reset(self.timeout)
-        return self._file
+        return self.pool.access(self)
 
-    def _fileTimeout(self):
-        for callback in self.callbacks:
-            callback(self)
-        self._file.close()
-        del self._file
-        del self._fileTimeoutCall
+    def close(self):
+        self.pool.close(self)
 
     def size(self):
         return os.fstat(self().fileno()).st_size
@@ -102,6 +487,27 @@ class SelfClosingFile(object):
         """Calls callback *before* the file is closes."""
         self.callbacks.append(callback)
 
+class OpenFile(object):
+    """Stands in for a SelfClosingFile for a file that is kept open.
+
+    HDF5 files in SWMR mode are kept open for as long as the backend exists,
+    because while readers have such a file open, HDF5 locks it against
+    being opened again for writing.  The file counts against the limit of
+    the FilePool until it is closed.
+    """
+    def __init__(self, fh, swmr=False, reactor=reactor, pool=None):
+        self.fh = fh
+        self.swmr = swmr # whether the file is in SWMR mode
+        self.pool = pool if pool is not None else get_file_pool(reactor)
+        self.pool.keep(self)
+
+    def __call__(self):
+        return self.fh
+
+    def close(self):
+        self.fh.close()
+        self.pool.forget(self)
+
 class IniData(object):
     """Handles dataset metadata stored in INI files.
 
@@ -237,6 +643,13 @@ class IniData(object):
     def access(self):
         self.accessed = datetime.datetime.now()
 
+    def getTitle(self):
+        return self.title
+
+    def getCreationTime(self):
+        """Get the creation time in seconds since the epoch."""
+        return time.mktime(self.created.timetuple())
+
     def getIndependents(self):
         return self.independents
 
@@ -294,8 +707,14 @@ class CsvListData(IniData):
     """Data backed by a csv-formatted file.
 
     Stores the entire contents of the file in memory as a list or numpy array
+
+    Until rows are appended through this object, the end of the file also
+    ends the last row, as legacy files may lack a final line break.  Once
+    appending, a partial last line is left to be completed.
     """
 
+    appending = False # whether rows have been appended through this object
+
     def __init__(self,
                  filename,
                  file_timeout=FILE_TIMEOUT_SEC,
@@ -308,6 +727,7 @@ class CsvListData(IniData):
         self.timeout = data_timeout
         self.infofile = filename[:-4] + '.ini'
         self.reactor = reactor
+        self._cache = get_data_cache(reactor)
 
     @property
     def file(self):
@@ -321,25 +741,53 @@ class CsvListData(IniData):
     def data(self):
         """Read data from file on demand.
 
-        The data is scheduled to be cleared from memory unless accessed."""
+        The data is dropped from memory if not accessed, or to stay within
+        the budget of the DataCache."""
         if not hasattr(self, '_data'):
             self._data = []
             self._datapos = 0
-            self._timeout_call = self.reactor.callLater(self.timeout,
-                                                        self._on_timeout)
-        else:
-            self._timeout_call.reset(DATA_TIMEOUT)
+        data = self._data
         f = self.file
         f.seek(self._datapos)
-        lines = f.readlines()
-        self._data.extend([float(n) for n in line.split(',')] for line in lines)
-        self._datapos = f.tell()
-        return self._data
+        text = f.read()
+        # only parse complete lines; a partial last line is left for later
+        # if we are appending
+        end = text.rfind('\n') + 1
+        if not self.appending and text[end:].strip():
+            end = len(text)
+        if end:
+            data.extend(util.parse_csv(text[:end]).tolist())
+            self._datapos += end
+        ncols = len(data[0]) if data else 0
+        self._cache.access(self, list_nbytes(data, ncols))
+        return data
 
-    def _on_timeout(self):
+    def _drop_data(self):
         del self._data
         del self._datapos
-        del self._timeout_call
+
+    def _start_appending(self):
+        """Get ready to append rows, ending the last line if it is partial.
+
+        Returns the size of the file before the line was ended, or None.
+        """
+        if self.appending:
+            return None
+        self.appending = True
+        f = self.file
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if not size:
+            return None
+        f.seek(size - 1)
+        if f.read(1) == '\n':
+            return None
+        f.seek(0, os.SEEK_END)
+        f.write('\r\n')
+        f.flush()
+        if getattr(self, '_datapos', None) == size:
+            self._datapos += 2 # the last row was already read
+        return size
 
     def _saveData(self, data):
         f = self.file
@@ -355,75 +803,216 @@ class CsvListData(IniData):
             raise errors.BadDataError(self.cols, len(data[0]))
 
         # append the data to the file
+        self._start_appending()
         self._saveData(data)
 
-    def getData(self, limit, start, transpose, simpleOnly):
+    def getData(self, limit, start, transpose, simpleOnly, columns=None):
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
         if limit is None:
             data = self.data[start:]
         else:
             data = self.data[start:start+limit]
+        if columns is not None:
+            data = [[row[i] for i in columns] for row in data]
         return data, start + len(data)
 
+    def __len__(self):
+        return len(self.data)
+
     def hasMore(self, pos):
         return pos < len(self.data)
 
+class CsvRowIndex(object):
+    """Sparse index of row positions in a csv data file.
+
+    offsets[k] is the byte offset in the data file at which row k*stride
+    starts.  The index covers the first nrows rows of the file, which end
+    at byte nbytes; rows appended after that are indexed on the next call
+    to update.  The index is persisted in a small sidecar file next to the
+    data so that later opens can seek straight to a given row.
+    """
+    VERSION = 1
+
+    def __init__(self, filename, stride=CSV_INDEX_STRIDE):
+        self.filename = filename
+        self.stride = stride
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.offsets = np.zeros((0,), dtype=np.int64)
+        self.nrows = 0
+        self.nbytes = 0
+        self.dirty = False
+
+    def load(self):
+        """Load the index from the sidecar file, if there is a valid one."""
+        if not os.path.exists(self.filename):
+            return
+        raw = np.fromfile(self.filename, dtype='<i8')
+        if len(raw) < 4 or raw[0] != self.VERSION or raw[1] != self.stride:
+            return
+        nrows, nbytes, offsets = int(raw[2]), int(raw[3]), raw[4:]
+        if len(offsets) != (nrows + self.stride - 1) // self.stride:
+            return
+        self.nrows, self.nbytes, self.offsets = nrows, nbytes, offsets
+
+    def save(self):
+        header = np.array([self.VERSION, self.stride, self.nrows, self.nbytes],
+                          dtype='<i8')
+        np.concatenate((header, self.offsets)).astype('<i8').tofile(self.filename)
+        self.dirty = False
+
+    def update(self, f, size, final=False):
+        """Index the rows in file f past those already indexed.
+
+        size is the current size of the file.  A partial line at the end of
+        the file is not indexed, unless final is true; then the end of the
+        file ends the line, as for a file that is not being appended to.
+        """
+        if size < self.nbytes:
+            # the file has been truncated or replaced
+            self.reset()
+        pos = self.nbytes
+        new_offsets = []
+        while pos < size:
+            f.seek(pos)
+            block = f.read(min(CSV_BLOCK_SIZE, size - pos))
+            ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            if not len(ends):
+                break
+            starts = pos + np.concatenate(([0], ends[:-1] + 1))
+            rows = self.nrows + np.arange(len(starts))
+            new_offsets.append(starts[rows % self.stride == 0])
+            self.nrows += len(starts)
+            pos += int(ends[-1]) + 1
+        if final and pos < size:
+            f.seek(pos)
+            if f.read(size - pos).strip():
+                if self.nrows % self.stride == 0:
+                    new_offsets.append(np.array([pos], dtype=np.int64))
+                self.nrows += 1
+                pos = size
+        if pos != self.nbytes:
+            self.offsets = np.concatenate([self.offsets] + new_offsets).astype(np.int64)
+            self.nbytes = pos
+            self.dirty = True
+
+    def byte_range(self, start, stop):
+        """Find the bytes holding rows start through stop-1.
+
+        Returns (first_row, begin, end), where the bytes from begin up to end
+        hold rows first_row <= start up to at least row stop-1.
+        """
+        k = start // self.stride
+        k_end = (stop + self.stride - 1) // self.stride
+        end = int(self.offsets[k_end]) if k_end < len(self.offsets) else self.nbytes
+        return k * self.stride, int(self.offsets[k]), end
+
 class CsvNumpyData(CsvListData):
     """Data backed by a csv-formatted file.
 
-    Stores the entire contents of the file in memory as a list or numpy array
+    Stores the entire contents of the file in memory as a numpy array.  The
+    array is allocated with spare capacity that doubles when it fills up, so
+    that appending rows takes amortized constant time.  self._data is this
+    buffer; only the first self._nrows rows of it hold data.
+
+    The file is parsed in large blocks with numpy, and a CsvRowIndex kept in
+    a sidecar file records where rows start, so that reads of a range of
+    rows when the data is not in memory only parse the rows requested.
     """
 
-    def __init__(self, filename, reactor=reactor):
+    def __init__(self, filename, data_timeout=DATA_TIMEOUT, reactor=reactor):
         self.filename = filename
         self._file = SelfClosingFile(open_args=(filename, 'a+'), reactor=reactor)
+        self.timeout = data_timeout
         self.infofile = filename[:-4] + '.ini'
+        self.index = CsvRowIndex(filename + '.idx')
         self.reactor = reactor
+        self._cache = get_data_cache(reactor)
 
     @property
     def file(self):
         return self._file()
 
+    def _update_index(self):
+        """Bring the row index up to date with the file."""
+        self.index.update(self.file, self._file.size(),
+                          final=not self.appending)
+        if self.index.dirty:
+            self.index.save()
+
+    def _read_rows(self, start, stop):
+        """Parse rows start through stop-1 from the file into a 2-D array.
+
+        The row index must be up to date.
+        """
+        ncols = getattr(self, 'cols', None)
+        stop = min(stop, self.index.nrows)
+        if start >= stop:
+            return np.zeros((0, ncols or 0))
+        first_row, pos, end = self.index.byte_range(start, stop)
+        f = self.file
+        chunks = []
+        remainder = ''
+        while pos < end:
+            f.seek(pos)
+            block = remainder + f.read(min(CSV_BLOCK_SIZE, end - pos))
+            pos += len(block) - len(remainder)
+            cut = block.rfind('\n') + 1 if pos < end else len(block)
+            if cut:
+                chunks.append(util.parse_csv(block[:cut], ncols))
+            remainder = block[cut:]
+        data = np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+        return data[start - first_row:stop - first_row]
+
     def _get_data(self):
         """Read data from file on demand.
 
-        The data is scheduled to be cleared from memory unless accessed."""
+        The data is dropped from memory if not accessed, or to stay within
+        the budget of the DataCache."""
         if not hasattr(self, '_data'):
-            try:
-                # if the file is empty, this line can barf in certain versions
-                # of numpy.  Clearly, if the file does not exist on disk, this
-                # will be the case.  Even if the file exists on disk, we must
-                # check its size
-                if self._file.size() > 0:
-                    self.file.seek(0)
-                    self._data = np.loadtxt(self.file, delimiter=',')
-                else:
-                    self._data = np.array([[]])
-                if len(self._data.shape) == 1:
-                    self._data.shape = (1, len(self._data))
-            except ValueError:
-                # no data saved yet
-                # this error is raised by numpy <=1.2
-                self._data = np.array([[]])
-            except IOError:
-                # no data saved yet
-                # this error is raised by numpy 1.3
-                self.file.seek(0)
-                self._data = np.array([[]])
-            self._timeout_call = self.reactor.callLater(DATA_TIMEOUT, self._on_timeout)
-        else:
-            self._timeout_call.reset(DATA_TIMEOUT)
-        return self._data
+            self._update_index()
+            data = self._read_rows(0, self.index.nrows)
+            if not data.size:
+                data = np.array([[]])
+            self._set_data(data)
+        data, nrows = self._data, self._nrows
+        self._cache.access(self, data.nbytes)
+        if not nrows:
+            return np.array([[]])
+        return data[:nrows]
 
     def _set_data(self, data):
         self._data = data
+        self._nrows = len(data) if data.size > 0 else 0
 
     data = property(_get_data, _set_data)
 
-    def _on_timeout(self):
+    def _append_data(self, rows):
+        """Append rows (a 2-D array) to the in-memory data."""
+        current = self.data
+        nrows = self._nrows
+        needed = nrows + len(rows)
+        if nrows == 0:
+            capacity = max(needed, 16)
+            self._data = np.empty((capacity, rows.shape[1]), dtype=rows.dtype)
+        elif needed > len(self._data):
+            capacity = max(needed, 2 * len(self._data))
+            dtype = np.promote_types(current.dtype, rows.dtype)
+            buf = np.empty((capacity, current.shape[1]), dtype=dtype)
+            buf[:nrows] = current
+            self._data = buf
+        elif not np.can_cast(rows.dtype, self._data.dtype):
+            self._data = self._data.astype(np.promote_types(self._data.dtype, rows.dtype))
+        self._data[nrows:needed] = rows
+        self._nrows = needed
+        self._cache.resize(self, self._data.nbytes)
+
+    def _drop_data(self):
         del self._data
-        del self._timeout_call
+        del self._nrows
 
     def _saveData(self, data):
         f = self.file
@@ -439,34 +1028,52 @@ class CsvNumpyData(CsvListData):
         # Ordinarily, we are using record arrays, but for numpy savetxt we want a 2-D array
         record_data = util.from_record_array(data)
         # append data to in-memory data
-        if self.data.size > 0:
-            self.data = np.vstack((self.data, record_data))
-        else:
-            self.data = record_data
+        self._append_data(record_data)
 
         # append data to file
+        size = self._start_appending()
+        if size is not None and self.index.nbytes == size:
+            # the last row was already indexed; skip the line break
+            self.index.nbytes += 2
+            self.index.dirty = True
         self._saveData(data)
 
-    def getData(self, limit, start, transpose, simpleOnly):
+    def getData(self, limit, start, transpose, simpleOnly, columns=None):
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
 
-        if limit is None:
+        if start > 0 and not hasattr(self, '_data'):
+            # The data is not in memory.  Rather than loading all of it,
+            # use the row index to parse just the rows requested.
+            self._update_index()
+            stop = self.index.nrows if limit is None else start + limit
+            data = self._read_rows(start, stop)
+        elif limit is None:
             data = self.data[start:]
         else:
             data = self.data[start:start+limit]
         # nrows should be zero for an empty row
         nrows = len(data) if data.size > 0 else 0
+        if columns is not None and nrows:
+            data = data[:, columns]
         return data, start + nrows
 
+    def __len__(self):
+        if hasattr(self, '_data'):
+            return self._nrows
+        self._update_index()
+        return self.index.nrows
+
     def hasMore(self, pos):
         # cheesy hack: if pos == 0, we only need to check whether
         # the filesize is nonzero
         if pos == 0:
             return os.path.getsize(self.filename) > 0
+        elif hasattr(self, '_data'):
+            return pos < self._nrows
         else:
-            nrows = len(self.data) if self.data.size > 0 else 0
-            return pos < nrows
+            self._update_index()
+            return pos < self.index.nrows
 
 class HDF5MetaData(object):
     """Class to store metadata inside the file itself.
@@ -491,13 +1098,23 @@ class HDF5MetaData(object):
         """Load and save do nothing because HDF5 metadata is accessed live"""
         pass
 
+    _columns = None # ColumnInfo, see columns
+    _dtype = None # row dtype, see dtype
+
     @property
     def dtype(self):
+        """The numpy dtype of a row, read from the file on first use."""
+        if self._dtype is None:
+            self._dtype = self._row_dtype()
+        return self._dtype
+
+    def _row_dtype(self):
         return self.dataset.dtype
 
     def initialize_info(self, title, indep, dep):
         """Initializes the metadata for a newly created dataset."""
         t = time.time()
+        self._columns = self._dtype = None
 
         attrs = self.dataset.attrs
         attrs['Title'] = title
@@ -521,43 +1138,64 @@ class HDF5MetaData(object):
             attrs[prefix + 'datatype'] = d.datatype
             attrs[prefix + 'unit'] = d.unit
 
+    _file = None # the SelfClosingFile or OpenFile, for subclasses with a file
+
+    @property
+    def swmr(self):
+        """Whether the file is in SWMR mode, where attributes are read-only."""
+        return getattr(self._file, 'swmr', False)
+
     def access(self):
-        self.dataset.attrs['Access Time'] = time.time()
+        if not self.swmr:
+            self.dataset.attrs['Access Time'] = time.time()
 
-    def getIndependents(self):
+    def getTitle(self):
+        return str(self.dataset.attrs['Title'])
+
+    def getCreationTime(self):
+        """Get the creation time in seconds since the epoch."""
+        return float(self.dataset.attrs['Creation Time'])
+
+    @property
+    def columns(self):
+        """The ColumnInfo of the dataset, read from the file on first use.
+
+        Reading the column attributes one by one and building type tags
+        from them is slow, and the columns never change, so this is done
+        only once per backend object.
+        """
+        if self._columns is None:
+            indep = tuple(self._read_columns('Independent', Independent))
+            dep = tuple(self._read_columns('Dependent', Dependent))
+            self._columns = ColumnInfo(indep, dep,
+                                       self._row_type(indep + dep),
+                                       self._transpose_type(indep + dep))
+        return self._columns
+
+    def _read_columns(self, kind, cls):
         attrs = self.dataset.attrs
-        rv = []
         for idx in xrange(sys.maxint):
-            prefix = 'Independent{}.'.format(idx)
-            key = prefix + 'label'
-            if key in attrs:
-                label = attrs[prefix + 'label']
-                shape = attrs[prefix + 'shape']
-                datatype = attrs[prefix + 'datatype']
-                unit = attrs[prefix + 'unit']
-                rv.append(Independent(label, shape, datatype, unit))
-            else:
-                return rv
+            prefix = '{}{}.'.format(kind, idx)
+            if prefix + 'label' not in attrs:
+                return
+            yield cls(*[attrs[prefix + field] for field in cls._fields])
+
+    def getIndependents(self):
+        return list(self.columns.independents)
 
     def getDependents(self):
-        attrs = self.dataset.attrs
-        rv = []
-        for idx in xrange(sys.maxint):
-            prefix = 'Dependent{}.'.format(idx)
-            key = prefix + 'label'
-            if key in attrs:
-                label = attrs[prefix + 'label']
-                legend = attrs[prefix + 'legend']
-                shape = attrs[prefix + 'shape']
-                datatype = attrs[prefix + 'datatype']
-                unit = attrs[prefix + 'unit']
-                rv.append(Dependent(label, legend, shape, datatype, unit))
-            else:
-                return rv
+        return list(self.columns.dependents)
 
     def getRowType(self):
+        return self.columns.row_type
+
+    def getTransposeType(self):
+        return self.columns.transpose_type
+
+    @staticmethod
+    def _row_type(cols):
         column_types = []
-        for col in self.getIndependents() + self.getDependents():
+        for col in cols:
             base_type = col.datatype
             if base_type in ['v', 'c']:
                 unit_tag = '[{}]'.format(col.unit)
@@ -576,9 +1214,10 @@ class HDF5MetaData(object):
         type_tag = '*({})'.format(','.join(column_types))
         return type_tag
 
-    def getTransposeType(self):
+    @staticmethod
+    def _transpose_type(cols):
         column_type = []
-        for col in self.getIndependents() + self.getDependents():
+        for col in cols:
             base_type = col.datatype
             if base_type in ['v', 'c']:
                 unit_tag = '[{}]'.format(col.unit)
@@ -597,24 +1236,81 @@ class HDF5MetaData(object):
         type_tag = '({})'.format(','.join(column_type))
         return type_tag
 
+    _params = None # parameter cache, see _get_params
+
+    def _get_params(self):
+        """Get the parameter cache, building it on first use.
+
+        The cache holds the parameter names in file order, the raw data-url
+        for each name, a lowercase name index and the values decoded so far.
+        It is discarded whenever a parameter is added.
+        """
+        if self._params is None:
+            names, raw, lower = [], {}, {}
+            items = [(k[6:], v) for k, v in self.dataset.attrs.items()
+                     if k.startswith('Param.')]
+            params = self._param_dataset()
+            if params is not None:
+                items.extend(params[:])
+            for name, v in items:
+                name = str(name)
+                names.append(name)
+                raw[name] = v
+                lower.setdefault(name.lower(), name)
+            self._params = (names, raw, lower, {})
+        return self._params
+
+    param_type = [
+        ('Name', h5py.special_dtype(vlen=str)),
+        ('Value', h5py.special_dtype(vlen=str))
+    ]
+
+    param_chunk_rows = 64
+
+    def _param_dataset(self, create=False):
+        """Get the 'Parameters' dataset of files written in SWMR mode.
+
+        Attributes cannot be added in SWMR mode, so such files keep their
+        parameters in this dataset instead.  Returns None if it does not
+        exist and create is False.
+        """
+        group = self.dataset.parent
+        if 'Parameters' in group:
+            return group['Parameters']
+        if not create:
+            return None
+        return group.create_dataset('Parameters', shape=(0,), maxshape=(None,),
+                                    dtype=self.param_type,
+                                    chunks=(self.param_chunk_rows,))
+
     def addParam(self, name, data):
-        keyname = 'Param.{}'.format(name)
-        if keyname in self.dataset.attrs:
+        names, raw, lower, decoded = self._get_params()
+        if name in raw:
             raise errors.ParameterInUseError(name)
         value = labrad_urlencode(data)
-        self.dataset.attrs[keyname] = value
+        params = self._param_dataset()
+        if params is None:
+            self.dataset.attrs['Param.{}'.format(name)] = value
+        else:
+            n = len(params)
+            params.resize((n + 1,))
+            params[n] = (name, value)
+            params.flush()
+        self._params = None
 
     def getParameter(self, name, case_sensitive=True):
-        """Get a parameter from the dataset."""
-        keyname = 'Param.{}'.format(name)
-        if case_sensitive:
-            if keyname in self.dataset.attrs:
-                return labrad_urldecode(self.dataset.attrs[keyname])
-        else:
-            for k in self.dataset.attrs:
-                if k.lower() == keyname.lower():
-                    return labrad_urldecode(self.dataset.attrs[k])
-        raise errors.BadParameterError(name)
+        """Get a parameter from the dataset.
+
+        Decoded values are cached, so the returned value must not be modified.
+        """
+        names, raw, lower, decoded = self._get_params()
+        if not case_sensitive:
+            name = lower.get(name.lower(), name)
+        if name not in raw:
+            raise errors.BadParameterError(name)
+        if name not in decoded:
+            decoded[name] = labrad_urldecode(raw[name])
+        return decoded[name]
 
     def getParamNames(self):
         """Get the names of all dataset parameters.
@@ -622,30 +1318,291 @@ class HDF5MetaData(object):
         Parameter names in the HDF5 file are prefixed with 'Param.' to avoid
         conflicts with the other metadata.
         """
-        names = [str(k[6:]) for k in self.dataset.attrs if k.startswith('Param.')]
-        return names
+        names, raw, lower, decoded = self._get_params()
+        return list(names)
+
+    comment_chunk_rows = 256
+
+    def _comment_dataset(self, create=False):
+        """Get the 'Comments' dataset stored next to the data.
+
+        Returns None if it does not exist and create is False.
+        """
+        group = self.dataset.parent
+        if 'Comments' in group:
+            return group['Comments']
+        if not create:
+            return None
+        return group.create_dataset('Comments', shape=(0,), maxshape=(None,),
+                                    dtype=self.comment_type,
+                                    chunks=(self.comment_chunk_rows,))
+
+    def _legacy_comments(self):
+        """Get comments stored in the old 'Comments' attribute, if any."""
+        attrs = self.dataset.attrs
+        if 'Comments' in attrs:
+            return attrs['Comments']
+        return np.ndarray((0,), dtype=self.comment_type)
 
     def addComment(self, user, comment):
         """Add a comment to the dataset."""
         t = time.time()
-        new_comment = np.array([(t, user, comment)], dtype=self.comment_type)
-        old_comments = self.dataset.attrs['Comments']
-        data = np.hstack((old_comments, new_comment))
-        self.dataset.attrs.create('Comments', data, dtype=self.comment_type)
+        new_comments = np.array([(t, user, comment)], dtype=self.comment_type)
+        comments = self._comment_dataset(create=True)
+        n = len(comments)
+        if n == 0:
+            # move comments out of the old attribute layout, which is read
+            # before the dataset so this keeps their order
+            legacy = self._legacy_comments()
+            if len(legacy):
+                new_comments = np.hstack((legacy, new_comments))
+                self.dataset.attrs.create(
+                        'Comments', np.ndarray((0,), dtype=self.comment_type),
+                        dtype=self.comment_type)
+        comments.resize((n + len(new_comments),))
+        comments[n:] = new_comments
+        if self.swmr:
+            comments.flush()
 
     def getComments(self, limit, start):
         """Get comments in [(datetime, username, comment), ...] format."""
-        if limit is None:
-            raw_comments = self.dataset.attrs['Comments'][start:]
-        else:
-            raw_comments = self.dataset.attrs['Comments'][start:start+limit]
+        stop = None if limit is None else start + limit
+        legacy = self._legacy_comments()
+        raw_comments = list(legacy[start:stop])
+        comments_ds = self._comment_dataset()
+        if comments_ds is not None and (stop is None or stop > len(legacy)):
+            ds_start = max(start - len(legacy), 0)
+            ds_stop = len(comments_ds) if stop is None else stop - len(legacy)
+            if ds_stop > ds_start:
+                raw_comments.extend(comments_ds[ds_start:ds_stop])
         comments = [(datetime.datetime.fromtimestamp(c[0]), str(c[1]), str(c[2])) for c in raw_comments]
         return comments, start+len(comments)
 
     def numComments(self):
-        return len(self.dataset.attrs['Comments'])
+        comments_ds = self._comment_dataset()
+        n = 0 if comments_ds is None else len(comments_ds)
+        return len(self._legacy_comments()) + n
+
+class HDF5Data(HDF5MetaData):
+    """Row storage shared by the HDF5 backends.
+
+    The rows live in a 1-D compound dataset at /DataVault.  Datasets created
+    with a storage policy whose growth factor is larger than one are
+    over-allocated geometrically, and the number of rows actually written is
+    kept in the 'Row Count' attribute.  Files without that attribute use the
+    size of the HDF5 dataset as the row count.
+
+    Files created with a storage policy with swmr set use the latest HDF5
+    file format and are switched to single-writer/multiple-reader mode once
+    their metadata is written, so that other processes can read them with
+    the reader module while rows are added.  No attributes or objects can
+    be added in SWMR mode.  The rows are flushed after each append, and
+    parameters and comments go to datasets that are created up front.
+    Access times and range indexes are not saved.
+    """
+
+    def __init__(self, fh):
+        self._file = fh
+        self._row_count = None
+        self._range_index = {} # field -> (rows, sorted, last, samples)
+
+    @staticmethod
+    def _filter_options(storage):
+        """Get the create_dataset arguments for the filters of a storage policy."""
+        kw = {}
+        if storage.compression is not None:
+            kw['compression'] = storage.compression
+            if storage.compression == 'gzip' and storage.compression_opts is not None:
+                kw['compression_opts'] = storage.compression_opts
+        if storage.shuffle:
+            kw['shuffle'] = True
+        return kw
+
+    def _create_dataset(self, dtype, storage=None):
+        """Create the /DataVault dataset according to a storage policy."""
+        if storage is None:
+            storage = DEFAULT_STORAGE_POLICY
+        kw = self._filter_options(storage)
+        if storage.chunk_rows is not None:
+            kw['chunks'] = (storage.chunk_rows,)
+        dataset = self.file.create_dataset('DataVault', (0,), dtype=dtype,
+                                           maxshape=(None,), **kw)
+        if storage.growth > 1 and not storage.swmr:
+            dataset.attrs['Row Count'] = 0
+            dataset.attrs['Growth'] = float(storage.growth)
+        self._row_count = None
+        return dataset
+
+    @property
+    def file(self):
+        return self._file()
+
+    @property
+    def dataset(self):
+        return self.file["DataVault"]
+
+    def _get_row_count(self):
+        if self._row_count is None:
+            attrs = self.dataset.attrs
+            if 'Row Count' in attrs:
+                self._row_count = int(attrs['Row Count'])
+            else:
+                self._row_count = self.dataset.shape[0]
+        return self._row_count
+
+    def addData(self, data):
+        """Adds one or more rows of data from a numpy struct array."""
+        dataset = self.dataset
+        new_rows = len(data)
+        old_rows = self._get_row_count()
+        needed = old_rows + new_rows
+        allocated = dataset.shape[0]
+        logical = 'Row Count' in dataset.attrs
+        if needed > allocated:
+            if logical:
+                growth = float(dataset.attrs['Growth'])
+                allocated = max(needed, int(allocated * growth))
+            else:
+                allocated = needed
+            dataset.resize((allocated,))
+        try:
+            dataset[old_rows:needed] = data
+        except Exception:
+            if not logical and dataset.shape[0] != old_rows:
+                dataset.resize((old_rows,)) # don't leave empty rows
+            raise
+        if logical:
+            dataset.attrs['Row Count'] = needed
+        self._row_count = needed
+        if self.swmr:
+            dataset.flush()
+
+    def start_swmr(self):
+        """Create the metadata datasets, and switch the file to SWMR mode."""
+        self._comment_dataset(create=True)
+        self._param_dataset(create=True)
+        self.file.attrs['SWMR'] = True
+        self.file.swmr_mode = True
+        self._file.swmr = True
+
+    def _getData(self, limit, start):
+        nrows = len(self)
+        stop = nrows if limit is None else min(start + limit, nrows)
+        start = min(start, stop)
+        struct_data = self.dataset[start:stop]
+        return struct_data, start + struct_data.shape[0]
+
+    def _getColumns(self, limit, start, columns=None):
+        """Read up to limit rows of the given columns (by index, default all).
+
+        Only the fields of the requested columns are read from the file.
+        Returns a list of column arrays, in the requested order.
+        """
+        names = self.dtype.names
+        if columns is None:
+            columns = range(len(names))
+        fields = []
+        for idx in columns:
+            if names[idx] not in fields:
+                fields.append(names[idx])
+        nrows = len(self)
+        stop = nrows if limit is None else min(start + limit, nrows)
+        start = min(start, stop)
+        data = self.dataset[(slice(start, stop),) + tuple(fields)]
+        if data.dtype.names is None:
+            # h5py returns a plain array when reading a single field
+            by_name = {fields[0]: data}
+        else:
+            by_name = dict((f, data[f]) for f in fields)
+        return [by_name[names[idx]] for idx in columns], stop
+
+    def __len__(self):
+        return self._get_row_count()
+
+    def hasMore(self, pos):
+        return pos < len(self)
+
+    def _update_range_index(self, field):
+        """Bring the range index of a column up to date and return it.
 
-class ExtendedHDF5Data(HDF5MetaData):
+        The index records whether the column is sorted (non-decreasing) and,
+        if so, holds every RANGE_INDEX_STRIDE-th value.  It is persisted in
+        /Index/<field> and extended incrementally as rows are added.
+        """
+        if field in self._range_index:
+            rows, is_sorted, last, samples = self._range_index[field]
+        elif 'Index' in self.file and field in self.file['Index']:
+            ds = self.file['Index'][field]
+            rows = int(ds.attrs['Rows'])
+            is_sorted = bool(ds.attrs['Sorted'])
+            last = ds.attrs.get('Last')
+            samples = ds[:]
+        else:
+            rows, is_sorted, last = 0, True, None
+            samples = np.zeros((0,), dtype=self.dtype.fields[field][0])
+        nrows = len(self)
+        if is_sorted and rows < nrows:
+            new_samples = [samples]
+            for a in xrange(rows, nrows, RANGE_INDEX_CHUNK):
+                b = min(a + RANGE_INDEX_CHUNK, nrows)
+                values = self.dataset[a:b, field]
+                # comparisons with NaN are false, so NaNs count as unsorted
+                if ((last is not None and not values[0] >= last) or
+                        not np.all(values[1:] >= values[:-1])):
+                    is_sorted = False
+                    break
+                new_samples.append(values[-a % RANGE_INDEX_STRIDE::RANGE_INDEX_STRIDE])
+                last = values[-1]
+            samples = np.concatenate(new_samples)
+            rows = nrows
+            if not self.swmr:
+                self._save_range_index(field, rows, is_sorted, last, samples)
+        self._range_index[field] = (rows, is_sorted, last, samples)
+        return self._range_index[field]
+
+    def _save_range_index(self, field, rows, is_sorted, last, samples):
+        group = self.file.require_group('Index')
+        if field in group:
+            ds = group[field]
+            ds.resize((len(samples),))
+            ds[:] = samples
+        else:
+            ds = group.create_dataset(field, data=samples, maxshape=(None,))
+        ds.attrs['Rows'] = rows
+        ds.attrs['Sorted'] = is_sorted
+        if last is not None:
+            ds.attrs['Last'] = last
+
+    def findRange(self, column, lo, hi):
+        """Find the rows whose value in a sorted column is in [lo, hi].
+
+        Returns (start, stop) such that the rows are start <= row < stop.
+        A binary search over the range index picks out a block of at most
+        RANGE_INDEX_STRIDE rows for each end, which is then searched exactly.
+        """
+        field = self.dtype.names[column]
+        base = self.dtype.fields[field][0]
+        if base.shape or base.kind not in 'iuf':
+            raise errors.RangeQueryError(
+                    'Column {} is not a real scalar column.'.format(column))
+        rows, is_sorted, last, samples = self._update_range_index(field)
+        if not is_sorted:
+            raise errors.RangeQueryError(
+                    'Column {} is not sorted.'.format(column))
+
+        def bound(value, side):
+            k = np.searchsorted(samples, value, side)
+            a = max(k - 1, 0) * RANGE_INDEX_STRIDE
+            b = min(k * RANGE_INDEX_STRIDE, rows)
+            if a >= b:
+                return b
+            return a + np.searchsorted(self.dataset[a:b, field], value, side)
+
+        start = bound(lo, 'left')
+        stop = max(start, bound(hi, 'right'))
+        return int(start), int(stop)
+
+class ExtendedHDF5Data(HDF5Data):
     """Dataset backed by HDF5 file
 
     This supports the extended dataset format which allows each column
@@ -653,12 +1610,12 @@ class ExtendedHDF5Data(HDF5MetaData):
     """
 
     def __init__(self, fh):
-        self._file = fh
+        HDF5Data.__init__(self, fh)
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([3, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], np.int32)
 
-    def initialize_info(self, title, indep, dep):
+    def initialize_info(self, title, indep, dep, storage=None):
         """Initialize the columns when creating a new dataset"""
         dtype = []
         for idx, col in enumerate(indep + dep):
@@ -687,43 +1644,43 @@ class ExtendedHDF5Data(HDF5MetaData):
             else:
                 raise RuntimeError("Invalid type tag {}".format(ttag))
 
-        self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+        self._create_dataset(dtype, storage)
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
-    @property
-    def file(self):
-        return self._file()
+    def getData(self, limit, start, transpose, simpleOnly, columns=None):
+        """Get up to limit rows from a dataset.
 
-    @property
-    def dataset(self):
-        return self.file["DataVault"]
-
-    def addData(self, data):
-        """Adds one or more rows or data from a numpy struct array."""
-        new_rows = len(data)
-        old_rows = self.dataset.shape[0]
-        self.dataset.resize((old_rows + new_rows,))
-        self.dataset[old_rows:(old_rows + new_rows)] = data
-
-    def getData(self, limit, start, transpose, simpleOnly):
-        """Get up to limit rows from a dataset."""
+        columns optionally selects the columns to read, by index.
+        """
         if simpleOnly:
-            datatype = self.dataset.dtype
-            for idx in range(len(datatype)):
-                if datatype[idx] != np.float64:
-                    raise errors.DataVersionMismatchError()
+            self.checkSimple(columns)
         if transpose:
-            return self.getDataTranspose(limit, start)
+            return self.getDataTranspose(limit, start, columns)
 
-        data, new_pos = self._getData(limit, start)
-        row_data = [tuple(row) for row in data]
+        if columns is None:
+            data, new_pos = self._getData(limit, start)
+            row_data = [tuple(row) for row in data]
+        else:
+            cols, new_pos = self._getColumns(limit, start, columns)
+            row_data = zip(*cols)
         return row_data, new_pos
 
-    def getDataTranspose(self, limit, start):
-        struct_data, new_pos = self._getData(limit, start)
-        columns = []
-        for idx in range(len(struct_data.dtype)):
-            col = struct_data['f{}'.format(idx)]
+    def checkSimple(self, columns=None):
+        """Check that the columns, by index, or all columns are scalar floats.
+
+        Raises DataVersionMismatchError if not.
+        """
+        datatype = self.dtype
+        for idx in (range(len(datatype)) if columns is None else columns):
+            if datatype[idx] != np.float64:
+                raise errors.DataVersionMismatchError()
+
+    def getDataTranspose(self, limit, start, columns=None):
+        cols, new_pos = self._getColumns(limit, start, columns)
+        if columns is None:
+            columns = range(len(cols))
+        result = []
+        for idx, col in zip(columns, cols):
             # Strings are stored as hdf5 vlen objects.  Numpy can't do
             # variable length strings, so they get encoded as object
             # arrays by hdf5.  we don't know how to flatten object
@@ -731,31 +1688,17 @@ class ExtendedHDF5Data(HDF5MetaData):
             # them to lists.  Also, h5py has a bug where when you
             # index a dataset with a compound type, it loses the
             # special dtype information, so we pull it directly from
-            # self.dataset.dtype rather than the data returned by
-            # _getData
-            if self.dataset.dtype[idx] == np.object:
-                base_type = h5py.check_dtype(vlen=self.dataset.dtype[idx])
+            # the dataset's dtype (self.dtype) rather than the data returned by
+            # _getColumns
+            if self.dtype[idx] == np.object:
+                base_type = h5py.check_dtype(vlen=self.dtype[idx])
                 if not base_type or not issubclass(base_type, str):
                     raise RuntimeError("Found object type array, but not vlen str.  Not supported.  This shouldn't happen")
                 col = [base_type(x) for x in col]
-            columns.append(col)
-        columns = tuple(columns)
-        return columns, new_pos
-
-    def _getData(self, limit, start):
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start+limit]
-        return struct_data, start + struct_data.shape[0]
-
-    def __len__(self):
-        return self.dataset.shape[0]
-
-    def hasMore(self, pos):
-        return pos < len(self)
+            result.append(col)
+        return tuple(result), new_pos
 
-class SimpleHDF5Data(HDF5MetaData):
+class SimpleHDF5Data(HDF5Data):
     """Basic dataset backed by HDF5 file.
 
     This is a very simple implementation that only supports a single 2-D dataset
@@ -764,59 +1707,409 @@ class SimpleHDF5Data(HDF5MetaData):
     is stored in /DataVault within the HDF5 file.
     """
     def __init__(self, fh):
-        self._file = fh
+        HDF5Data.__init__(self, fh)
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([2, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], dtype=np.int32)
 
-    def initialize_info(self, title, indep, dep):
+    def initialize_info(self, title, indep, dep, storage=None):
         ncol = len(indep) + len(dep)
         dtype = [('f{}'.format(idx), np.float64) for idx in range(ncol)]
         if 'DataVault' not in self.file:
-            self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+            self._create_dataset(dtype, storage)
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
+    def getData(self, limit, start, transpose, simpleOnly, columns=None):
+        """Get up to limit rows from a dataset.
+
+        columns optionally selects the columns to read, by index.
+        """
+        if transpose:
+            raise RuntimeError("Transpose specified for simple data format: not supported")
+        cols, new_pos = self._getColumns(limit, start, columns)
+        data = np.column_stack(cols)
+        return data, new_pos
+
+class GridHDF5Data(HDF5Data):
+    """Dataset of values on a grid of independent variables (version 5).
+
+    The independents are the axes of the grid.  Each axis has fixed values,
+    except that the first one may start empty and grow as data is written.
+    The dependents are stored in /DataVault as an N-D float array, with one
+    dimension per axis and a last one over the dependents, and the values
+    of each axis in /Axes/f<i>.  Points that have not been written are NaN.
+
+    Data is written and read in blocks with writeSlab and getSlice.  For
+    compatibility, getData presents the grid as rows, one per point in C
+    order with the axis values first, so rows are added at the end as the
+    first axis grows.  The storage policy's chunk gives the chunk length
+    along the first axis; growth does not apply.
+    """
+
+    def __init__(self, fh):
+        HDF5Data.__init__(self, fh)
+        if 'Version' not in self.file.attrs:
+            self.file.attrs['Version'] = np.asarray([5, 0, 0], dtype=np.int32)
+        self.version = np.asarray(self.file.attrs['Version'], dtype=np.int32)
+
+    def initialize_info(self, title, axes, dep, storage=None):
+        """Create the grid for the given axes and dependents."""
+        if storage is None:
+            storage = DEFAULT_STORAGE_POLICY
+        if not axes or not dep:
+            raise errors.GridDataError('a grid needs axes and dependents')
+        for idx, axis in enumerate(axes[1:]):
+            if not len(axis.values):
+                raise errors.GridDataError(
+                        'axis {} has no values; only the first axis can '
+                        'grow'.format(idx + 1))
+        shape = tuple(len(axis.values) for axis in axes) + (len(dep),)
+        growing = not len(axes[0].values)
+        maxshape = ((None,) if growing else shape[:1]) + shape[1:]
+        kw = self._filter_options(storage)
+        if storage.chunk_rows is not None:
+            kw['chunks'] = (storage.chunk_rows,) + shape[1:]
+        elif growing:
+            kw['chunks'] = True
+        self.file.create_dataset('DataVault', shape, dtype=np.float64,
+                                 maxshape=maxshape, fillvalue=np.nan, **kw)
+        group = self.file.create_group('Axes')
+        for idx, axis in enumerate(axes):
+            group.create_dataset(
+                    'f{}'.format(idx), data=np.asarray(axis.values, np.float64),
+                    maxshape=(None,) if growing and not idx else None,
+                    chunks=True if growing and not idx else None)
+        indep = [Independent(axis.label, (1,), 'v', axis.unit) for axis in axes]
+        HDF5MetaData.initialize_info(self, title, indep, dep)
+
+    def _row_dtype(self):
+        ncol = len(self.dataset.shape) - 1 + self.dataset.shape[-1]
+        return np.dtype([('f{}'.format(idx), np.float64) for idx in range(ncol)])
+
+    @property
+    def shape(self):
+        """The grid shape: the number of values on each axis."""
+        return self.dataset.shape[:-1]
+
+    def _axis(self, idx):
+        return self.file['Axes']['f{}'.format(idx)]
+
+    def getAxisValues(self):
+        """Get the values along each axis, as a list of arrays."""
+        return [self._axis(idx)[:] for idx in range(len(self.shape))]
+
+    def _get_row_count(self):
+        return int(np.prod(self.shape))
+
+    def addData(self, data):
+        raise errors.GridDataError(
+                'rows cannot be added to a grid; write slabs instead')
+
+    def writeSlab(self, offset, data, axis_values=None):
+        """Write a block of values into the grid.
+
+        data is an array with a dimension per axis and a last one over the
+        dependents, which may be left out if there is only one.  offset
+        gives the position of the block along each axis; missing entries
+        are 0.  If the block extends a growing first axis, the axis values
+        for the block's extent along it may be given as axis_values, and
+        otherwise the new values are their indexes.
+        """
+        dataset = self.dataset
+        grid = self.shape
+        ndep = dataset.shape[-1]
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim == len(grid) and ndep == 1:
+            data = data[..., np.newaxis]
+        if data.ndim != len(grid) + 1 or data.shape[-1] != ndep:
+            raise errors.GridDataError(
+                    'expected a block with {} axes and {} dependents, got '
+                    'shape {}'.format(len(grid), ndep, data.shape))
+        offset = list(offset) + [0] * (len(grid) - len(offset))
+        if len(offset) != len(grid):
+            raise errors.GridDataError(
+                    'offset {} has too many entries'.format(offset))
+        stop = [o + n for o, n in zip(offset, data.shape)]
+        growing = dataset.maxshape[0] is None
+        for idx in range(len(grid)):
+            if stop[idx] > grid[idx] and not (idx == 0 and growing):
+                raise errors.GridDataError(
+                        'block does not fit on axis {}'.format(idx))
+        if axis_values is not None:
+            axis_values = np.asarray(axis_values, dtype=np.float64)
+            if not growing or axis_values.shape != data.shape[:1]:
+                raise errors.GridDataError(
+                        'axis values can only be given for the extent of the '
+                        'block along a growing first axis')
+        if stop[0] > grid[0]:
+            axis = self._axis(0)
+            axis.resize((stop[0],))
+            axis[grid[0]:] = np.arange(grid[0], stop[0])
+            dataset.resize((stop[0],) + dataset.shape[1:])
+        if axis_values is not None:
+            self._axis(0)[offset[0]:stop[0]] = axis_values
+        dataset[tuple(slice(a, b) for a, b in zip(offset, stop))] = data
+        if self.swmr:
+            self._axis(0).flush()
+            dataset.flush()
+
+    def getSlice(self, slices, dependents=None):
+        """Read a block of the grid.
+
+        slices gives (start, stop, step) along the leading axes, with stop
+        clipped to the size of the axis; the other axes are read whole.
+        dependents optionally selects the dependents to read, by index.
+        Returns an array with a dimension per axis and a last one over the
+        dependents.
+        """
+        grid = self.shape
+        if len(slices) > len(grid):
+            raise errors.GridDataError(
+                    'the grid has only {} axes'.format(len(grid)))
+        index = []
+        for (start, stop, step), size in zip(slices, grid):
+            stop = min(stop, size)
+            index.append(slice(min(start, stop), stop, step or 1))
+        data = self.dataset[tuple(index)]
+        if dependents is not None:
+            data = data[..., list(dependents)]
+        return data
+
+    def _getColumns(self, limit, start, columns=None):
+        """Read up to limit rows of the row view of the grid.
+
+        Only the part of the grid spanned by the rows is read.  Returns a
+        list of column arrays, in the requested order.
+        """
+        grid = self.shape
+        naxes = len(grid)
+        ndep = self.dataset.shape[-1]
+        if columns is None:
+            columns = range(naxes + ndep)
+        nrows = len(self)
+        stop = nrows if limit is None else min(start + limit, nrows)
+        start = min(start, stop)
+        if start == stop:
+            return [np.zeros((0,)) for idx in columns], stop
+        inner = int(np.prod(grid[1:]))
+        a, b = start // inner, -(-stop // inner)
+        block = self.dataset[a:b].reshape(-1, ndep)
+        block = block[start - a * inner:stop - a * inner]
+        position = np.unravel_index(np.arange(start, stop), grid)
+        cols = []
+        for idx in columns:
+            if idx < naxes:
+                cols.append(self._axis(idx)[:][position[idx]])
+            else:
+                cols.append(block[:, idx - naxes])
+        return cols, stop
+
+    def getData(self, limit, start, transpose, simpleOnly, columns=None):
+        """Get up to limit rows of the row view of the grid.
+
+        columns optionally selects the columns to read, by index.
+        """
+        cols, new_pos = self._getColumns(limit, start, columns)
+        if transpose:
+            return tuple(cols), new_pos
+        return np.column_stack(cols), new_pos
+
+    def findRange(self, column, lo, hi):
+        raise errors.RangeQueryError(
+                'Range queries are not supported for grid datasets.')
+
+class BinaryData(IniData):
+    """Dataset of float rows appended to a raw binary file (version 4).
+
+    The file starts with a BINARY_HEADER_SIZE byte header holding the number
+    of columns and a checkpoint of the row count, followed by the rows as
+    little-endian float64 records.  The metadata is kept in an INI file, as
+    for csv datasets.  Adding rows is a single write at the end of the file,
+    with no resizing that a crash could leave half done.  Every
+    BINARY_CHECKPOINT_ROWS rows, and when the file is closed, the data is
+    synced to disk and the row count written to the header.
+
+    A BinaryData that has the dataset loaded holds a shared lock on the
+    file.  When the dataset is loaded where no one else has it, the file is
+    truncated to the checkpointed row count: rows written since may not
+    have reached the disk before a crash, and the last of them may be
+    partial.  If it is loaded elsewhere, or without file locking (on
+    Windows), only a partial row at the end is left out.  Reads map the
+    file with np.memmap.
+
+    Finished datasets can be converted to HDF5 with compact_binary, which
+    loads them with an exclusive lock, so it refuses datasets that are
+    loaded anywhere else.
+    """
+
+    version = np.asarray([4, 0, 0], np.int32)
+
+    def __init__(self, filename, reactor=reactor, exclusive=False):
+        self.filename = filename
+        self.infofile = filename[:-len(BINARY_EXTENSION)] + '.ini'
+        self._file = SelfClosingFile(open_args=(filename, 'r+b'), touch=False,
+                                     reactor=reactor)
+        self._file.onClose(self._on_close)
+        self._nrows = 0
+        self._checkpoint = 0
+        self._map = None
+        self._exclusive = exclusive
+        self._lock_file = None
+
     @property
     def file(self):
         return self._file()
 
     @property
-    def dataset(self):
-        return self.file["DataVault"]
+    def _row_size(self):
+        return 8 * self.cols
+
+    def initialize_info(self, title, indep, dep):
+        IniData.initialize_info(self, title, indep, dep)
+        with open(self.filename, 'wb') as f:
+            f.write(BINARY_HEADER.pack(BINARY_MAGIC, 4, 0, 0, self.cols, 0)
+                    .ljust(BINARY_HEADER_SIZE, '\0'))
+        self._lock()
+        self._share_lock()
+
+    def load(self):
+        IniData.load(self)
+        alone = self._lock()
+        try:
+            self._recover(alone)
+        except Exception:
+            self.close()
+            raise
+        self._share_lock()
+
+    def _lock(self):
+        """Lock the file, exclusively if no one else has it loaded.
+
+        Returns whether the lock is exclusive; without file locking, False.
+        Raises DatasetInUseError if the file is locked exclusively elsewhere,
+        or if this BinaryData is exclusive and cannot have it to itself.
+        """
+        if fcntl is None:
+            return False
+        f = open(self.filename, 'rb')
+        try:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                alone = True
+            except IOError as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN) or self._exclusive:
+                    raise
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+                alone = False
+        except IOError as e:
+            f.close()
+            if e.errno not in (errno.EACCES, errno.EAGAIN):
+                raise
+            raise errors.DatasetInUseError(self.filename)
+        self._lock_file = f
+        return alone
+
+    def _share_lock(self):
+        """Let others load the file too, unless this BinaryData is exclusive."""
+        if self._lock_file is not None and not self._exclusive:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_SH)
+
+    def close(self):
+        """Close the file and release the lock on it."""
+        self._file.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _recover(self, alone):
+        """Check the header, and truncate rows that may be lost or partial.
+
+        If alone, no one else has the file loaded, so rows after the
+        checkpoint were left by a crash, and are truncated.
+        """
+        f = self.file
+        f.seek(0)
+        header = f.read(BINARY_HEADER.size)
+        if len(header) < BINARY_HEADER.size:
+            raise errors.CorruptDatasetError(self.filename, 'no header')
+        magic, major, minor, patch, cols, checkpoint = BINARY_HEADER.unpack(header)
+        if magic != BINARY_MAGIC or major != 4:
+            raise errors.CorruptDatasetError(self.filename, 'not a version 4 file')
+        if cols != self.cols:
+            raise errors.CorruptDatasetError(
+                    self.filename, '{} columns in file, {} in metadata'.format(
+                            cols, self.cols))
+        size = os.fstat(f.fileno()).st_size - BINARY_HEADER_SIZE
+        nrows = max(size, 0) // self._row_size if self._row_size else checkpoint
+        self._checkpoint = checkpoint
+        if not alone:
+            # the rows may still be written by whoever has the file loaded
+            self._nrows = nrows
+            return
+        nrows = min(nrows, checkpoint)
+        end = BINARY_HEADER_SIZE + nrows * self._row_size
+        if end != size + BINARY_HEADER_SIZE:
+            f.truncate(end)
+        self._nrows = nrows
+        if nrows != checkpoint:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Sync the data to disk and record the row count in the header."""
+        self._write_checkpoint(self.file)
+
+    def _write_checkpoint(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(BINARY_HEADER.size - BINARY_ROW_COUNT.size)
+        f.write(BINARY_ROW_COUNT.pack(self._nrows))
+        f.flush()
+        self._checkpoint = self._nrows
+
+    def _on_close(self, f):
+        if self._nrows != self._checkpoint:
+            self._write_checkpoint(f._file)
+        self._map = None
 
     def addData(self, data):
-        """Adds one or more rows or data from a 2D array of floats."""
-        new_rows = data.shape[0]
-        old_rows = self.dataset.shape[0]
-        #if data.shape[1] != len(self.dataset.dtype):
-        #    raise errors.BadDataError(len(self.dataset.dtype), data.shape[1])
-
-        self.dataset.resize((old_rows + new_rows,))
-        #new_data = np.zeros((new_rows,), dtype=self.dataset.dtype)
-        #for col in range(data.shape[1]):
-        #    field = "f%d" % (col,)
-        #    new_data[field] = data[:,col]
-        self.dataset[old_rows:(old_rows + new_rows)] = data
-
-    def getData(self, limit, start, transpose, simpleOnly):
-        """Get up to limit rows from a dataset."""
+        data = util.from_record_array(data)
+        if data.shape[1] != self.cols:
+            raise errors.BadDataError(self.cols, data.shape[1])
+        f = self.file
+        f.seek(BINARY_HEADER_SIZE + self._nrows * self._row_size)
+        f.write(np.ascontiguousarray(data, '<f8').tostring())
+        f.flush()
+        self._nrows += len(data)
+        if self._nrows - self._checkpoint >= BINARY_CHECKPOINT_ROWS:
+            self._write_checkpoint(f)
+
+    def _rows(self, stop):
+        """Get a memory map of at least the first stop rows of the file."""
+        if self._map is None or len(self._map) < stop:
+            self._map = np.memmap(self.filename, dtype='<f8', mode='r',
+                                  offset=BINARY_HEADER_SIZE,
+                                  shape=(self._nrows, self.cols))
+        return self._map
+
+    def getData(self, limit, start, transpose, simpleOnly, columns=None):
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start+limit]
-        columns = []
-        for idx in range(len(struct_data.dtype)):
-            columns.append(struct_data['f{}'.format(idx)])
-        data = np.column_stack(columns)
-        return data, start + data.shape[0]
+        nrows = self._nrows
+        stop = nrows if limit is None else min(start + limit, nrows)
+        start = min(start, stop)
+        ncols = self.cols if columns is None else len(columns)
+        if start == stop:
+            return np.zeros((0, ncols)), stop
+        data = self._rows(stop)[start:stop]
+        if columns is not None:
+            data = data[:, columns]
+        return np.array(data, dtype=float), stop
 
     def __len__(self):
-        return self.dataset.shape[0]
+        return self._nrows
 
     def hasMore(self, pos):
-        return pos < len(self)
+        return pos < self._nrows
 
 def open_hdf5_file(filename):
     """Factory for HDF5 files.  
@@ -825,23 +2118,91 @@ def open_hdf5_file(filename):
     options exist: version 2.0.0 -> legacy format, 3.0.0 -> extended format.
     Version 1 is reserved for CSV files.
     """
-    fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'))
+    fh = None
+    try:
+        fh = SelfClosingFile(h5py.File, open_args=(filename, 'r+'))
+        swmr = fh().attrs.get('SWMR', False)
+    except IOError as e:
+        if not _is_lock_error(e):
+            raise
+        # locked by readers, which only SWMR files may have open
+        swmr = True
+    if swmr:
+        if fh is not None:
+            fh.close()
+        fh = open_swmr_file(filename)
     version = fh().attrs['Version']
     if version[0] == 2:
         return SimpleHDF5Data(fh)
+    elif version[0] == 5:
+        return GridHDF5Data(fh)
     else:
         return ExtendedHDF5Data(fh)
 
-def create_backend(filename, title, indep, dep, extended):
-    hdf5_file = filename + '.hdf5'
-    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'))
+def open_swmr_file(filename):
+    """Open an HDF5 file written in SWMR mode, to append to it if possible.
+
+    If readers have the file open, it can only be opened for reading.
+    """
+    try:
+        fh = h5py.File(filename, 'r+', libver='latest')
+        try:
+            fh.swmr_mode = True
+        except ValueError:
+            pass # already in SWMR mode, open elsewhere in this process
+    except IOError as e:
+        if not _is_lock_error(e):
+            raise
+        fh = h5py.File(filename, 'r', libver='latest', swmr=True)
+    return OpenFile(fh, swmr=True)
+
+def _is_lock_error(e):
+    """Check whether an IOError from h5py is HDF5 failing to lock the file.
+
+    h5py gives no errno, so this goes by the message of the HDF5 error.
+    """
+    return 'unable to lock file' in str(e)
+
+def create_backend(filename, title, indep, dep, extended, storage=None):
+    """Create a new HDF5 or binary dataset.
+
+    storage is an optional StoragePolicy controlling the file format,
+    chunking, compression and over-allocation of the rows; by default
+    DEFAULT_STORAGE_POLICY is used.  Extended datasets are always HDF5.
+    """
+    if storage is not None and storage.format == 'binary' and not extended:
+        data = BinaryData(filename + BINARY_EXTENSION)
+        data.initialize_info(title, indep, dep)
+        return data
+    fh = _create_hdf5_file(filename + '.hdf5', storage)
     if extended:
         data = ExtendedHDF5Data(fh)
     else:
         data = SimpleHDF5Data(fh)
-    data.initialize_info(title, indep, dep)
+    data.initialize_info(title, indep, dep, storage)
+    if storage is not None and storage.swmr:
+        data.start_swmr()
     return data
 
+def create_grid_backend(filename, title, axes, dep, storage=None):
+    """Create a new grid dataset (see GridHDF5Data).
+
+    axes is a list of Axis, and storage an optional StoragePolicy as for
+    create_backend; its format does not apply.
+    """
+    fh = _create_hdf5_file(filename + '.hdf5', storage)
+    data = GridHDF5Data(fh)
+    data.initialize_info(title, axes, dep, storage)
+    if storage is not None and storage.swmr:
+        data.start_swmr()
+    return data
+
+def _create_hdf5_file(filename, storage):
+    """Create an HDF5 file, to be written in SWMR mode if storage says so."""
+    if storage is not None and storage.swmr:
+        return OpenFile(h5py.File(filename, 'a', libver='latest'))
+    return SelfClosingFile(h5py.File, open_args=(filename, 'a'))
+
 def open_backend(filename):
     """Make a data object that manages in-memory and on-disk storage for a dataset.
 
@@ -850,6 +2211,7 @@ def open_backend(filename):
     no file exists, we create a new backend to store data in binary form.
     """
     csv_file = filename + '.csv'
+    binary_file = filename + BINARY_EXTENSION
     hdf5_file = filename + '.hdf5'
 
     if os.path.exists(csv_file):
@@ -857,7 +2219,52 @@ def open_backend(filename):
             return CsvNumpyData(csv_file)
         else:
             return CsvListData(csv_file)
+    elif os.path.exists(binary_file):
+        # a binary file is only left next to an HDF5 file by an interrupted
+        # compact_binary, so it holds the complete data
+        return BinaryData(binary_file)
     elif os.path.exists(hdf5_file):
         return open_hdf5_file(hdf5_file)
     else: # We should have already checked, this should not happen
         raise errors.DatasetNotFoundError(filename)
+
+def compact_binary(filename):
+    """Convert a finished version 4 dataset to a simple HDF5 dataset.
+
+    filename is given without extension, as for open_backend.  The rows and
+    metadata are copied to a new HDF5 file, and then the binary and INI
+    files are removed.  Raises DatasetInUseError if the dataset is loaded
+    by a data vault, or anything else, as a BinaryData.
+    """
+    src = BinaryData(filename + BINARY_EXTENSION, exclusive=True)
+    src.load()
+    hdf5_file = filename + '.hdf5'
+    tmp_file = hdf5_file + '.tmp'
+    try:
+        with h5py.File(tmp_file, 'w') as fh:
+            dst = SimpleHDF5Data(lambda: fh)
+            dst.initialize_info(src.title, src.independents, src.dependents)
+            attrs = dst.dataset.attrs
+            for key, t in [('Creation Time', src.created),
+                           ('Access Time', src.accessed),
+                           ('Modification Time', src.modified)]:
+                attrs[key] = time.mktime(t.timetuple())
+            dtype = dst.dataset.dtype
+            for start in xrange(0, len(src), COMPACT_CHUNK_ROWS):
+                rows, _ = src.getData(COMPACT_CHUNK_ROWS, start, False, True)
+                dst.addData(np.ascontiguousarray(rows).view(dtype).ravel())
+            for name in src.getParamNames():
+                dst.addParam(name, src.getParameter(name))
+            if src.comments:
+                comments = np.array(
+                        [(time.mktime(t.timetuple()), user, comment)
+                         for t, user, comment in src.comments],
+                        dtype=dst.comment_type)
+                ds = dst._comment_dataset(create=True)
+                ds.resize((len(comments),))
+                ds[:] = comments
+    finally:
+        src.close()
+    os.rename(tmp_file, hdf5_file)
+    os.remove(src.filename)
+    os.remove(src.infofile)
@@ -0,0 +1,10 @@
+"""Performance benchmarks for the data vault.
+
+These are standalone scripts rather than tests.  Run them as modules from
+the repository root, for example:
+
+    python -m datavault.benchmarks.csv_append
+
+The suite module runs the standard set of backend and server benchmarks and
+writes the results as JSON, for tracking performance between versions.
+"""
@@ -0,0 +1,104 @@
+"""Benchmark adding rows with add, add_ex and add_ex_t.
+
+Adds --calls batches of --rows rows of --cols float columns to a dataset of
+an in-process server with each setting, and reports the time per call and
+the rows added per second.  The data for each call is unflattened from the
+labrad wire format beforehand, as the server would receive it, so only the
+work of the setting itself is timed.  add_ex is timed both with the current
+conversion of rows to records and with the old per-row fromrecords one
+('add_ex (legacy)').  Each setting is run --repeat times, alternating
+between settings, and the best run is reported.  For example:
+
+    python -m datavault.benchmarks.add_ex --rows 1000 --cols 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from labrad import types as T
+
+from datavault.benchmarks.suite import Vault
+
+
+def legacy_add_ex(vault, c, data):
+    """add_ex as it was before util.records_from_rows."""
+    dataset = vault.server.getDataset(c)
+    list_data = [tuple(row) for row in data]
+    dataset.addData(np.core.records.fromrecords(list_data,
+                                                dtype=dataset.data.dtype))
+
+
+def wire_data(values, tag):
+    """Flatten and unflatten data, as it arrives at the server."""
+    flat = T.flatten(values, tag)
+    return T.unflatten(flat.bytes, flat.tag)
+
+
+def run(setting, rows, calls, ncols):
+    """Time calls of a setting.  Returns the mean seconds per call."""
+    vault = Vault()
+    try:
+        c = vault.context()
+        if setting == 'add':
+            vault.server.new(c, 'bench', ['x [s]'],
+                             ['y{} (trace) [V]'.format(i)
+                              for i in range(ncols - 1)])
+        else:
+            vault.server.new_ex(c, 'bench', [('x', [1], 'v', 's')],
+                                [('y{}'.format(i), 'trace', [1], 'v', 'V')
+                                 for i in range(ncols - 1)])
+        values = np.random.rand(rows, ncols)
+        if setting == 'add':
+            batches = [wire_data(values, '*2v') for _ in range(calls)]
+            f = vault.server.add
+        elif setting == 'add_ex_t':
+            batches = [wire_data(tuple(values.T), '(' + '*v' * ncols + ')')
+                       for _ in range(calls)]
+            f = vault.server.add_ex_t
+        else:
+            rows_tag = '*(' + 'v' * ncols + ')'
+            batches = [wire_data([tuple(row) for row in values], rows_tag)
+                       for _ in range(calls)]
+            f = vault.server.add_ex
+            if setting == 'add_ex (legacy)':
+                f = lambda c, data: legacy_add_ex(vault, c, data)
+        elapsed = 0.0
+        for data in batches:
+            t = time.time()
+            f(c, data)
+            elapsed += time.time() - t
+        vault.flush()
+        return elapsed / calls
+    finally:
+        vault.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='rows per call')
+    parser.add_argument('--calls', type=int, default=100,
+                        help='number of calls of each setting')
+    parser.add_argument('--cols', type=int, default=5,
+                        help='number of columns')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of each setting')
+    args = parser.parse_args()
+
+    settings = ['add', 'add_ex (legacy)', 'add_ex', 'add_ex_t']
+    best = dict((setting, float('inf')) for setting in settings)
+    for _ in range(args.repeat):
+        for setting in settings:
+            seconds = run(setting, args.rows, args.calls, args.cols)
+            best[setting] = min(best[setting], seconds)
+    print '{:>16} {:>12} {:>16}'.format('setting', 'us/call', 'rows/s')
+    for setting in settings:
+        seconds = best[setting]
+        print '{:>16} {:>12.1f} {:>16.0f}'.format(
+                setting, seconds * 1e6, args.rows / seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Benchmark appending rows to a CSV dataset.
+
+Appends rows in small batches to a CsvNumpyData backend until it holds
+--rows rows, and reports the mean time per append over consecutive windows.
+With amortized constant-time appends the time per append stays flat as the
+dataset grows.  --legacy also times the old np.vstack-per-append strategy on
+the in-memory array, which grows linearly with the dataset size.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from twisted.internet import task
+
+from datavault import backend
+
+
+def make_dataset(dirname, ncols):
+    indep = [backend.Independent(label='x', shape=(1,), datatype='v', unit='')]
+    dep = [backend.Dependent(label='y{}'.format(i), legend='', shape=(1,),
+                             datatype='v', unit='')
+           for i in range(ncols - 1)]
+    data = backend.CsvNumpyData(os.path.join(dirname, 'bench.csv'),
+                                reactor=task.Clock())
+    data.initialize_info('benchmark', indep, dep)
+    data.save()
+    return data
+
+
+def run_backend(rows, batch, ncols, windows):
+    """Time CsvNumpyData.addData.  Returns [(rows so far, us per append)]."""
+    dirname = tempfile.mkdtemp(prefix='dvbench_')
+    try:
+        data = make_dataset(dirname, ncols)
+        block = np.core.records.fromarrays(np.random.rand(ncols, batch))
+        appends = rows // batch
+        per_window = max(appends // windows, 1)
+        results = []
+        t0 = time.time()
+        for i in xrange(1, appends + 1):
+            data.addData(block)
+            if i % per_window == 0:
+                t1 = time.time()
+                results.append((i * batch, (t1 - t0) / per_window * 1e6))
+                t0 = t1
+        return results
+    finally:
+        shutil.rmtree(dirname)
+
+
+def run_legacy(rows, batch, ncols, windows):
+    """Time the old vstack-per-append strategy on an in-memory array."""
+    block = np.random.rand(batch, ncols)
+    data = np.array([[]])
+    appends = rows // batch
+    per_window = max(appends // windows, 1)
+    results = []
+    t0 = time.time()
+    for i in xrange(1, appends + 1):
+        if data.size > 0:
+            data = np.vstack((data, block))
+        else:
+            data = block
+        if i % per_window == 0:
+            t1 = time.time()
+            results.append((i * batch, (t1 - t0) / per_window * 1e6))
+            t0 = t1
+    return results
+
+
+def report(name, results):
+    print name
+    print '{:>12} {:>16}'.format('rows', 'us/append')
+    for nrows, us in results:
+        print '{:>12} {:>16.1f}'.format(nrows, us)
+    first, last = results[0][1], results[-1][1]
+    print 'last/first window ratio: {:.2f}'.format(last / first)
+    print
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10**6,
+                        help='total number of rows to append')
+    parser.add_argument('--batch', type=int, default=10,
+                        help='rows per append')
+    parser.add_argument('--cols', type=int, default=3,
+                        help='number of columns')
+    parser.add_argument('--windows', type=int, default=10,
+                        help='number of timing windows to report')
+    parser.add_argument('--legacy', action='store_true',
+                        help='also time the old vstack strategy')
+    parser.add_argument('--legacy-rows', type=int, default=10**5,
+                        help='total rows for the legacy strategy')
+    args = parser.parse_args()
+
+    report('CsvNumpyData.addData',
+           run_backend(args.rows, args.batch, args.cols, args.windows))
+    if args.legacy:
+        report('legacy np.vstack per append',
+               run_legacy(args.legacy_rows, args.batch, args.cols,
+                          args.windows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+"""Benchmark suite for the data vault backends and server.
+
+Runs each benchmark against an in-process DataVault server using a
+temporary data directory.  Settings are called directly, as in the tests,
+and the values they return are flattened to the labrad wire format so that
+the cost of encoding the result is included.  The benchmarks are:
+
+    append   add rows in calls of 1, 100 and 10k rows with 2 to 200
+             columns, to simple HDF5, extended HDF5, csv and binary datasets
+    read     read a dataset in chunks with get, get_ex and get_ex_t
+    params   add, list and look up the parameters of a dataset with many
+    listing  create, list and open datasets in a directory with 10^4 of them
+
+Results, with the throughput and p50/p99 latency of each case, are written
+as JSON so that runs can be compared to track regressions.  A summary is
+printed to stderr.  For example:
+
+    python -m datavault.benchmarks.suite --output results.json
+    python -m datavault.benchmarks.suite --quick --only append read
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from labrad import types as T
+
+from datavault import (INDEX_MTIME_SLACK, SessionStore, backend,
+                       filename_encode, server)
+
+BENCHMARKS = ['append', 'read', 'params', 'listing']
+
+APPEND_ROWS = [1, 100, 10000] # rows per call
+APPEND_COLUMNS = [2, 20, 200]
+APPEND_BACKENDS = ['simple', 'extended', 'csv', 'binary']
+APPEND_VALUES = 2 * 10**7 # values (rows x columns) added per append case
+APPEND_MAX_CALLS = 2000
+READ_ROWS = 10**5 # rows in the dataset read by the read benchmarks
+READ_COLUMNS = [2, 20]
+READ_LIMITS = [100, 10000] # rows per call
+PARAMS = 1000 # parameters in the params benchmark
+LISTING_DATASETS = 10**4 # datasets in the listing benchmark
+LISTING_CALLS = 100
+QUICK_FACTOR = 10 # --quick divides the sizes above by this
+
+
+class NullHub(object):
+    """Stands in for the labrad server that sends signals to clients."""
+    def __getattr__(self, name):
+        return lambda *args, **kw: None
+
+
+class Context(dict):
+    def __init__(self, name):
+        self.ID = name
+
+
+class Vault(object):
+    """An in-process data vault server with a temporary data directory."""
+
+    def __init__(self, datadir=None):
+        self.datadir = datadir or tempfile.mkdtemp(prefix='dvbench_')
+        self.store = SessionStore(self.datadir, NullHub())
+        self.server = server.DataVault(self.store)
+        self.server.initServer()
+        self._contexts = 0
+
+    def context(self, path=None):
+        self._contexts += 1
+        c = Context('bench-{}'.format(self._contexts))
+        self.server.initContext(c)
+        if path is not None:
+            self.server.cd(c, path, True)
+        return c
+
+    def flush(self):
+        self.store.flush()
+
+    def remove(self):
+        shutil.rmtree(self.datadir)
+
+
+class Timer(object):
+    """Collects the latency of each call of a benchmark case."""
+
+    def __init__(self):
+        self.latencies = []
+        self.start = time.time()
+        self.stop = None
+
+    def __call__(self, f, *args, **kw):
+        t = time.time()
+        result = f(*args, **kw)
+        self.latencies.append(time.time() - t)
+        return result
+
+    def done(self):
+        self.stop = time.time()
+
+
+def flatten(value, tag=None):
+    """Encode a setting result as it would be sent to the client."""
+    if value is not None:
+        T.flatten(value, tag)
+    return value
+
+
+def result(benchmark, params, timer, count, unit):
+    """Summarize a case, with the throughput of count units per second."""
+    if timer.stop is None:
+        timer.done()
+    seconds = timer.stop - timer.start
+    p50, p99 = np.percentile(timer.latencies, [50, 99]) * 1e3
+    return {
+        'benchmark': benchmark,
+        'params': params,
+        'calls': len(timer.latencies),
+        'seconds': seconds,
+        'throughput': count / seconds if seconds else None,
+        'throughput_unit': unit,
+        'mean_ms': float(np.mean(timer.latencies)) * 1e3,
+        'p50_ms': float(p50),
+        'p99_ms': float(p99),
+    }
+
+
+## Datasets
+
+def _variables(ncols):
+    indep = [('x', 's')]
+    dep = [('y{}'.format(i), 'trace {}'.format(i), 'V')
+           for i in range(ncols - 1)]
+    return indep, dep
+
+def new_dataset(vault, c, kind, ncols, name='bench'):
+    """Create a dataset with ncols float columns and make it current in c.
+
+    kind is 'simple', 'extended', 'csv' or 'binary'.  The server only
+    creates HDF5 and binary datasets, so csv datasets are written with the
+    backend and then opened for appending.
+    """
+    indep, dep = _variables(ncols)
+    if kind == 'simple':
+        vault.server.new(c, name, indep, dep)
+    elif kind == 'binary':
+        vault.server.new(c, name, indep, dep, 'format=binary')
+    elif kind == 'extended':
+        vault.server.new_ex(c, name,
+                            [(label, [1], 'v', unit) for label, unit in indep],
+                            [(label, legend, [1], 'v', unit)
+                             for label, legend, unit in dep])
+    elif kind == 'csv':
+        session = vault.server.getSession(c)
+        data = backend.CsvNumpyData(
+                os.path.join(session.dir, filename_encode(name) + '.csv'))
+        data.initialize_info(
+                name,
+                [backend.Independent(label, (1,), 'v', unit)
+                 for label, unit in indep],
+                [backend.Dependent(label, legend, (1,), 'v', unit)
+                 for label, legend, unit in dep])
+        data.save()
+        data._file.close()
+        vault.server.open(c, name, True)
+    else:
+        raise ValueError(kind)
+    return vault.server.getDataset(c)
+
+def add_rows(vault, c, kind, rows):
+    """Add a 2-D array of rows, with add_ex_t for extended datasets."""
+    if kind == 'extended':
+        vault.server.add_ex_t(c, tuple(rows.T))
+    else:
+        vault.server.add(c, rows)
+
+
+## Benchmarks
+
+def bench_append(rng, scale):
+    results = []
+    for kind in APPEND_BACKENDS:
+        for nrows in APPEND_ROWS:
+            for ncols in APPEND_COLUMNS:
+                calls = max(min(APPEND_MAX_CALLS // scale,
+                                APPEND_VALUES // scale // (nrows * ncols)), 5)
+                vault = Vault()
+                try:
+                    c = vault.context()
+                    dataset = new_dataset(vault, c, kind, ncols)
+                    rows = rng.rand(nrows, ncols)
+                    timer = Timer()
+                    for _ in xrange(calls):
+                        timer(add_rows, vault, c, kind, rows)
+                    dataset.flush()
+                    timer.done()
+                    results.append(result(
+                            'append',
+                            {'backend': kind, 'rows_per_call': nrows,
+                             'columns': ncols},
+                            timer, calls * nrows, 'rows/s'))
+                finally:
+                    vault.remove()
+    return results
+
+READ_METHODS = [
+    ('simple', 'get', '*2v'),
+    ('csv', 'get', '*2v'),
+    ('binary', 'get', '*2v'),
+    ('extended', 'get', '*2v'),
+    ('extended', 'get_ex', None),
+    ('extended', 'get_ex_t', None),
+]
+
+def bench_read(rng, scale):
+    results = []
+    total = READ_ROWS // scale
+    for ncols in READ_COLUMNS:
+        for kind in ['simple', 'csv', 'binary', 'extended']:
+            vault = Vault()
+            try:
+                c = vault.context()
+                dataset = new_dataset(vault, c, kind, ncols)
+                add_rows(vault, c, kind, rng.rand(total, ncols))
+                dataset.flush()
+                for method_kind, method, tag in READ_METHODS:
+                    if method_kind != kind:
+                        continue
+                    get = getattr(vault.server, method)
+                    for limit in READ_LIMITS:
+                        reader = vault.context()
+                        vault.server.open(reader, dataset.name)
+                        timer = Timer()
+                        for _ in xrange(-(-total // limit)):
+                            timer(lambda: flatten(get(reader, limit), tag))
+                        timer.done()
+                        results.append(result(
+                                'read',
+                                {'backend': kind, 'method': method,
+                                 'rows_per_call': limit, 'columns': ncols},
+                                timer, total, 'rows/s'))
+            finally:
+                vault.remove()
+    return results
+
+def _param_value(rng, i):
+    kind = i % 3
+    if kind == 0:
+        return float(rng.rand())
+    elif kind == 1:
+        return 'value {}'.format(i)
+    return rng.rand(16)
+
+def bench_params(rng, scale):
+    results = []
+    count = PARAMS // scale
+    vault = Vault()
+    try:
+        c = vault.context()
+        dataset = new_dataset(vault, c, 'simple', 2)
+        names = ['param {:05d}'.format(i) for i in range(count)]
+        timer = Timer()
+        for i, name in enumerate(names):
+            timer(vault.server.add_parameter, c, name, _param_value(rng, i))
+        timer.done()
+        results.append(result('params', {'operation': 'add parameter',
+                                         'parameters': count},
+                              timer, count, 'calls/s'))
+
+        timer = Timer()
+        lookups = [names[i] for i in rng.randint(0, count, count)]
+        for name in lookups:
+            timer(lambda: flatten(vault.server.get_parameter(c, name)))
+        timer.done()
+        results.append(result('params', {'operation': 'get parameter',
+                                         'parameters': count},
+                              timer, count, 'calls/s'))
+
+        timer = Timer()
+        for _ in xrange(20):
+            timer(lambda: flatten(vault.server.get_parameters(c)))
+        timer.done()
+        results.append(result('params', {'operation': 'get parameters',
+                                         'parameters': count},
+                              timer, 20, 'calls/s'))
+
+        # reopening the dataset reads the parameters back from disk
+        vault.flush()
+        timer = Timer()
+        for _ in xrange(20):
+            fresh = Vault(vault.datadir)
+            reader = fresh.context()
+            timer(lambda: (fresh.server.open(reader, dataset.name),
+                           flatten(fresh.server.get_parameters(reader))))
+        timer.done()
+        results.append(result('params', {'operation': 'open and get parameters',
+                                         'parameters': count},
+                              timer, 20, 'calls/s'))
+    finally:
+        vault.remove()
+    return results
+
+def bench_listing(rng, scale):
+    results = []
+    count = LISTING_DATASETS // scale
+    path = ['', 'listing']
+    vault = Vault()
+    try:
+        c = vault.context(path)
+        indep, dep = _variables(2)
+        timer = Timer()
+        for i in xrange(count):
+            timer(vault.server.new, c, 'dataset', indep, dep)
+        timer.done()
+        results.append(result('listing', {'operation': 'new',
+                                          'datasets': count},
+                              timer, count, 'calls/s'))
+        vault.flush()
+        # listings of a directory changed within the slack are not cached
+        time.sleep(INDEX_MTIME_SLACK)
+
+        timer = Timer()
+        for _ in xrange(LISTING_CALLS):
+            timer(lambda: flatten(vault.server.dir(c)))
+        timer.done()
+        results.append(result('listing', {'operation': 'dir',
+                                          'datasets': count},
+                              timer, LISTING_CALLS, 'calls/s'))
+
+        timer = Timer()
+        for _ in xrange(LISTING_CALLS // 10):
+            fresh = Vault(vault.datadir)
+            reader = fresh.context()
+            timer(lambda: (fresh.server.cd(reader, path),
+                           flatten(fresh.server.dir(reader))))
+        timer.done()
+        results.append(result('listing', {'operation': 'cold cd and dir',
+                                          'datasets': count},
+                              timer, LISTING_CALLS // 10, 'calls/s'))
+
+        timer = Timer()
+        for num in rng.randint(1, count + 1, LISTING_CALLS):
+            timer(vault.server.open, c, int(num))
+        timer.done()
+        results.append(result('listing', {'operation': 'open by number',
+                                          'datasets': count},
+                              timer, LISTING_CALLS, 'calls/s'))
+    finally:
+        vault.remove()
+    return results
+
+
+## Reporting
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'h5py': h5py.__version__,
+    }
+
+def summarize(results, out):
+    for r in results:
+        params = ', '.join('{}={}'.format(k, v)
+                           for k, v in sorted(r['params'].items()))
+        out.write('{:<8} {:<60} {:>12.0f} {:<7} p50 {:8.3f} ms  '
+                  'p99 {:8.3f} ms\n'.format(
+                          r['benchmark'], params, r['throughput'] or 0,
+                          r['throughput_unit'], r['p50_ms'], r['p99_ms']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        default=BENCHMARKS, help='benchmarks to run')
+    parser.add_argument('--quick', action='store_true',
+                        help='run with {}x smaller sizes'.format(QUICK_FACTOR))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for the data written')
+    parser.add_argument('--output', help='file to write the JSON results to '
+                                         '(default: stdout)')
+    args = parser.parse_args(argv)
+
+    rng = np.random.RandomState(args.seed)
+    scale = QUICK_FACTOR if args.quick else 1
+    results = []
+    for name in args.only:
+        new_results = globals()['bench_' + name](rng, scale)
+        summarize(new_results, sys.stderr)
+        results.extend(new_results)
+    report = {
+        'environment': environment(),
+        'args': {'only': args.only, 'quick': args.quick, 'seed': args.seed},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
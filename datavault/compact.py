@@ -0,0 +1,57 @@
+"""Convert the binary (version 4) datasets of a data vault to HDF5.
+
+Binary datasets are fast to append to, but HDF5 files are more widely
+readable and can be compressed.  Once a data vault is stopped, all of its
+binary datasets are finished, and can be converted by running this module:
+
+    python -m datavault.compact <datadir>
+
+Each dataset keeps its name, so it is found as before.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+
+from . import backend
+from . import filename_encode, DirectoryIndex
+
+
+def compact_all(dirname, log=None):
+    """Convert the binary datasets in dirname and below.  Returns the count.
+
+    Datasets that cannot be converted are skipped and reported to log, if
+    given.
+    """
+    count = 0
+    index = DirectoryIndex(os.listdir(dirname))
+    for name in index.datasets:
+        if index.types[name] != 'dvb':
+            continue
+        file_base = os.path.join(dirname, filename_encode(name))
+        try:
+            backend.compact_binary(file_base)
+            count += 1
+        except Exception as e:
+            if log is not None:
+                log('Skipping {}: {}'.format(file_base, e))
+    for d in index.dirs:
+        count += compact_all(os.path.join(dirname, filename_encode(d) + '.dir'),
+                             log)
+    return count
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        print 'usage: python -m datavault.compact <datadir>'
+        return 1
+    t = time.time()
+    def log(msg):
+        print msg
+    count = compact_all(argv[1], log)
+    print 'Converted {} datasets in {:.1f} s.'.format(count, time.time() - t)
+
+if __name__ == '__main__':
+    sys.exit(main())
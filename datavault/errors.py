@@ -46,3 +46,58 @@ class DataVersionMismatchError(T.Error):
     code = 11
     def __init__(self):
         self.msg = "Dataset was created with newer API, cannot be read.  Use get_ex"
+
+class DecimationMethodError(T.Error):
+    code = 12
+    def __init__(self, method):
+        self.msg = "Unknown decimation method '{0}'.".format(method)
+
+class RangeQueryError(T.Error):
+    code = 13
+    def __init__(self, msg):
+        self.msg = msg
+
+class ColumnNotFoundError(T.Error):
+    code = 14
+    def __init__(self, column):
+        self.msg = "Column {0!r} not found.".format(column)
+
+class ColumnTypeError(T.Error):
+    code = 15
+    def __init__(self, column):
+        self.msg = "Column {0!r} does not hold real scalar values.".format(column)
+
+class SearchNotEnabledError(T.Error):
+    code = 16
+    def __init__(self):
+        self.msg = "Searching is not enabled on this data vault."
+
+class DatasetImportError(T.Error):
+    code = 17
+    def __init__(self, msg):
+        self.msg = "Cannot import dataset: {0}".format(msg)
+
+class CorruptDatasetError(T.Error):
+    code = 18
+    def __init__(self, filename, msg):
+        self.msg = "Dataset file {0} is corrupt: {1}".format(filename, msg)
+
+class GridDataError(T.Error):
+    code = 19
+    def __init__(self, msg):
+        self.msg = "Grid dataset error: {0}".format(msg)
+
+class DataWriteError(T.Error):
+    code = 20
+    def __init__(self, name, msg):
+        self.msg = "Writing rows to dataset {0!r} failed: {1}".format(name, msg)
+
+class DatasetInUseError(T.Error):
+    code = 21
+    def __init__(self, filename):
+        self.msg = "Dataset file {0} is in use.".format(filename)
+
+class DatasetExportError(T.Error):
+    code = 22
+    def __init__(self, msg):
+        self.msg = "Cannot export dataset: {0}".format(msg)
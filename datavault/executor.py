@@ -0,0 +1,63 @@
+"""Thread pool for blocking dataset I/O.
+
+Reading and writing dataset files can take a long time for large datasets
+or slow file systems.  Run on the reactor thread, such calls would stall
+every other client of the data vault.  An IOExecutor runs them in a pool of
+worker threads instead, so the reactor stays responsive.  Calls for the same
+dataset run one at a time in the order they were made, so that reads see
+all data written before them; calls for different datasets run concurrently.
+"""
+
+from __future__ import absolute_import
+
+import weakref
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+# default number of worker threads
+IO_THREADS = 4
+
+
+class IOExecutor(object):
+    """Runs blocking calls in a thread pool, serialized per key.
+
+    run must be called from the reactor thread; the Deferreds it returns
+    fire on the reactor thread.
+    """
+
+    def __init__(self, threads=IO_THREADS, reactor=reactor):
+        self.reactor = reactor
+        self.pool = ThreadPool(1, threads, name='datavault-io')
+        self._locks = weakref.WeakKeyDictionary()
+        self._shutdown_trigger = None
+
+    def start(self):
+        """Start the worker threads, and stop them when the reactor stops."""
+        self.pool.start()
+        self._shutdown_trigger = self.reactor.addSystemEventTrigger(
+                'during', 'shutdown', self.stop)
+
+    def stop(self):
+        """Stop the worker threads once queued calls have run."""
+        if self._shutdown_trigger is not None:
+            try:
+                self.reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            except ValueError:
+                pass # already running as the trigger
+            self._shutdown_trigger = None
+        self.pool.stop()
+
+    def run(self, key, f, *args, **kw):
+        """Call f(*args, **kw) in a worker thread.
+
+        The call is made after all earlier calls with the same key have
+        finished.  key must be weakly referenceable; typically it is the
+        object that owns the file.  Returns a Deferred firing with the
+        result of the call.
+        """
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = defer.DeferredLock()
+        return lock.run(threads.deferToThreadPool, self.reactor, self.pool,
+                        f, *args, **kw)
@@ -0,0 +1,93 @@
+"""Read HDF5 datasets directly from disk while the data vault writes them.
+
+Datasets created with the storage policy entry 'swmr' are written in
+HDF5's single-writer/multiple-reader mode, so other processes can read the
+files safely while rows are added, without going through LabRAD:
+
+    from datavault.reader import LiveDataset
+
+    with LiveDataset('/data/vault/00001 - scan.hdf5') as ds:
+        print ds.getTitle(), ds.getParamNames()
+        rows = ds.tail() # all rows so far
+        ...
+        rows = ds.tail() # rows added since the last call
+
+Only SWMR files can be opened, and HDF5 1.10 or later is required.  Files
+are opened read-only and are never modified.
+"""
+
+from __future__ import absolute_import
+
+import h5py
+
+from .backend import HDF5MetaData
+
+
+class LiveDataset(HDF5MetaData):
+    """Read-only view of an HDF5 dataset file that is being written.
+
+    The view is fixed when the file is opened and on each call of refresh;
+    the metadata accessors of HDF5MetaData (getTitle, getParameter,
+    getComments, ...) and read see the file as of then.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = h5py.File(filename, 'r', libver='latest', swmr=True)
+        self.pos = 0 # position of tail
+        self._datasets = {}
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self, name):
+        # keep one handle to each dataset, so that refresh updates it
+        if name not in self._datasets:
+            self._datasets[name] = self.file[name] if name in self.file else None
+        return self._datasets[name]
+
+    @property
+    def dataset(self):
+        return self._get('DataVault')
+
+    @property
+    def swmr(self):
+        return True
+
+    def _comment_dataset(self, create=False):
+        return self._get('Comments')
+
+    def _param_dataset(self, create=False):
+        return self._get('Parameters')
+
+    def refresh(self):
+        """Update the view to include data written since it was taken.
+
+        Returns the number of rows.
+        """
+        for name in ['DataVault', 'Comments', 'Parameters']:
+            dataset = self._get(name)
+            if dataset is not None:
+                dataset.refresh()
+        self._params = None
+        return len(self)
+
+    def __len__(self):
+        return self.dataset.shape[0]
+
+    def read(self, start=0, stop=None):
+        """Read rows from start to stop (default: the end) as a record array."""
+        return self.dataset[start:stop]
+
+    def tail(self):
+        """Refresh, and read the rows added since the last call of tail."""
+        nrows = self.refresh()
+        data = self.dataset[self.pos:nrows]
+        self.pos = nrows
+        return data
@@ -0,0 +1,314 @@
+"""Search index of the datasets in a data vault.
+
+The index is an SQLite database in the data directory.  For every dataset
+it holds the session path, name, title, creation time, variables, parameters
+and tags, so that datasets can be found without walking the directory tree.
+The session store keeps it up to date as datasets are created, tagged and
+given parameters.  The index of an existing vault can be rebuilt from the
+files on disk by running this module:
+
+    python -m datavault.search <datadir>
+
+Servers use the index when the 'Search Index' registry key is true and the
+index has been built.  Rebuild it after running a server without it.
+"""
+
+from __future__ import absolute_import
+
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import h5py
+
+from . import backend, util
+from . import filename_encode, filename_decode, DirectoryIndex
+
+INDEX_FILENAME = 'search_index.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    title TEXT,
+    created REAL,
+    UNIQUE (path, name));
+CREATE TABLE IF NOT EXISTS variables (
+    dataset INTEGER NOT NULL,
+    independent INTEGER NOT NULL,
+    label TEXT,
+    legend TEXT,
+    unit TEXT);
+CREATE TABLE IF NOT EXISTS params (
+    dataset INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    number REAL);
+CREATE TABLE IF NOT EXISTS tags (
+    dataset INTEGER NOT NULL,
+    tag TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS variables_dataset ON variables (dataset);
+CREATE INDEX IF NOT EXISTS params_dataset ON params (dataset, name);
+CREATE INDEX IF NOT EXISTS tags_dataset ON tags (dataset, tag);
+"""
+
+
+def path_to_str(path):
+    """Encode a session path like ['', 'a', 'b'] as '/a/b'.
+
+    Path components are filename-encoded, so they never contain '/'.
+    """
+    return ''.join('/' + filename_encode(p) for p in path[1:])
+
+def path_from_str(s):
+    return [''] + [filename_decode(p) for p in s.split('/')[1:]]
+
+def param_value(value):
+    """Get the (text, number) forms of a parameter value used for matching.
+
+    Real numbers are matched by value, anything else by its string form.
+    """
+    number = None
+    if isinstance(value, (bool, int, long, float)):
+        number = float(value)
+    if isinstance(value, unicode):
+        text = value.encode('utf-8')
+    elif isinstance(value, str):
+        text = value
+    else:
+        text = str(value)
+    return text, number
+
+def _regexp(pattern, s):
+    return s is not None and re.search(pattern, s) is not None
+
+
+class SearchIndex(object):
+    """SQLite index of dataset metadata, searchable with search()."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.text_factory = str
+        self.conn.create_function('REGEXP', 2, _regexp)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _datasetId(self, path, name):
+        row = self.conn.execute(
+                'SELECT id FROM datasets WHERE path = ? AND name = ?',
+                (path_to_str(path), name)).fetchone()
+        return row[0] if row else None
+
+    def addSession(self, path):
+        with self.conn:
+            self._addSession(path)
+
+    def _addSession(self, path):
+        self.conn.execute('INSERT OR IGNORE INTO sessions VALUES (?)',
+                          (path_to_str(path),))
+
+    def addDataset(self, path, name, title, created, independents,
+                   dependents, params=(), tags=()):
+        """Add a dataset to the index, replacing any existing entry."""
+        with self.conn:
+            self._addDataset(path, name, title, created, independents,
+                             dependents, params, tags)
+
+    def _addDataset(self, path, name, title, created, independents,
+                    dependents, params=(), tags=()):
+        old = self._datasetId(path, name)
+        if old is not None:
+            for table in ['variables', 'params', 'tags']:
+                self.conn.execute(
+                        'DELETE FROM {} WHERE dataset = ?'.format(table), (old,))
+            self.conn.execute('DELETE FROM datasets WHERE id = ?', (old,))
+        cur = self.conn.execute(
+                'INSERT INTO datasets (path, name, title, created) '
+                'VALUES (?, ?, ?, ?)',
+                (path_to_str(path), name, title, created))
+        dataset = cur.lastrowid
+        self.conn.executemany(
+                'INSERT INTO variables VALUES (?, 1, ?, NULL, ?)',
+                [(dataset, v.label, v.unit) for v in independents])
+        self.conn.executemany(
+                'INSERT INTO variables VALUES (?, 0, ?, ?, ?)',
+                [(dataset, v.label, v.legend, v.unit) for v in dependents])
+        self._addParams(dataset, params)
+        self._setTags(dataset, tags)
+
+    def addParams(self, path, name, params):
+        """Add (name, value) parameters to an indexed dataset."""
+        with self.conn:
+            dataset = self._datasetId(path, name)
+            if dataset is not None:
+                self._addParams(dataset, params)
+
+    def _addParams(self, dataset, params):
+        rows = []
+        for name, value in params:
+            text, number = param_value(value)
+            rows.append((dataset, name, text, number))
+        self.conn.executemany('INSERT INTO params VALUES (?, ?, ?, ?)', rows)
+
+    def setTags(self, path, name, tags):
+        """Replace the tags of an indexed dataset."""
+        with self.conn:
+            dataset = self._datasetId(path, name)
+            if dataset is not None:
+                self.conn.execute('DELETE FROM tags WHERE dataset = ?',
+                                  (dataset,))
+                self._setTags(dataset, tags)
+
+    def _setTags(self, dataset, tags):
+        self.conn.executemany('INSERT INTO tags VALUES (?, ?)',
+                              [(dataset, tag) for tag in tags])
+
+    def search(self, under=None, titles=(), tags=(), params=(),
+               created_after=None, created_before=None):
+        """Find datasets matching all of the given filters.
+
+        under:     session path to search below (default: the whole vault)
+        titles:    regular expressions that must all match the title
+        tags:      tags the dataset must have, or not have if prefixed by '-'
+        params:    (name, value) pairs of parameters the dataset must have
+        created_after, created_before:  creation time limits, in seconds
+                   since the epoch
+
+        Returns a sorted list of (path, name) tuples.
+        """
+        sql = ['SELECT path, name FROM datasets d WHERE 1']
+        args = []
+        if under is not None and len(under) > 1:
+            prefix = path_to_str(under)
+            sql.append('AND (path = ? OR substr(path, 1, ?) = ?)')
+            args += [prefix, len(prefix) + 1, prefix + '/']
+        for pattern in titles:
+            re.compile(pattern) # raise on bad patterns rather than in sqlite
+            sql.append('AND title REGEXP ?')
+            args.append(pattern)
+        for tag in tags:
+            if tag[:1] == '-':
+                sql.append('AND NOT EXISTS')
+                tag = tag[1:]
+            else:
+                sql.append('AND EXISTS')
+            sql.append('(SELECT 1 FROM tags t WHERE t.dataset = d.id '
+                       'AND t.tag = ?)')
+            args.append(tag)
+        for name, value in params:
+            text, number = param_value(value)
+            sql.append('AND EXISTS (SELECT 1 FROM params p WHERE '
+                       'p.dataset = d.id AND p.name = ?')
+            if number is not None:
+                sql.append('AND p.number = ?)')
+                args += [name, number]
+            else:
+                sql.append('AND p.value = ?)')
+                args += [name, text]
+        if created_after is not None:
+            sql.append('AND created >= ?')
+            args.append(created_after)
+        if created_before is not None:
+            sql.append('AND created <= ?')
+            args.append(created_before)
+        sql.append('ORDER BY path, name')
+        rows = self.conn.execute(' '.join(sql), args).fetchall()
+        return [(path_from_str(path), name) for path, name in rows]
+
+    def rebuild(self, datadir, log=None):
+        """Replace the contents of the index with what is on disk.
+
+        Walks every session directory below datadir and reads the metadata
+        of every dataset.  Datasets that cannot be read are skipped and
+        reported to log, if given.
+        """
+        with self.conn:
+            for table in ['sessions', 'datasets', 'variables', 'params', 'tags']:
+                self.conn.execute('DELETE FROM {}'.format(table))
+            self._rebuild(datadir, [''], log)
+
+    def _rebuild(self, dirname, path, log):
+        self._addSession(path)
+        dataset_tags = {}
+        infofile = os.path.join(dirname, 'session.ini')
+        if os.path.exists(infofile):
+            S = util.DVSafeConfigParser()
+            S.read(infofile)
+            if S.has_section('Tags'):
+                dataset_tags = eval(S.get('Tags', 'datasets', raw=True))
+        index = DirectoryIndex(os.listdir(dirname))
+        for name in index.datasets:
+            file_base = os.path.join(dirname, filename_encode(name))
+            try:
+                if index.types[name] in ('csv', 'dvb'):
+                    meta = backend.IniData()
+                    meta.infofile = file_base + '.ini'
+                    meta.load()
+                    self._addFromMetadata(path, name, meta, dataset_tags)
+                else:
+                    with h5py.File(file_base + '.hdf5', 'r') as f:
+                        meta = backend.HDF5MetaData()
+                        meta.dataset = f['DataVault']
+                        self._addFromMetadata(path, name, meta, dataset_tags)
+            except Exception as e:
+                if log is not None:
+                    log('Skipping {}: {}'.format(file_base, e))
+        for d in index.dirs:
+            self._rebuild(os.path.join(dirname, filename_encode(d) + '.dir'),
+                          path + [d], log)
+
+    def _addFromMetadata(self, path, name, meta, dataset_tags):
+        params = [(p, meta.getParameter(p)) for p in meta.getParamNames()]
+        self._addDataset(path, name, meta.getTitle(), meta.getCreationTime(),
+                         meta.getIndependents(), meta.getDependents(), params,
+                         sorted(dataset_tags.get(name, [])))
+
+def open_index(datadir, log=None):
+    """Open the search index of a vault, building it if it doesn't exist."""
+    filename = os.path.join(datadir, INDEX_FILENAME)
+    exists = os.path.exists(filename)
+    index = SearchIndex(filename)
+    if not exists:
+        index.rebuild(datadir, log)
+    return index
+
+def open_existing_index(datadir):
+    """Open the search index of a vault, or return None if it isn't built.
+
+    Building the index reads the metadata of every dataset, which takes a
+    long time for a large vault, so servers do not build it when they
+    start; run python -m datavault.search <datadir> to build it.
+    """
+    filename = os.path.join(datadir, INDEX_FILENAME)
+    if not os.path.exists(filename):
+        return None
+    return SearchIndex(filename)
+
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        print 'usage: python -m datavault.search <datadir>'
+        return 1
+    datadir = argv[1]
+    t = time.time()
+    def log(msg):
+        print msg
+    index = SearchIndex(os.path.join(datadir, INDEX_FILENAME))
+    index.rebuild(datadir, log)
+    count = index.conn.execute('SELECT COUNT(*) FROM datasets').fetchone()[0]
+    index.close()
+    print 'Indexed {} datasets in {:.1f} s.'.format(count, time.time() - t)
+
+if __name__ == '__main__':
+    sys.exit(main())
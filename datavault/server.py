@@ -1,13 +1,18 @@
 from __future__ import absolute_import
 
 import collections
+import tempfile
+import time
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import gatherResults, inlineCallbacks, maybeDeferred
 import twisted.internet.task
 import numpy as np
 from labrad.server import LabradServer, Signal, setting
 
-from . import errors
+from . import PushListener, PUSH_MAX_ROWS, backend, errors, util
+
+# default size of the pieces an exported dataset is returned in
+EXPORT_CHUNK_SIZE = 1 << 20
 
 
 class DataVault(LabradServer):
@@ -27,11 +32,20 @@ class DataVault(LabradServer):
         self.onDataAvailable = Signal(543619, 'signal: data available', '')
         self.onNewParameter = Signal(543620, 'signal: new parameter', '')
         self.onCommentsAvailable = Signal(543621, 'signal: comments available', '')
+        self.onDataPushed = Signal(543623, 'signal: data pushed',
+                                   '(w{start}, *2v{rows})')
 
     def initServer(self):
         # create root session
         _root = self.session_store.get([''])
 
+    def stopServer(self):
+        # write out any data still buffered in memory, then close the data
+        # files, which checkpoints binary datasets
+        d = self.session_store.flush()
+        d.addCallback(lambda _: backend.get_file_pool().close_all())
+        return d
+
     def contextKey(self, c):
         """The key used to identify a given context for notifications"""
         return c.ID
@@ -55,17 +69,53 @@ class DataVault(LabradServer):
                 removeFromList(dataset.listeners)
                 removeFromList(dataset.param_listeners)
                 removeFromList(dataset.comment_listeners)
+                dataset.removePushListener(key)
 
     def getSession(self, c):
         """Get a session object for the current path."""
         return c['session']
 
+    def getStoragePolicy(self, spec=None):
+        """Get the storage policy for a new dataset.
+
+        Entries in spec override the server-wide default policy.
+        """
+        policy = self.session_store.storage_policy
+        if spec:
+            policy = backend.parse_storage_policy(spec, policy)
+        return policy
+
+    def getColumns(self, dataset, columns):
+        """Get the indexes of the selected columns, or None for all."""
+        if not columns:
+            return None
+        return [dataset.findColumn(col) for col in columns]
+
     def getDataset(self, c):
         """Get a dataset object for the current dataset."""
         if 'dataset' not in c:
             raise errors.NoDatasetError()
         return c['datasetObj']
 
+    def readRows(self, c, dataset, limit, start, **kw):
+        """Read rows from start, and continue reading from the end in future.
+
+        The read runs in the I/O executor, if there is one; then a Deferred
+        is returned.  Keyword arguments are passed to Dataset.readData.
+        """
+        def done((data, pos)):
+            c['filepos'] = pos
+            dataset.keepStreaming(self.contextKey(c), pos)
+            return data
+        d = dataset.readData(limit, start, **kw)
+        d.addCallback(done)
+        return util.sync_result(d)
+
+    def stopPushing(self, c):
+        """Stop pushing rows of the current dataset, before opening another."""
+        if 'datasetObj' in c:
+            c['datasetObj'].removePushListener(self.contextKey(c))
+
     @setting(5, returns=['*s'])
     def dump_existing_sessions(self, c):
         return ['/'.join(session.path)
@@ -147,8 +197,9 @@ class DataVault(LabradServer):
     @setting(9, name='s',
                 independents=['*s', '*(ss)'],
                 dependents=['*s', '*(sss)'],
+                storage='s',
                 returns='(*s{path}, s{name})')
-    def new(self, c, name, independents, dependents):
+    def new(self, c, name, independents, dependents, storage=None):
         """Create a new Dataset.
 
         Independent and dependent variables can be specified either
@@ -159,12 +210,25 @@ class DataVault(LabradServer):
         axis label that can be shared among traces, while legend is
         a legend entry that should be unique for each trace.
         Returns the path and name for this dataset.
+
+        The optional storage argument selects how the data is laid out on
+        disk, overriding the server default for this dataset only.  It is a
+        comma-separated list of entries such as 'chunk=1024, gzip=4,
+        shuffle, growth=2'; see backend.parse_storage_policy for details.
+        'format=binary' stores the dataset in the version 4 binary format,
+        which is faster to append to than HDF5.  'swmr' writes an HDF5
+        dataset in single-writer/multiple-reader mode, so that it can be
+        read from disk while it is written (see datavault.reader).
         """
+        self.stopPushing(c)
         session = self.getSession(c)
-        dataset = session.newDataset(name or 'untitled', independents, dependents)
+        policy = self.getStoragePolicy(storage)
+        dataset = session.newDataset(name or 'untitled', independents,
+                                     dependents, storage=policy)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0 # start at the beginning
+        c['decimatepos'] = 0
         c['commentpos'] = 0
         c['writing'] = True
         return c['path'], c['dataset']
@@ -172,8 +236,9 @@ class DataVault(LabradServer):
     @setting(1009, name='s', 
              independents='*(s*iss)',
              dependents='*(ss*iss)',
+             storage='s',
              returns=['*ss'])
-    def new_ex(self, c, name, independents, dependents):
+    def new_ex(self, c, name, independents, dependents, storage=None):
         """Create a new extended dataset
 
         Independents are specified as: (label, shape, type, unit)
@@ -199,12 +264,49 @@ class DataVault(LabradServer):
         code.  The name and parameters will be there, but no actual data.
 
         The legacy format requires each column be a scalar v[unit] type.
+
+        storage optionally overrides the server's storage policy, as in new().
         """
+        self.stopPushing(c)
         session = self.getSession(c)
-        dataset = session.newDataset(name, independents, dependents, extended=True)
+        policy = self.getStoragePolicy(storage)
+        dataset = session.newDataset(name, independents, dependents,
+                                     extended=True, storage=policy)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0 # start at the beginning
+        c['decimatepos'] = 0
+        c['commentpos'] = 0
+        c['writing'] = True
+        return c['path'], c['dataset']
+
+    @setting(11, 'new grid', name='s',
+             axes='*(s{label}, s{unit}, *v{values})',
+             dependents=['*s', '*(sss)'],
+             storage='s',
+             returns='(*s{path}, s{name})')
+    def new_grid(self, c, name, axes, dependents, storage=None):
+        """Create a new dataset of values on a grid, such as a 2-D sweep.
+
+        Each independent variable is an axis of the grid, given as (label,
+        unit, values), where values are the points along the axis.  The
+        first axis may have no values, and then grows as data is written.
+        Dependents are given as in new().  The values of the dependents are
+        stored as an N-D array, without repeating the axis values, and are
+        written with 'put slab' and read with 'get slice'.  'get' and
+        'get_ex' still work, and return one row per point of the grid, in
+        order with the last axis varying fastest.
+        storage optionally overrides the server's storage policy, as in new().
+        """
+        self.stopPushing(c)
+        session = self.getSession(c)
+        policy = self.getStoragePolicy(storage)
+        dataset = session.newGridDataset(name or 'untitled', axes, dependents,
+                                         storage=policy)
+        c['dataset'] = dataset.name # not the same as name; has number prefixed
+        c['datasetObj'] = dataset
+        c['filepos'] = 0 # start at the beginning
+        c['decimatepos'] = 0
         c['commentpos'] = 0
         c['writing'] = True
         return c['path'], c['dataset']
@@ -216,11 +318,13 @@ class DataVault(LabradServer):
         You can specify the dataset by name or number.
         Returns the path and name for this dataset.
         """
+        self.stopPushing(c)
         session = self.getSession(c)
         dataset = session.openDataset(name)
         c['dataset'] = dataset.name # not the same as name; has number prefixed
         c['datasetObj'] = dataset
         c['filepos'] = 0
+        c['decimatepos'] = 0
         c['commentpos'] = 0
         c['writing'] = append
         key = self.contextKey(c)
@@ -235,6 +339,8 @@ class DataVault(LabradServer):
         1.x:   CSV dataset
         2.x:   Simple HDF5 dataset
         3.x:   Extended dataset
+        4.x:   Binary dataset
+        5.x:   Grid dataset
         """
         dataset = self.getDataset(c)
         return dataset.version()
@@ -272,8 +378,7 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         if not c['writing']:
             raise errors.ReadOnlyError()
-        list_data = [tuple(row) for row in data]
-        dataset.addData(np.core.records.fromrecords(list_data, dtype=dataset.data.dtype))
+        dataset.addData(util.records_from_rows(data, dataset.data.dtype))
 
     @setting(2020, data='?', returns='')
     def add_ex_t(self, c, data):
@@ -288,8 +393,9 @@ class DataVault(LabradServer):
             raise errors.ReadOnlyError()
         dataset.addData(np.core.records.fromarrays(data, dtype=dataset.data.dtype))
 
-    @setting(21, limit='w', startOver='b', returns='*2v')
-    def get(self, c, limit=None, startOver=False):
+    @setting(21, limit='w', startOver='b', columns=['*w', '*s'],
+             returns='*2v')
+    def get(self, c, limit=None, startOver=False, columns=None):
         """Get data from the current dataset.
 
         Limit is the maximum number of rows of data to return, with
@@ -297,32 +403,208 @@ class DataVault(LabradServer):
         startOver flag to true will return data starting at the beginning
         of the dataset.  By default, only new data that has not been seen
         in this context is returned.
+        Columns optionally selects the columns to return, by index or by
+        label (or legend, for dependents); only those are read from disk.
         """
         dataset = self.getDataset(c)
+        columns = self.getColumns(dataset, columns)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], simpleOnly=True)
+        return self.readRows(c, dataset, limit, c['filepos'], simpleOnly=True,
+                             columns=columns)
+
+    @setting(22, 'get decimated', points='w', method='s', startOver='b',
+             columns=['*w', '*s'], returns='*2v')
+    def get_decimated(self, c, points, method='stride', startOver=False,
+                      columns=None):
+        """Get a reduced view of the current dataset for plotting.
+
+        Rows are combined in bins sized so that the whole dataset reduces to
+        about the given number of points.  Method is 'stride' (first row of
+        each bin), 'mean' (mean of each column) or 'minmax' (two rows per
+        bin, with the minimum and then the maximum of each column).  Like
+        get, only rows not yet seen in this context are returned, unless
+        startOver is true, so a plot can fetch just the reduced tail of a
+        growing dataset.  Only datasets of scalar values are supported.
+        Columns optionally selects the columns to return, as for get.
+        """
+        if method not in util.DECIMATION_METHODS:
+            raise errors.DecimationMethodError(method)
+        dataset = self.getDataset(c)
+        columns = self.getColumns(dataset, columns)
+        c['decimatepos'] = 0 if startOver else c['decimatepos']
+        def done((data, pos)):
+            c['decimatepos'] = pos
+            dataset.keepStreaming(self.contextKey(c), pos)
+            return data
+        d = dataset.runIO(dataset.getDecimated, points, method,
+                          c['decimatepos'], columns)
+        d.addCallback(done)
+        return util.sync_result(d)
+
+    @setting(23, 'get range', column=['w', 's'], low='v', high='v',
+             transpose='b', columns=['*w', '*s'], returns='?')
+    def get_range(self, c, column, low, high, transpose=False, columns=None):
+        """Get the rows whose value in a sorted column is in [low, high].
+
+        Column is given by index or by label (or legend, for dependents),
+        and must be a real scalar column whose values never decrease, such
+        as a timestamp.  Rows are found by binary search over a sparse index
+        that is kept in the dataset file.  Data is returned in the format of
+        get_ex, or get_ex_t if transpose is true.  Afterwards, get continues
+        from the end of the range, so new rows can be streamed from there.
+        Columns optionally selects the columns to return, as for get.
+        """
+        dataset = self.getDataset(c)
+        column = dataset.findColumn(column)
+        columns = self.getColumns(dataset, columns)
+        def read((start, stop)):
+            return self.readRows(c, dataset, stop - start, start,
+                                 transpose=transpose, columns=columns)
+        d = dataset.runIO(dataset.findRange, column, low, high)
+        d.addCallback(read)
+        return util.sync_result(d)
+
+    @setting(24, 'stream rows', enable='b', max_rows='w',
+                 columns=['*w', '*s'], returns='')
+    def stream_rows(self, c, enable=True, max_rows=PUSH_MAX_ROWS,
+                    columns=None):
+        """Have new rows of the current dataset pushed to this context.
+
+        Rows that have not been read yet, and rows added later, are sent in
+        the 'data pushed' signal as (start row, rows) instead of a 'data
+        available' notification, and advance the position of 'get'.  If
+        more than max_rows rows are waiting, 'data available' is sent
+        instead; read with 'get' to catch up, and pushing resumes.  Columns
+        selects the columns to push, as in 'get'.  Pushing stops when
+        enable is false or another dataset is opened.
+        """
+        dataset = self.getDataset(c)
         key = self.contextKey(c)
-        dataset.keepStreaming(key, c['filepos'])
-        return data
-
-    @setting(1021, limit='w', startOver='b', returns='?')
-    def get_ex(self, c, limit=None, startOver=False):
+        if not enable:
+            dataset.removePushListener(key)
+            return
+        columns = self.getColumns(dataset, columns)
+        if isinstance(dataset.data, backend.ExtendedHDF5Data):
+            # rows are pushed as *2v
+            dataset.data.checkSimple(columns)
+        def advance(pos):
+            c['filepos'] = pos
+        listener = PushListener(c['filepos'], columns, max_rows, advance)
+        dataset.addPushListener(key, listener)
+
+    @setting(25, 'poll', datasets=['*(*s{path}, s{name}, w{position})',
+                                   '*(*s{path}, w{number}, w{position})'],
+             limit='w', columns=['*w', '*s'],
+             returns='*(w{position}, *2v{rows})')
+    def poll(self, c, datasets, limit=None, columns=None):
+        """Get new rows from several datasets at once.
+
+        Each dataset is given by its path, as returned by 'cd', its name or
+        number, and the position to read from, which is 0 at first and then
+        the position returned by the previous poll.  For each dataset, up to
+        limit rows (default: all) from that position are returned, along
+        with the position after them.  Columns optionally selects the
+        columns to return, by index or by label (or legend, for
+        dependents); it must apply to every dataset.  Afterwards, a 'data
+        available' signal is sent to this context when any of the datasets
+        has rows after the returned position, as for 'get'; datasets of
+        earlier polls that are not in this one are no longer signalled.
+        Datasets do not have to be opened in this context, and the current
+        dataset is not changed.
+        """
+        key = self.contextKey(c)
+        # keep polled datasets loaded, so their listeners are kept
+        polled = {}
+        opened = []
+        reads = []
+        for path, name, pos in datasets:
+            path = list(path)
+            if not self.session_store.exists(path):
+                raise errors.DirectoryNotFoundError(path)
+            dataset = self.session_store.get(path).openDataset(name)
+            polled[tuple(path), dataset.name] = dataset
+            opened.append(dataset)
+            reads.append(dataset.readData(
+                    limit, pos, simpleOnly=True,
+                    columns=self.getColumns(dataset, columns)))
+        for dataset in c.get('polled', {}).values():
+            if dataset not in opened and dataset is not c.get('datasetObj'):
+                dataset.listeners.discard(key)
+        c['polled'] = polled
+        def done(results):
+            for dataset, (data, pos) in zip(opened, results):
+                dataset.keepStreaming(key, pos)
+            return [(pos, data) for data, pos in results]
+        d = gatherResults(reads, consumeErrors=True)
+        d.addCallback(done)
+        d.addErrback(lambda f: f.value.subFailure)
+        return util.sync_result(d)
+
+    @setting(26, 'put slab', offset='*w', data='?', axis_values='*v',
+             returns='')
+    def put_slab(self, c, offset, data, axis_values=None):
+        """Write a block of values into the current grid dataset.
+
+        Data is an array with a dimension for each axis and a last one for
+        the dependents, which may be left out if there is only one.  Offset
+        is the index of the block's first point along each axis, with
+        missing entries taken as 0.  A block may extend a growing first axis;
+        then axis_values can give the axis values for the block's extent
+        along it, which otherwise are the indexes.
+        """
+        dataset = self.getDataset(c)
+        if not c['writing']:
+            raise errors.ReadOnlyError()
+        return util.sync_result(dataset.writeSlab(offset, data, axis_values))
+
+    @setting(27, 'get slice', slices=['*(w{start}, w{stop}, w{step})',
+                                      '*(w{start}, w{stop})'],
+             columns=['*w', '*s'], returns='?')
+    def get_slice(self, c, slices=[], columns=None):
+        """Read a block of the current grid dataset.
+
+        Slices gives (start, stop) or (start, stop, step) for each of the
+        leading axes; stop is clipped to the length of the axis, and the
+        remaining axes are read whole.  Columns optionally selects the
+        dependents to read, by column index as in 'get' (the axes come
+        first) or by label (or legend).  Returns an
+        array with a dimension for each axis and a last one for the
+        dependents.  Get the axis values with 'grid axes'.
+        """
+        dataset = self.getDataset(c)
+        slices = [tuple(sl) + (1,) * (3 - len(sl)) for sl in slices]
+        dependents = None
+        if columns:
+            naxes = len(dataset.getIndependents())
+            dependents = []
+            for col in columns:
+                idx = dataset.findColumn(col)
+                if idx < naxes:
+                    raise errors.GridDataError(
+                            'column {!r} is an axis'.format(col))
+                dependents.append(idx - naxes)
+        return util.sync_result(dataset.readSlice(slices, dependents))
+
+    @setting(1021, limit='w', startOver='b', columns=['*w', '*s'],
+             returns='?')
+    def get_ex(self, c, limit=None, startOver=False, columns=None):
         """Get data from the current dataset in the extended format.
 
         Data is returned as *(...).  That is, a list of clusters, one per
         row.  Because of the inefficiency of python flattening and
         unflattening cluster arrays, consider using get_ex_t for
-        performance.
+        performance.  Columns optionally selects the columns to return, as
+        for get.
         """
         dataset = self.getDataset(c)
+        columns = self.getColumns(dataset, columns)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=False)
-        ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        return self.readRows(c, dataset, limit, c['filepos'], transpose=False,
+                             columns=columns)
 
-    @setting(2021, limit='w', startOver='b', returns='?')
-    def get_ex_t(self, c, limit=None, startOver=False):
+    @setting(2021, limit='w', startOver='b', columns=['*w', '*s'],
+             returns='?')
+    def get_ex_t(self, c, limit=None, startOver=False, columns=None):
         """Get data from the current dataset in the extended format.
 
         Data is returned as (*c1*c2*c3): that is, a cluster of lists,
@@ -330,14 +612,13 @@ class DataVault(LabradServer):
         the array dimension of that particular column.  Scalar columns
         result in 1-D lists.  This is the transpose of the normal
         format, but is more efficient for pylabrad flatten/unflatten
-        code.
+        code.  Columns optionally selects the columns to return, as for get.
         """
         dataset = self.getDataset(c)
+        columns = self.getColumns(dataset, columns)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=True)
-        ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        return self.readRows(c, dataset, limit, c['filepos'], transpose=True,
+                             columns=columns)
 
     @setting(100, returns='(*(ss){independents}, *(sss){dependents})')
     def variables(self, c):
@@ -386,6 +667,11 @@ class DataVault(LabradServer):
         ds = self.getDataset(c)
         return ds.getTransposeType()
 
+    @setting(104, 'grid axes', returns='*(s{label}, s{unit}, *v{values})')
+    def grid_axes(self, c):
+        """Get the axes of the current grid dataset, with their values."""
+        return self.getDataset(c).getAxes()
+
     @setting(120, returns='*s')
     def parameters(self, c):
         """Get a list of parameter names."""
@@ -398,13 +684,15 @@ class DataVault(LabradServer):
     def add_parameter(self, c, name, data):
         """Add a new parameter to the current dataset."""
         dataset = self.getDataset(c)
-        dataset.addParameter(name, data)
+        d = maybeDeferred(dataset.addParameter, name, data)
+        d.addCallback(lambda _: None)
+        return util.sync_result(d)
 
     @setting(124, 'add parameters', params='?{((s?)(s?)...)}', returns='')
     def add_parameters(self, c, params):
         """Add a new parameter to the current dataset."""
         dataset = self.getDataset(c)
-        dataset.addParameters(params)
+        return dataset.addParameters(params)
 
 
     @setting(126, 'get name', returns='s')
@@ -429,12 +717,157 @@ class DataVault(LabradServer):
         are not allowed).
         """
         dataset = self.getDataset(c)
-        names = dataset.getParamNames()
-        params = tuple((name, dataset.getParameter(name)) for name in names)
         key = self.contextKey(c)
         dataset.param_listeners.add(key) # send a message when new parameters are added
-        if len(params):
-            return params
+        def result(params):
+            if len(params):
+                return tuple(params)
+        d = maybeDeferred(dataset.getParameters)
+        d.addCallback(result)
+        return util.sync_result(d)
+
+    @setting(150, 'get statistics', columns=['*w', '*s'], start='w',
+             stop='w', returns='*(wvvvv)')
+    def get_statistics(self, c, columns, start=0, stop=None):
+        """Get statistics of columns of the current dataset.
+
+        For each column, given by index or by label (or legend, for
+        dependents), returns (count, mean, std, min, max) over the rows
+        from start up to stop, by default the end of the dataset.  NaNs
+        are not counted and std is the population standard deviation.
+        Results up to the end of the dataset are cached, so later calls
+        on a growing dataset only process the new rows.
+        """
+        dataset = self.getDataset(c)
+        columns = [dataset.findColumn(col) for col in columns]
+        def stats():
+            return [dataset.getStatistics(col, start, stop) for col in columns]
+        return util.sync_result(dataset.runIO(stats))
+
+    @setting(151, 'get histogram', column=['w', 's'], bins='w', low='v',
+             high='v', start='w', stop='w', returns='(*v{edges}, *w{counts})')
+    def get_histogram(self, c, column, bins, low=None, high=None, start=0,
+                      stop=None):
+        """Get a histogram of a column of the current dataset.
+
+        Counts values in bins evenly spaced from low to high, which default
+        to the minimum and maximum of the column.  Returns the bins+1 bin
+        edges and the counts in each bin.  The rows used and caching are as
+        for get statistics.
+        """
+        dataset = self.getDataset(c)
+        column = dataset.findColumn(column)
+        return util.sync_result(dataset.runIO(
+                dataset.getHistogram, column, bins, low, high, start, stop))
+
+    @setting(160, 'export dataset', offset='w', chunk_size='w', returns='y')
+    def export_dataset(self, c, offset=0, chunk_size=EXPORT_CHUNK_SIZE):
+        """Export the current dataset, with parameters, comments and tags.
+
+        The exported dataset is returned in pieces of at most chunk_size
+        bytes, starting at byte offset.  Call this with offset 0 to start
+        an export, which replaces any earlier one in this context, then with
+        the offset after the pieces received so far, until it returns an
+        empty string.  Pass the concatenated pieces to 'import dataset' to
+        recreate the dataset in another directory or on another data vault.
+        """
+        dataset = self.getDataset(c)
+        def read(_):
+            f = c['export'][1]
+            f.seek(offset)
+            data = f.read(chunk_size)
+            if not data:
+                f.close()
+                del c['export']
+            return data
+        # datasets in different directories may have the same name
+        key = tuple(dataset.session_path), dataset.name
+        exported, f = c.get('export', (None, None))
+        if offset:
+            if exported != key:
+                raise errors.DatasetExportError(
+                        'no export of this dataset in progress')
+            return read(None)
+        if f is not None:
+            f.close()
+        f = tempfile.TemporaryFile()
+        c['export'] = key, f
+        d = dataset.session.exportDataset(dataset, f)
+        d.addCallback(lambda _: f.seek(0))
+        d.addCallback(read)
+        return util.sync_result(d)
+
+    @setting(161, 'import chunk', data='y', returns='')
+    def import_chunk(self, c, data):
+        """Add a piece of an exported dataset to be imported.
+
+        Use this to send exported datasets that are too large for a single
+        request, then finish with 'import dataset'.
+        """
+        if 'import' not in c:
+            c['import'] = tempfile.TemporaryFile()
+        c['import'].write(data)
+
+    @setting(162, 'import dataset', data='y',
+                  returns='(*s{path}, s{name})')
+    def import_dataset(self, c, data=''):
+        """Create a new dataset in the current directory from an export.
+
+        data is the exported dataset, or its last piece if the previous
+        pieces were sent with 'import chunk'.  The new dataset is numbered
+        like a new one, and opened for reading.  Returns the path and name
+        of the new dataset.
+        """
+        f = c.pop('import', None) or tempfile.TemporaryFile()
+        try:
+            f.write(data)
+            f.seek(0)
+            d = self.getSession(c).importDataset(f)
+        except Exception:
+            f.close()
+            raise
+        def close(result):
+            f.close()
+            return result
+        def opened(dataset):
+            self.stopPushing(c)
+            c['dataset'] = dataset.name
+            c['datasetObj'] = dataset
+            c['filepos'] = 0
+            c['decimatepos'] = 0
+            c['commentpos'] = 0
+            c['writing'] = False
+            key = self.contextKey(c)
+            dataset.keepStreaming(key, 0)
+            dataset.keepStreamingComments(key, 0)
+            return c['path'], c['dataset']
+        d.addBoth(close)
+        d.addCallback(opened)
+        return util.sync_result(d)
+
+    @setting(163, 'copy dataset', path='*s', name=['s', 'w'],
+                  returns='(*s{path}, s{name})')
+    def copy_dataset(self, c, path, name=None):
+        """Copy a dataset into the directory with absolute path path.
+
+        The dataset is given by name or number in the current directory,
+        or is the current dataset if not specified.  Its data, parameters,
+        comments and tags are copied on the server.  The current directory
+        and dataset are unchanged.  Returns the path and name of the copy.
+        """
+        session = self.getSession(c)
+        if name is None:
+            dataset = self.getDataset(c)
+        else:
+            dataset = session.openDataset(name)
+        if not path or path[0] != '':
+            path = [''] + list(path)
+        if not self.session_store.exists(path):
+            raise errors.DirectoryNotFoundError(path)
+        dest = self.session_store.get(path)
+        d = dataset.session.copyDataset(dataset, dest)
+        d.addCallback(lambda copy: (path, copy.name))
+        return util.sync_result(d)
 
     @setting(200, 'add comment', comment=['s'], user=['s'], returns=[''])
     def add_comment(self, c, comment, user='anonymous'):
@@ -448,10 +881,14 @@ class DataVault(LabradServer):
         """Get comments for the current dataset."""
         dataset = self.getDataset(c)
         c['commentpos'] = 0 if startOver else c['commentpos']
-        comments, c['commentpos'] = dataset.getComments(limit, c['commentpos'])
-        key = self.contextKey(c)
-        dataset.keepStreamingComments(key, c['commentpos'])
-        return comments
+        def result((comments, pos)):
+            c['commentpos'] = pos
+            key = self.contextKey(c)
+            dataset.keepStreamingComments(key, pos)
+            return comments
+        d = maybeDeferred(dataset.getComments, limit, c['commentpos'])
+        d.addCallback(result)
+        return util.sync_result(d)
 
     @setting(300, 'update tags', tags=['s', '*s'],
                   dirs=['s', '*s'], datasets=['s', '*s'],
@@ -489,6 +926,66 @@ class DataVault(LabradServer):
             datasets = [datasets]
         return sess.getTags(dirs, datasets)
 
+    @setting(302, 'search', titles=['s', '*s'], tags=['s', '*s'],
+                  params='*(s?)', created_after='t', created_before='t',
+                  returns='*(*ss)')
+    def search(self, c, titles=[], tags=[], params=[], created_after=None,
+               created_before=None):
+        """Search for datasets in and below the current directory.
+
+        titles are regular expressions that must all match the dataset
+        title.  Datasets must have all given tags, and none of the tags
+        prefixed by a minus sign '-'.  params are (name, value) pairs of
+        parameters the datasets must have; numbers are compared by value,
+        other parameters by their string form.  created_after and
+        created_before limit the creation time of the datasets.
+
+        Returns a list of (path, name) for the matching datasets.
+        """
+        search_index = self.session_store.search_index
+        if search_index is None:
+            raise errors.SearchNotEnabledError()
+        if isinstance(titles, str):
+            titles = [titles]
+        if isinstance(tags, str):
+            tags = [tags]
+        if created_after is not None:
+            created_after = time.mktime(created_after.timetuple())
+        if created_before is not None:
+            created_before = time.mktime(created_before.timetuple())
+        return search_index.search(c['path'], titles, tags, params,
+                                   created_after, created_before)
+
+    @setting(500, 'file pool stats',
+                  returns='(w{open}, w{max open}, w{hits}, w{misses}, '
+                          'w{evictions}, w{expirations})')
+    def file_pool_stats(self, c):
+        """Get statistics of the pool of open dataset files.
+
+        Returns the number of open files and the limit on it, the number of
+        file accesses that found the file open (hits) or had to open it
+        (misses), and the number of files closed to stay within the limit
+        (evictions) or because they were idle (expirations).
+        """
+        return backend.get_file_pool().stats()
+
+    @setting(501, 'data cache stats',
+                  returns='(w{datasets}, v{bytes}, v{max bytes}, w{hits}, '
+                          'w{misses}, w{evictions}, w{expirations})')
+    def data_cache_stats(self, c):
+        """Get statistics of the cache of csv dataset contents in memory.
+
+        Returns the number of datasets held in memory, the bytes they use
+        and the budget for them, the number of accesses that found the data
+        in memory (hits) or had to load it (misses), and the number of
+        datasets dropped to stay within the budget (evictions) or because
+        they were idle (expirations).
+        """
+        (datasets, nbytes, max_bytes, hits, misses, evictions,
+         expirations) = backend.get_data_cache().stats()
+        return (datasets, float(nbytes), float(max_bytes), hits, misses,
+                evictions, expirations)
+
 
 class DataVaultMultiHead(DataVault):
     """Data Vault server with additional settings for running multi-headed.
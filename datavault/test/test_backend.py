@@ -1,5 +1,6 @@
 import datetime
 import h5py
+import mock
 import numpy as np
 import os
 import pytest
@@ -14,7 +15,7 @@ from labrad import units as U
 
 from twisted.internet import task
 
-from datavault import backend, errors
+from datavault import backend, errors, util
 
 
 def _unique_filename(suffix='.hdf5'):
@@ -70,6 +71,43 @@ class UtilityMethodsTest(_TestCase):
                 ValueError, backend.labrad_urldecode, url_string)
 
 
+class StoragePolicyTest(_TestCase):
+    def test_parse_empty(self):
+        policy = backend.parse_storage_policy('')
+        self.assertEqual(policy, backend.DEFAULT_STORAGE_POLICY)
+
+    def test_parse_all_options(self):
+        policy = backend.parse_storage_policy(
+                'chunk=1024, gzip=4, shuffle, growth=2')
+        self.assertEqual(policy.chunk_rows, 1024)
+        self.assertEqual(policy.compression, 'gzip')
+        self.assertEqual(policy.compression_opts, 4)
+        self.assertTrue(policy.shuffle)
+        self.assertEqual(policy.growth, 2.0)
+
+    def test_parse_overrides_default(self):
+        default = backend.parse_storage_policy('lzf, growth=1.5')
+        policy = backend.parse_storage_policy('chunk=auto, shuffle=no', default)
+        self.assertEqual(policy.chunk_rows, None)
+        self.assertEqual(policy.compression, 'lzf')
+        self.assertFalse(policy.shuffle)
+        self.assertEqual(policy.growth, 1.5)
+
+    def test_parse_format(self):
+        policy = backend.parse_storage_policy('format=binary')
+        self.assertEqual(policy.format, 'binary')
+
+    def test_parse_swmr(self):
+        self.assertFalse(backend.parse_storage_policy('').swmr)
+        self.assertTrue(backend.parse_storage_policy('swmr').swmr)
+        self.assertFalse(backend.parse_storage_policy('swmr=0').swmr)
+
+    def test_parse_invalid(self):
+        for spec in ['chunk=0', 'compression=zip', 'growth=0.5', 'foo=1',
+                     'gzip=12', 'level=4', 'format=csv']:
+            self.assertRaises(ValueError, backend.parse_storage_policy, spec)
+
+
 class _MockFile(object):
     def __init__(self):
         self.is_open = True
@@ -133,6 +171,186 @@ class SelfClosingFileTest(_TestCase):
                     msg='Registered callback not called!')
 
 
+class FilePoolTest(_TestCase):
+    """Tests for the FilePool that limits the number of open files."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = backend.FilePool(max_open=2, sweep_interval=1,
+                                     reactor=self.clock)
+        self.opener = _MockFileOpener()
+
+    def _file(self, timeout=10):
+        return backend.SelfClosingFile(opener=self.opener, timeout=timeout,
+                                       touch=False, pool=self.pool)
+
+    def test_evicts_least_recently_used(self):
+        f1, f2, f3 = self._file(), self._file(), self._file()
+        h1 = f1()
+        self.clock.advance(backend.FILE_EVICT_MIN_IDLE)
+        h2 = f2()
+        self.clock.advance(backend.FILE_EVICT_MIN_IDLE)
+        self.assertIs(h1, f1()) # now f2 is least recently used
+        self.clock.advance(backend.FILE_EVICT_MIN_IDLE)
+        f3()
+        self.assertTrue(h1.is_open)
+        self.assertFalse(h2.is_open)
+        self.assertEqual((2, 2, 1, 3, 1, 0), self.pool.stats())
+        # reopened on the next access
+        self.assertTrue(f2().is_open)
+
+    def test_recently_used_files_are_not_evicted(self):
+        files = [self._file() for _ in range(3)]
+        handles = [f() for f in files]
+        self.assertTrue(all(h.is_open for h in handles))
+        # the sweep brings the pool back within its limit
+        self.clock.advance(backend.FILE_EVICT_MIN_IDLE)
+        self.assertFalse(handles[0].is_open)
+        self.assertEqual(2, self.pool.stats()[0])
+
+    def test_sweep_closes_idle_files(self):
+        f1, f2 = self._file(timeout=2), self._file(timeout=5)
+        h1, h2 = f1(), f2()
+        self.clock.advance(2)
+        self.assertFalse(h1.is_open)
+        self.assertTrue(h2.is_open)
+        self.clock.advance(3)
+        self.assertFalse(h2.is_open)
+        self.assertEqual((0, 2, 0, 2, 0, 2), self.pool.stats())
+
+    def test_pinned_files_are_not_closed(self):
+        f1, f2, f3 = self._file(timeout=2), self._file(), self._file()
+        with backend.pin_files():
+            h1 = f1()
+            with backend.pin_files():
+                f1()
+            self.clock.advance(5)
+            f2()
+            self.clock.advance(5)
+            f3()
+            self.assertTrue(h1.is_open)
+            self.assertEqual(1, f1.pins)
+        self.assertEqual(0, f1.pins)
+        self.clock.advance(1)
+        self.assertFalse(h1.is_open)
+
+    def test_open_files_count_against_limit(self):
+        f1, f2 = self._file(), self._file()
+        h1 = f1()
+        self.clock.advance(backend.FILE_EVICT_MIN_IDLE)
+        h2 = f2()
+        self.clock.advance(backend.FILE_EVICT_MIN_IDLE)
+        kept = backend.OpenFile(mock.Mock(), pool=self.pool)
+        self.assertFalse(h1.is_open)
+        self.assertTrue(h2.is_open)
+        self.assertEqual(2, self.pool.stats()[0])
+        kept.close()
+        self.assertEqual(1, self.pool.stats()[0])
+
+    def test_close_all(self):
+        f1, f2 = self._file(), self._file()
+        h1 = f1()
+        with backend.pin_files():
+            h2 = f2()
+            self.pool.close_all()
+            self.assertFalse(h1.is_open)
+            self.assertTrue(h2.is_open)
+
+    def test_stop_and_start(self):
+        h = self._file(timeout=2)()
+        self.pool.stop()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.clock.advance(5)
+        self.assertTrue(h.is_open)
+        self.pool.start()
+        self.clock.advance(1)
+        self.assertFalse(h.is_open)
+
+
+class _CacheOwner(object):
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self.dropped = False
+
+    def _drop_data(self):
+        self.dropped = True
+
+
+class DataCacheTest(_TestCase):
+    """Tests for the DataCache that limits the memory used by csv data."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = backend.DataCache(max_bytes=100, sweep_interval=1,
+                                       reactor=self.clock)
+
+    def test_evicts_least_recently_used(self):
+        a, b, c = _CacheOwner(), _CacheOwner(), _CacheOwner()
+        self.cache.access(a, 40)
+        self.clock.advance(backend.DATA_EVICT_MIN_IDLE)
+        self.cache.access(b, 40)
+        self.clock.advance(backend.DATA_EVICT_MIN_IDLE)
+        self.cache.access(a, 40) # now b is least recently used
+        self.clock.advance(backend.DATA_EVICT_MIN_IDLE)
+        self.cache.access(c, 40)
+        self.assertFalse(a.dropped)
+        self.assertTrue(b.dropped)
+        self.assertEqual((2, 80, 100, 1, 3, 1, 0), self.cache.stats())
+
+    def test_resize_evicts_others(self):
+        a, b = _CacheOwner(), _CacheOwner()
+        self.cache.access(a, 40)
+        self.clock.advance(backend.DATA_EVICT_MIN_IDLE)
+        self.cache.access(b, 40)
+        self.clock.advance(backend.DATA_EVICT_MIN_IDLE)
+        self.cache.resize(b, 80)
+        self.assertTrue(a.dropped)
+        self.assertEqual((1, 80), self.cache.stats()[:2])
+
+    def test_recently_used_data_is_not_evicted(self):
+        owners = [_CacheOwner() for _ in range(3)]
+        for owner in owners:
+            self.cache.access(owner, 40)
+        self.assertFalse(any(owner.dropped for owner in owners))
+        # the sweep brings the cache back within its budget
+        self.clock.advance(backend.DATA_EVICT_MIN_IDLE)
+        self.assertTrue(owners[0].dropped)
+        self.assertEqual(80, self.cache.stats()[1])
+
+    def test_sweep_drops_idle_data(self):
+        a, b = _CacheOwner(timeout=2), _CacheOwner(timeout=5)
+        self.cache.access(a, 10)
+        self.cache.access(b, 10)
+        self.clock.advance(2)
+        self.assertTrue(a.dropped)
+        self.assertFalse(b.dropped)
+        self.clock.advance(3)
+        self.assertTrue(b.dropped)
+        self.assertEqual((0, 0, 100, 0, 2, 0, 2), self.cache.stats())
+
+    def test_csv_data_within_budget(self):
+        filenames = [_unique_filename(suffix='.csv') for _ in range(3)]
+        self.cache.max_bytes = 2 * 16 * 3 * 8 # two datasets of 16 rows
+        try:
+            datasets = []
+            for filename in filenames:
+                data = backend.CsvNumpyData(filename, reactor=self.clock)
+                data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+                data._cache = self.cache
+                data.addData(np.ones((10, 3)))
+                datasets.append(data)
+                self.clock.advance(backend.DATA_EVICT_MIN_IDLE)
+            self.assertFalse(hasattr(datasets[0], '_data'))
+            self.assertTrue(hasattr(datasets[2], '_data'))
+            self.assertEqual(1, self.cache.stats()[5])
+            # evicted data is reloaded from the file
+            self.assert_arrays_equal(np.ones((10, 3)), datasets[0].data)
+        finally:
+            for filename in filenames:
+                _remove_file_if_exists(filename)
+                _remove_file_if_exists(filename[:-4] + '.ini')
+                _remove_file_if_exists(filename + '.idx')
+
 # Dependent and Independent variables used for testing IniData and HDF5MetaData.
 _INDEPENDENTS = [
         backend.Independent(
@@ -411,6 +629,9 @@ class _MockDataset(object):
     """Mock Dataset class to use in the HDF5MetaDataTest."""
     def __init__(self):
         self.attrs = _MockAttrs()
+        # comments are kept in a real dataset next to this one
+        self.parent = h5py.File('mock_{}.hdf5'.format(id(self)), 'w',
+                                driver='core', backing_store=False)
 
 
 class HDF5MetaDataTest(_MetadataTest):
@@ -420,6 +641,73 @@ class HDF5MetaDataTest(_MetadataTest):
         data.dataset = _MockDataset()
         return data
 
+    def test_comments_appended_to_dataset(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        for i in range(300):
+            data.addComment('user', 'comment {}'.format(i))
+        self.assertEqual(data.numComments(), 300)
+        self.assertEqual(len(data.dataset.attrs['Comments']), 0)
+        self.assertEqual(len(data.dataset.parent['Comments']), 300)
+        comments, pos = data.getComments(3, 297)
+        self.assertEqual([c[2] for c in comments],
+                         ['comment 297', 'comment 298', 'comment 299'])
+        self.assertEqual(pos, 300)
+        comments, pos = data.getComments(None, 300)
+        self.assertEqual((comments, pos), ([], 300))
+
+    def test_legacy_comment_attribute(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        legacy = np.array([(1.0, 'old user', 'old 0'), (2.0, 'old user', 'old 1')],
+                          dtype=data.comment_type)
+        data.dataset.attrs.create('Comments', legacy, dtype=data.comment_type)
+        self.assertEqual(data.numComments(), 2)
+        comments, pos = data.getComments(None, 1)
+        self.assertEqual([c[2] for c in comments], ['old 1'])
+        self.assertEqual(pos, 2)
+
+        # the next comment moves the old ones into the dataset, in order
+        data.addComment('user', 'new')
+        self.assertEqual(len(data.dataset.attrs['Comments']), 0)
+        comments, pos = data.getComments(None, 0)
+        self.assertEqual([c[2] for c in comments], ['old 0', 'old 1', 'new'])
+        self.assertEqual(pos, 3)
+
+    def test_parameters_decoded_once(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addParam('Param1', ('a', 5))
+        with mock.patch.object(backend, 'labrad_urldecode',
+                               wraps=backend.labrad_urldecode) as decode:
+            for _ in range(3):
+                self.assertEqual(data.getParameter('Param1'), ('a', 5))
+                self.assertEqual(
+                        data.getParameter('PARAM1', case_sensitive=False),
+                        ('a', 5))
+        self.assertEqual(decode.call_count, 1)
+
+    def test_columns_read_once(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        with mock.patch.object(backend.HDF5MetaData, '_read_columns',
+                               wraps=data._read_columns) as read:
+            for _ in range(3):
+                self.assertEqual(data.getIndependents(), _INDEPENDENTS)
+                self.assertEqual(data.getDependents(), _DEPENDENTS)
+                self.assertEqual(data.getRowType(),
+                                 '*(v[Ghz],v[Kelvin],v[Dollars])')
+        self.assertEqual(read.call_count, 2) # independents and dependents
+
+    def test_parameter_cache_invalidated_by_add(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addParam('Param1', 1)
+        self.assertEqual(data.getParamNames(), ['Param1'])
+        data.addParam('Param2', 2)
+        self.assertEqual(sorted(data.getParamNames()), ['Param1', 'Param2'])
+        self.assertEqual(data.getParameter('param2', case_sensitive=False), 2)
+
 
 class _BackendDataTestCase(_TestCase):
     def assert_data_in_backend(self, backend_data, expected_data):
@@ -496,6 +784,19 @@ class CsvListDataTest(_BackendDataTestCase):
         self.assertRaises(
                errors.BadDataError, self.data.addData, [(1, 2, 3, 4)])
 
+    def test_read_without_trailing_newline(self):
+        self.data.save()
+        del self.data
+        with open(self.filename, 'wb') as f:
+            f.write('1, 2, 3\r\n4, 5, 6\r\n7, 8, 9')
+        data = self.get_backend_data()
+        data.load()
+        self.assert_data_in_backend(data, [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        data.addData([[10, 11, 12]])
+        self.assertEqual(data.data[-2:], [[7, 8, 9], [10, 11, 12]])
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read().count('\n'), 4)
+
 
 class _BackendDataTest(_BackendDataTestCase):
     """Base tests for data backends."""
@@ -581,6 +882,7 @@ class CsvNumpyDataTest(_BackendDataTest):
         for name in self.files_to_remove:
             _remove_file_if_exists(name)
             _remove_file_if_exists(name[:-4] + '.ini')
+            _remove_file_if_exists(name + '.idx')
 
 
     def get_backend_data(self, filename):
@@ -593,11 +895,126 @@ class CsvNumpyDataTest(_BackendDataTest):
         self.assertEqual(read_data.size, 0)
         self.assertEqual(read_data[0].size, 0)
 
+    def test_get_columns(self):
+        self.data.addData(np.array([[1., 2., 3.], [4., 5., 6.]]))
+        read_data, next_pos = self.data.getData(None, 0, False, None, [2, 1])
+        self.assert_arrays_equal(read_data, [[3, 2], [6, 5]])
+        self.assertEqual(next_pos, 2)
+
     def test_add_data_wrong_number_of_columns(self):
         self.assertRaises(errors.BadDataError, self.data.addData, [(1, 2)])
         self.assertRaises(
                errors.BadDataError, self.data.addData, [(1, 2, 3, 4)])
 
+    def test_append_grows_capacity_geometrically(self):
+        rows = np.recarray(
+            (3, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        expected = []
+        capacities = set()
+        for i in range(100):
+            rows[:] = [(i, i + 1, i + 2)] * 3
+            self.data.addData(rows)
+            expected.extend([[i, i + 1, i + 2]] * 3)
+            capacities.add(len(self.data._data))
+        self.assert_arrays_equal(self.data.data, expected)
+        # capacity doubles, so it only changed a handful of times
+        self.assertTrue(len(capacities) <= 6, capacities)
+        read_data, next_pos = self.data.getData(2, 298, False, None)
+        self.assertEqual(next_pos, 300)
+        self.assert_arrays_equal(read_data, expected[298:])
+
+    def test_append_after_reload(self):
+        rows = np.recarray(
+            (2, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        rows[0] = (1, 2, 3)
+        rows[1] = (4, 5, 6)
+        self.data.addData(rows)
+        # drop the in-memory copy, so that it is reloaded from the file
+        self.clock.advance(backend.DATA_TIMEOUT)
+        self.data.addData(rows)
+        self.assert_arrays_equal(
+                self.data.data,
+                [[1, 2, 3], [4, 5, 6], [1, 2, 3], [4, 5, 6]])
+
+
+    def _add_rows(self, count):
+        rows = np.core.records.fromarrays(
+                [np.arange(count), np.arange(count) * 2., np.arange(count) * .5],
+                names='f0,f1,f2')
+        self.data.addData(rows)
+        return util.from_record_array(rows)
+
+    def test_range_read_after_eviction(self):
+        expected = self._add_rows(3000)
+        self.clock.advance(backend.DATA_TIMEOUT)
+        # Read only a range of rows; the data is not loaded into memory.
+        read_data, next_pos = self.data.getData(10, 2500, False, None)
+        self.assertEqual(next_pos, 2510)
+        self.assert_arrays_equal(read_data, expected[2500:2510])
+        read_data, next_pos = self.data.getData(None, 2990, False, None)
+        self.assertEqual(next_pos, 3000)
+        self.assert_arrays_equal(read_data, expected[2990:])
+        self.assertFalse(hasattr(self.data, '_data'))
+        self.assertTrue(self.data.hasMore(2999))
+        self.assertFalse(self.data.hasMore(3000))
+        self.assertEqual(self.data.index.nrows, 3000)
+
+    def test_index_persisted(self):
+        expected = self._add_rows(2100)
+        self.clock.advance(backend.DATA_TIMEOUT)
+        self.assertTrue(self.data.hasMore(1))
+        self.assertTrue(os.path.exists(self.filename + '.idx'))
+
+        # A new backend on the same file picks up the saved index, and
+        # indexes rows appended since.
+        data = self.get_backend_data(self.filename)
+        self.assertEqual(data.index.nrows, 2100)
+        self.assertEqual(len(data.index.offsets), 3)
+        more = self._add_rows(5)
+        read_data, next_pos = data.getData(None, 2098, False, None)
+        self.assertEqual(next_pos, 2105)
+        self.assert_arrays_equal(read_data, np.vstack((expected[2098:], more)))
+
+    def test_index_discarded_when_file_shrinks(self):
+        self._add_rows(10)
+        self.clock.advance(backend.DATA_TIMEOUT)
+        self.assertTrue(self.data.hasMore(1))
+        with open(self.filename, 'w') as f:
+            f.write('1, 2, 3\r\n')
+        data = self.get_backend_data(self.filename)
+        data.cols = 3
+        read_data, next_pos = data.getData(None, 0, False, None)
+        self.assertEqual(next_pos, 1)
+        self.assert_arrays_equal(read_data, [[1, 2, 3]])
+
+    def test_read_without_trailing_newline(self):
+        # legacy files may lack a final line break
+        self.data.save()
+        with open(self.filename, 'wb') as f:
+            f.write('1, 2, 3\r\n4, 5, 6\r\n7, 8, 9')
+        data = self.get_backend_data(self.filename)
+        data.load()
+        self.assertEqual(len(data), 3)
+        self.assert_data_in_backend(data, [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        read_data, next_pos = data.getData(None, 2, False, None)
+        self.assertEqual(next_pos, 3)
+        self.assert_arrays_equal(read_data, [[7, 8, 9]])
+
+        # appending ends the last line first
+        rows = np.core.records.fromarrays([[10.], [11.], [12.]],
+                                          names='f0,f1,f2')
+        data.addData(rows)
+        self.clock.advance(backend.DATA_TIMEOUT)
+        read_data, next_pos = data.getData(None, 2, False, None)
+        self.assertEqual(next_pos, 4)
+        self.assert_arrays_equal(read_data, [[7, 8, 9], [10, 11, 12]])
+        data = self.get_backend_data(self.filename)
+        data.load()
+        self.assertEqual(len(data), 4)
+
+
 class ExtendedHDF5DataTest(_BackendDataTest):
 
     def setUp(self):
@@ -770,6 +1187,47 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         added_data, _ = data.getData(None, 0, False, None)
         self.assertEqual(added_data[0][0], "{'a': 0}")
 
+    def test_storage_policy_applied(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        storage = backend.parse_storage_policy('chunk=16, gzip=4, shuffle')
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, storage)
+        self.assertEqual(data.dataset.chunks, (16,))
+        self.assertEqual(data.dataset.compression, 'gzip')
+        self.assertEqual(data.dataset.compression_opts, 4)
+        self.assertTrue(data.dataset.shuffle)
+
+    def test_geometric_preallocation(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        storage = backend.parse_storage_policy('growth=2')
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, storage)
+        row = np.recarray(
+            (1, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i in range(5):
+            row[0] = (i, i, i)
+            data.addData(row)
+        self.assertEqual(len(data), 5)
+        self.assertEqual(data.dataset.shape[0], 8)
+        self.assertTrue(data.hasMore(4))
+        self.assertFalse(data.hasMore(5))
+        read_data, next_pos = data.getData(None, 3, False, None)
+        self.assertEqual(next_pos, 5)
+        self.assert_arrays_equal(read_data, [(3, 3, 3), (4, 4, 4)])
+        read_data, next_pos = data.getData(10, 5, False, None)
+        self.assertEqual(next_pos, 5)
+        self.assertEqual(len(read_data), 0)
+
+        # The logical row count survives reopening the file.
+        data.file.close()
+        reopened = self.get_backend_data(name)
+        self.assertEqual(len(reopened), 5)
+        row[0] = (5, 5, 5)
+        reopened.addData(row)
+        self.assertEqual(len(reopened), 6)
+        self.assertEqual(reopened.dataset.shape[0], 8)
+
     def test_add_string_array_column(self):
         name = _unique_filename()
         data = self.get_backend_data(name)
@@ -811,5 +1269,320 @@ class SimpleHDF5DataTest(_BackendDataTest):
         self.assertEqual(read_data.dtype, np.dtype(float))
         self.assertEqual(read_data.size, 0)
 
+    def test_failed_add_leaves_no_rows(self):
+        rows = np.core.records.fromarrays([[1.], [2.], [3.]], names='f0,f1,f2')
+        self.data.addData(rows)
+        bad = np.array([('a', 'b', 'c')],
+                       dtype=[('f0', 'S1'), ('f1', 'S1'), ('f2', 'S1')])
+        self.assertRaises(Exception, self.data.addData, bad)
+        self.assertEqual(1, len(self.data))
+        self.assertEqual(1, self.data.dataset.shape[0])
+        self.data.addData(rows)
+        read_data, _ = self.data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, [[1, 2, 3], [1, 2, 3]])
+
+    def test_geometric_preallocation(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        storage = backend.parse_storage_policy('growth=1.5, lzf')
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS, storage)
+        rows = np.core.records.fromarrays(np.eye(3) * 2, names='f0,f1,f2')
+        data.addData(rows)
+        data.addData(rows)
+        self.assertEqual(len(data), 6)
+        self.assertEqual(data.dataset.compression, 'lzf')
+        read_data, next_pos = data.getData(None, 0, False, None)
+        self.assertEqual(next_pos, 6)
+        self.assert_arrays_equal(read_data, np.vstack([np.eye(3) * 2] * 2))
+
+    def _add_rows(self, data, x):
+        x = np.asarray(x, dtype=float)
+        data.addData(np.core.records.fromarrays([x, -x, x * 2], names='f0,f1,f2'))
+
+    def assert_range(self, data, x, lo, hi):
+        x = np.asarray(x)
+        expected = np.nonzero((x >= lo) & (x <= hi))[0]
+        start, stop = data.findRange(0, lo, hi)
+        if len(expected):
+            self.assertEqual((expected[0], expected[-1] + 1), (start, stop))
+        else:
+            self.assertEqual(start, stop)
+
+    def test_get_columns(self):
+        self._add_rows(self.data, [1, 2, 3])
+        read_data, next_pos = self.data.getData(2, 1, False, None, [2, 0])
+        self.assert_arrays_equal(read_data, [[4, 2], [6, 3]])
+        self.assertEqual(next_pos, 3)
+        read_data, next_pos = self.data.getData(None, 3, False, None, [1])
+        self.assertEqual(read_data.shape, (0, 1))
+        self.assertEqual(next_pos, 3)
+
+    @mock.patch.object(backend, 'RANGE_INDEX_STRIDE', 4)
+    @mock.patch.object(backend, 'RANGE_INDEX_CHUNK', 8)
+    def test_find_range(self):
+        x = sorted([i // 3 for i in range(50)])
+        self._add_rows(self.data, x)
+        for lo, hi in [(-5, -1), (-1, 0), (0, 0), (3, 7), (4.5, 5.5),
+                       (7, 7.5), (15, 16), (16, 30), (30, 40), (5, 4)]:
+            self.assert_range(self.data, x, lo, hi)
+
+        # the index is extended as rows are added
+        self._add_rows(self.data, [16, 17, 17, 20])
+        x += [16, 17, 17, 20]
+        self.assert_range(self.data, x, 16, 17)
+        self.assert_range(self.data, x, 18, 25)
+
+        # and is persisted in the file
+        self.data.file.close()
+        reopened = self.get_backend_data(self.filename)
+        self.assertEqual(len(x), reopened.file['Index']['f0'].attrs['Rows'])
+        self.assert_range(reopened, x, 2, 10)
+
+    @mock.patch.object(backend, 'RANGE_INDEX_STRIDE', 4)
+    def test_find_range_unsorted(self):
+        self._add_rows(self.data, [0, 1, 2, 3, 4, 5])
+        self.assertEqual((1, 3), self.data.findRange(0, 1, 2))
+        self._add_rows(self.data, [4])
+        self.assertRaises(
+                errors.RangeQueryError, self.data.findRange, 0, 1, 2)
+        # column 1 is decreasing
+        self.assertRaises(
+                errors.RangeQueryError, self.data.findRange, 1, -2, -1)
+
+
+class GridHDF5DataTest(_TestCase):
+
+    def setUp(self):
+        self.filename = _unique_filename()
+        self.clock = task.Clock()
+        self.data = self.get_backend_data(self.filename)
+        axes = [backend.Axis('flux', 'V', []),
+                backend.Axis('freq', 'GHz', [4.0, 5.0, 6.0])]
+        dep = [backend.Dependent('amp', 'I', (1,), 'v', ''),
+               backend.Dependent('amp', 'Q', (1,), 'v', '')]
+        self.data.initialize_info('Map', axes, dep)
+
+    def tearDown(self):
+        _remove_file_if_exists(self.filename)
+
+    def get_backend_data(self, filename):
+        fh = backend.SelfClosingFile(
+                h5py.File, open_args=(filename, 'a'), reactor=self.clock)
+        return backend.GridHDF5Data(fh)
+
+    def _block(self, rows, offset=0):
+        # values i*10 + j for I and their negatives for Q, at point (i, j)
+        i = np.arange(offset, offset + rows)[:, np.newaxis]
+        values = (i * 10 + np.arange(3)).astype(float)
+        return np.stack([values, -values], axis=-1)
+
+    def test_metadata(self):
+        self.assertEqual('5.0.0', '.'.join(str(v) for v in self.data.version))
+        self.assertEqual(['flux', 'freq'],
+                         [i.label for i in self.data.getIndependents()])
+        self.assertEqual(['I', 'Q'],
+                         [d.legend for d in self.data.getDependents()])
+        self.assertEqual(4, len(self.data.dtype))
+        self.assertEqual((0, 3), self.data.shape)
+        self.assertEqual(0, len(self.data))
+
+    def test_write_and_slice(self):
+        self.data.writeSlab([0], self._block(2), axis_values=[0.1, 0.2])
+        self.data.writeSlab([2], self._block(1, 2))
+        self.assertEqual((3, 3), self.data.shape)
+        self.assertEqual(9, len(self.data))
+        flux, freq = self.data.getAxisValues()
+        self.assert_arrays_equal(flux, [0.1, 0.2, 2])
+        self.assert_arrays_equal(freq, [4, 5, 6])
+        self.assert_arrays_equal(self.data.getSlice([]), self._block(3))
+        block = self.data.getSlice([(1, 10, 1), (0, 3, 2)], dependents=[1])
+        self.assert_arrays_equal(block, self._block(3)[1:, ::2, 1:])
+
+        # unwritten points are NaN
+        self.data.writeSlab([3, 1], np.ones((1, 2, 2)))
+        block = self.data.getSlice([(3, 4, 1)])
+        self.assertTrue(np.all(np.isnan(block[0, 0])))
+        self.assert_arrays_equal(block[0, 1:], np.ones((2, 2)))
+
+    def test_row_view(self):
+        self.data.writeSlab([0], self._block(2), axis_values=[0.1, 0.2])
+        rows, pos = self.data.getData(None, 0, False, True)
+        self.assertEqual(6, pos)
+        self.assert_arrays_equal(rows[:, 0], [0.1] * 3 + [0.2] * 3)
+        self.assert_arrays_equal(rows[:, 1], [4, 5, 6] * 2)
+        self.assert_arrays_equal(rows[:, 2], [0, 1, 2, 10, 11, 12])
+        self.assert_arrays_equal(rows[:, 3], -rows[:, 2])
+        rows, pos = self.data.getData(3, 2, False, True, columns=[2, 1])
+        self.assertEqual(5, pos)
+        self.assert_arrays_equal(rows, [[2, 6], [10, 4], [11, 5]])
+        cols, pos = self.data.getData(None, 6, True, False)
+        self.assertEqual((6, 4), (pos, len(cols)))
+
+    def test_reopen(self):
+        self.data.writeSlab([0], self._block(2))
+        self.data.file.close()
+        data = backend.open_backend(self.filename[:-len('.hdf5')])
+        self.assertIsInstance(data, backend.GridHDF5Data)
+        self.assert_arrays_equal(data.getSlice([]), self._block(2))
+        data.file.close()
+
+    def test_errors(self):
+        self.assertRaises(errors.GridDataError, self.data.addData,
+                          np.zeros((1, 4)))
+        # wrong number of dependents, and out of bounds of a fixed axis
+        self.assertRaises(errors.GridDataError, self.data.writeSlab, [0],
+                          np.zeros((1, 3, 3)))
+        self.assertRaises(errors.GridDataError, self.data.writeSlab, [0, 1],
+                          self._block(1))
+        self.assertRaises(errors.GridDataError, self.data.writeSlab, [0],
+                          self._block(2), axis_values=[1])
+        self.assertRaises(errors.RangeQueryError, self.data.findRange, 0, 0, 1)
+
+        data = self.get_backend_data(_unique_filename())
+        self.addCleanup(_remove_file_if_exists, data.file.filename)
+        axes = [backend.Axis('x', '', [1, 2]), backend.Axis('y', '', [])]
+        self.assertRaises(errors.GridDataError, data.initialize_info, 'Bad',
+                          axes, [backend.Dependent('z', '', (1,), 'v', '')])
+
+
+class BinaryDataTest(_BackendDataTest):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix=backend.BINARY_EXTENSION)
+        self.files_to_remove = []
+        self.clock = task.Clock()
+        self.data = self.get_backend_data(self.filename)
+        # Initialize the metadata.
+        self.data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+
+    def tearDown(self):
+        for name in self.files_to_remove:
+            base = name[:-len(backend.BINARY_EXTENSION)]
+            for filename in [name, base + '.ini', base + '.hdf5']:
+                _remove_file_if_exists(filename)
+
+    def get_backend_data(self, filename):
+        self.files_to_remove.append(filename)
+        return backend.BinaryData(filename, reactor=self.clock)
+
+    def _add_rows(self, x):
+        x = np.asarray(x, dtype=float)
+        self.data.addData(np.core.records.fromarrays([x, -x, x * 2],
+                                                     names='f0,f1,f2'))
+        return np.column_stack([x, -x, x * 2])
+
+    def _reload(self):
+        self.data.save()
+        self.data.close()
+        data = self.get_backend_data(self.filename)
+        data.load()
+        return data
+
+    def test_empty_data_read(self):
+        read_data, next_pos = self.data.getData(None, 0, False, None)
+        self.assertEqual(read_data.shape, (0, 3))
+        self.assertEqual(next_pos, 0)
+        self.assertEqual('4.0.0', '.'.join(str(v) for v in self.data.version))
+
+    def test_get_columns(self):
+        self._add_rows([1, 2, 3])
+        read_data, next_pos = self.data.getData(2, 1, False, None, [2, 0])
+        self.assert_arrays_equal(read_data, [[4, 2], [6, 3]])
+        self.assertEqual(next_pos, 3)
+
+    def test_checkpoint(self):
+        with mock.patch.object(backend, 'BINARY_CHECKPOINT_ROWS', 4):
+            self._add_rows(range(3))
+            self.assertEqual(0, self.data._checkpoint)
+            self._add_rows(range(3))
+            self.assertEqual(6, self.data._checkpoint)
+        self._add_rows(range(2))
+        # closing the file checkpoints the rest
+        self.data._file.close()
+        with open(self.filename, 'rb') as f:
+            header = backend.BINARY_HEADER.unpack(
+                    f.read(backend.BINARY_HEADER.size))
+        self.assertEqual(('DVBINARY', 4, 0, 0, 3, 8), header)
+
+    def test_recover_torn_row(self):
+        expected = self._add_rows(range(5))
+        self.data._file.close()
+        # a crash in the middle of writing a row
+        with open(self.filename, 'ab') as f:
+            f.write('\x01' * 12)
+        data = self._reload()
+        self.assertEqual(5, len(data))
+        self.assertEqual(backend.BINARY_HEADER_SIZE + 5 * 24,
+                         os.path.getsize(self.filename))
+        self.assertEqual(5, data._checkpoint)
+        read_data, _ = data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, expected)
+        # appending continues after the last complete row
+        data.addData(np.array([[7., 8., 9.]]))
+        read_data, next_pos = data.getData(None, 4, False, None)
+        self.assert_arrays_equal(read_data, [expected[4], [7, 8, 9]])
+
+    def test_recover_rows_past_checkpoint(self):
+        expected = self._add_rows(range(5))
+        self.data._file.close()
+        # complete rows written after the checkpoint, which a crash may have
+        # left unsynced
+        with open(self.filename, 'ab') as f:
+            f.write('\x01' * 48)
+        data = self._reload()
+        self.assertEqual(5, len(data))
+        self.assertEqual(backend.BINARY_HEADER_SIZE + 5 * 24,
+                         os.path.getsize(self.filename))
+        read_data, _ = data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, expected)
+
+    def test_load_while_loaded_elsewhere(self):
+        expected = self._add_rows(range(3)) # not checkpointed yet
+        self.data.save()
+        other = self.get_backend_data(self.filename)
+        other.load()
+        self.assertEqual(0, other._checkpoint)
+        read_data, _ = other.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, expected)
+        other.close()
+
+    def test_column_mismatch_is_corrupt(self):
+        self.data.save()
+        self.data._file.close()
+        with open(self.filename, 'r+b') as f:
+            f.write(backend.BINARY_HEADER.pack('DVBINARY', 4, 0, 0, 2, 0))
+        data = self.get_backend_data(self.filename)
+        self.assertRaises(errors.CorruptDatasetError, data.load)
+
+    def test_compact(self):
+        expected = self._add_rows(range(10))
+        self.data.addParam('gain', 3.5)
+        self.data.addComment('user', 'a comment')
+        self.data.save()
+        self.data.close()
+        base = self.filename[:-len(backend.BINARY_EXTENSION)]
+        with mock.patch.object(backend, 'COMPACT_CHUNK_ROWS', 4):
+            backend.compact_binary(base)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertFalse(os.path.exists(base + '.ini'))
+        data = backend.open_backend(base)
+        self.assertIsInstance(data, backend.SimpleHDF5Data)
+        self.assertEqual('FooTitle', data.getTitle())
+        self.assertEqual(3.5, data.getParameter('gain'))
+        self.assertEqual('a comment', data.getComments(None, 0)[0][0][2])
+        self.assertEqual(len(_DEPENDENTS), len(data.getDependents()))
+        read_data, next_pos = data.getData(None, 0, False, None)
+        self.assert_arrays_equal(read_data, expected)
+        data.file.close()
+
+    @unittest.skipIf(backend.fcntl is None, 'no file locking')
+    def test_compact_open_dataset(self):
+        self._add_rows(range(3))
+        self.data.save()
+        base = self.filename[:-len(backend.BINARY_EXTENSION)]
+        self.assertRaises(errors.DatasetInUseError, backend.compact_binary, base)
+        self.assertTrue(os.path.exists(self.filename))
+        self.assertEqual(3, len(self._reload()))
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
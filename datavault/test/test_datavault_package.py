@@ -9,7 +9,8 @@ from labrad import types
 
 from twisted.internet import task
 
-from datavault import Session, Dataset, SessionStore
+import datavault
+from datavault import Session, Dataset, SessionStore, errors, util
 
 
 def _unique_dir():
@@ -66,6 +67,57 @@ class TestSessionStore(unittest.TestCase):
         bar_session = store.get('bar')
         self.assertEqual([foo_session, bar_session], store.get_all())
 
+    def _saved_access_time(self, session):
+        S = util.DVSafeConfigParser()
+        S.read(session.infofile)
+        return datavault.time_from_str(S.get('Information', 'Accessed'))
+
+    def test_access_time_written_after_delay(self):
+        clock = task.Clock()
+        store = SessionStore(self.datadir, self.hub, reactor=clock)
+        session = store.get(['', 'foo'])
+        saved = self._saved_access_time(session)
+        session.accessed = saved.replace(year=2000)
+        store.markDirty(session)
+        self.assertEqual(saved, self._saved_access_time(session))
+        clock.advance(datavault.METADATA_FLUSH_DELAY)
+        self.assertEqual(2000, self._saved_access_time(session).year)
+        self.assertEqual(0, len(clock.getDelayedCalls()))
+
+    def test_dataset_access_time_deferred(self):
+        clock = task.Clock()
+        store = SessionStore(self.datadir, self.hub, reactor=clock)
+        session = store.get(['', 'foo'])
+        dataset = session.newDataset('Foo', ['x'], ['y'])
+        dataset.data.access = mock.Mock()
+        session.openDataset(1)
+        self.assertFalse(dataset.data.access.called)
+        store.flush()
+        self.assertEqual(1, dataset.data.access.call_count)
+        self.assertEqual(0, len(clock.getDelayedCalls()))
+
+    def test_noatime(self):
+        clock = task.Clock()
+        store = SessionStore(self.datadir, self.hub, reactor=clock)
+        store.noatime = True
+        session = store.get(['', 'foo'])
+        dataset = session.newDataset('Foo', ['x'], ['y'])
+        dataset.data.access = mock.Mock()
+        session.openDataset(1)
+        self.assertEqual(0, len(clock.getDelayedCalls()))
+        store.flush()
+        self.assertFalse(dataset.data.access.called)
+
+    def test_zero_flush_delay_writes_through(self):
+        clock = task.Clock()
+        store = SessionStore(self.datadir, self.hub, reactor=clock)
+        store.metadata_flush_delay = 0
+        session = store.get(['', 'foo'])
+        session.accessed = session.accessed.replace(year=2000)
+        store.markDirty(session)
+        self.assertEqual(2000, self._saved_access_time(session).year)
+        self.assertEqual(0, len(clock.getDelayedCalls()))
+
 
 class _DatavaultTestCase(unittest.TestCase):
     _TITLE = 'Foo'
@@ -168,6 +220,56 @@ class SessionTest(_DatavaultTestCase):
         d2 = s2.openDataset(datasets[0])
         self.assertDatasetsEqual(d1, d2)
 
+    def _age_dir(self, session, seconds=60):
+        # make the directory mtime old enough for its index to be trusted
+        t = os.stat(session.dir).st_mtime - seconds
+        os.utime(session.dir, (t, t))
+
+    def test_open_dataset_by_number(self):
+        session = self._get_session()
+        for title in ['a', 'b', 'c']:
+            session.newDataset(title, self._INDEPENDENTS, self._DEPENDENTS)
+        self.assertEqual('00002 - b', session.openDataset(2).name)
+        self.assertEqual('00003 - c', session.openDataset(3).name)
+        with self.assertRaises(errors.DatasetNotFoundError):
+            session.openDataset(4)
+        with self.assertRaises(errors.DatasetNotFoundError):
+            session.openDataset('00004 - d')
+
+    def test_index_not_rebuilt_when_unchanged(self):
+        session = self._get_session()
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        self._age_dir(session)
+        session.listContents([])
+        with mock.patch('os.listdir') as listdir:
+            dirs, datasets = session.listContents([])
+            self.assertEqual(['00001 - Foo'], datasets)
+            self.assertEqual('00001 - Foo', session.openDataset(1).name)
+        self.assertFalse(listdir.called)
+
+    def test_index_rebuilt_on_directory_change(self):
+        session = self._get_session()
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        self._age_dir(session, seconds=120)
+        self.assertEqual(['00001 - Foo'], session.listDatasets())
+
+        # another process adds a dataset and a subdirectory
+        open(os.path.join(session.dir, '00002 - Bar.csv'), 'w').close()
+        os.mkdir(os.path.join(session.dir, 'sub.dir'))
+        self._age_dir(session)
+        dirs, datasets = session.listContents([])
+        self.assertEqual(['sub'], dirs)
+        self.assertEqual(['00001 - Foo', '00002 - Bar'], datasets)
+        self.assertEqual('00002 - Bar', session._getIndex().lookup(2))
+
+    def test_index_numbers_beyond_five_digits(self):
+        index = datavault.DirectoryIndex(
+                ['123456 - Big.hdf5', '00007 - Small.csv', 'session.ini'])
+        self.assertEqual('123456 - Big', index.lookup(123456))
+        self.assertEqual('00007 - Small', index.lookup(7))
+        self.assertIsNone(index.lookup(12345))
+        self.assertEqual('csv', index.types['00007 - Small'])
+
     def test_add_new_tags(self):
         session1 = self._get_session()
         dataset1 = session1.newDataset(
@@ -271,6 +373,7 @@ class DatasetTest(_DatavaultTestCase):
         self.session = mock.MagicMock()
         self.session.hub = self.hub
         self.session.dir = _unique_dir()
+        self.session.session_store.io_executor = None
 
     def tearDown(self):
         _empty_and_remove_dir(self.session.dir)
@@ -370,6 +473,8 @@ class DatasetTest(_DatavaultTestCase):
 
         # Add the data.
         dataset.addData(data)
+        self.assertFalse(self.hub.onDataAvailable.called)
+        dataset.flush()
 
         self.hub.onDataAvailable.assert_called_with(None, set(['foo listener']))
         data_in_dataset, count = dataset.getData(None, 0, simpleOnly=True)
@@ -394,6 +499,8 @@ class DatasetTest(_DatavaultTestCase):
 
         # Add the data.
         dataset.addData(data)
+        self.assertFalse(self.hub.onDataAvailable.called)
+        dataset.flush()
 
         self.hub.onDataAvailable.assert_called_with(None, set(['foo listener']))
 
@@ -425,6 +532,7 @@ class DatasetTest(_DatavaultTestCase):
         dataset.addData(data)
 
         # Save the dataset
+        dataset.flush()
         dataset.save()
 
         # Create a new dataset that loads the data.
@@ -518,9 +626,164 @@ class DatasetTest(_DatavaultTestCase):
         dataset.keepStreaming(listener, 1)
         # Add more data.
         dataset.addData(data)
-        # Trigger the listener again.
+        # Trigger the listener again when the data is written.
+        dataset.flush()
         self.hub.onDataAvailable.assert_called_with(None, set([listener]))
 
+    def test_buffered_data_visible_to_readers(self):
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS)
+
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(data)
+        dataset.addData(data)
+        self.assertFalse(dataset.data.hasMore(0))
+        self.assertTrue(dataset.hasMore(1))
+        self.assertFalse(dataset.hasMore(2))
+
+        data_in_dataset, count = dataset.getData(None, 0, simpleOnly=True)
+        self.assertEqual(count, 2)
+        self.assertArrayEqual([[1, 2, 3], [1, 2, 3]], data_in_dataset)
+
+    def test_buffer_flushes_on_row_limit(self):
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS)
+        dataset.listeners.add('listener')
+
+        rows = [(i, i, i) for i in range(datavault.WRITE_BUFFER_ROWS)]
+        dataset.addData(self._get_records_simple(rows[:-1], dataset.data.dtype))
+        self.assertFalse(self.hub.onDataAvailable.called)
+        dataset.addData(self._get_records_simple(rows[-1:], dataset.data.dtype))
+        self.hub.onDataAvailable.assert_called_once_with(None, set(['listener']))
+        self.assertEqual(len(dataset.data), datavault.WRITE_BUFFER_ROWS)
+
+    @mock.patch.object(datavault, 'STATS_CHUNK_ROWS', 4)
+    def test_statistics_cached_for_growing_dataset(self):
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS)
+        rows = [(i, 2 * i, np.nan if i == 3 else i) for i in range(10)]
+        dataset.addData(self._get_records_simple(rows, dataset.data.dtype))
+        count, mean, std, lo, hi = dataset.getStatistics(1)
+        self.assertEqual((10, 9, 18), (count, mean, hi))
+        self.assertAlmostEqual(np.std(np.arange(10) * 2), std)
+        self.assertEqual(9, dataset.getStatistics(2)[0])
+        self.assertEqual((3, 1.0), dataset.getStatistics(0, 0, 3)[:2])
+
+        more = [(i, 2 * i, i) for i in range(10, 13)]
+        dataset.addData(self._get_records_simple(more, dataset.data.dtype))
+        with mock.patch.object(dataset, 'getData', wraps=dataset.getData) as get:
+            count, mean, std, lo, hi = dataset.getStatistics(1)
+        # only the new rows were read
+        self.assertEqual([10], [call[0][1] for call in get.call_args_list])
+        self.assertEqual((13, 12, 0, 24), (count, mean, lo, hi))
+        self.assertAlmostEqual(np.std(np.arange(13) * 2), std)
+
+    def test_histogram(self):
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS)
+        rows = [(i, i % 4, 0) for i in range(8)]
+        dataset.addData(self._get_records_simple(rows, dataset.data.dtype))
+        edges, counts = dataset.getHistogram(1, 3)
+        self.assertArrayEqual([0, 1, 2, 3], edges)
+        self.assertArrayEqual([2, 2, 4], counts)
+        edges, counts = dataset.getHistogram(0, 2, 0, 4, start=2)
+        self.assertArrayEqual([0, 3], counts)
+        # constant columns get a unit-wide range
+        edges, counts = dataset.getHistogram(2, 1)
+        self.assertArrayEqual([-0.5, 0.5], edges)
+        self.assertArrayEqual([8], counts)
+
+        # a cached histogram is extended, or redone if its range changes
+        more = [(8, 1, 0), (9, 5, 0)]
+        dataset.addData(self._get_records_simple(more, dataset.data.dtype))
+        edges, counts = dataset.getHistogram(0, 2, 0, 4, start=2)
+        self.assertArrayEqual([0, 3], counts)
+        edges, counts = dataset.getHistogram(1, 5)
+        self.assertArrayEqual([0, 1, 2, 3, 4, 5], edges)
+        self.assertArrayEqual([2, 3, 2, 2, 1], counts)
+
+    def test_buffer_flushes_after_delay(self):
+        clock = task.Clock()
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS,
+                reactor=clock)
+        dataset.listeners.add('listener')
+
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(data)
+        dataset.addData(data)
+        clock.advance(datavault.WRITE_BUFFER_DELAY)
+        # both adds are written and notified together
+        self.hub.onDataAvailable.assert_called_once_with(None, set(['listener']))
+        self.assertEqual(len(dataset.data), 2)
+
+    def test_failed_write_keeps_rows(self):
+        clock = task.Clock()
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS,
+                reactor=clock)
+        dataset.listeners.add('listener')
+
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(data)
+        dataset.addData(data)
+        with mock.patch.object(dataset.data, 'addData',
+                               side_effect=IOError('disk full')):
+            clock.advance(datavault.WRITE_BUFFER_DELAY)
+        self.assertFalse(self.hub.onDataAvailable.called)
+        self.assertEqual(len(dataset.data), 0)
+
+        # the error is reported once, and the rows are written by the
+        # next flush
+        self.assertRaises(errors.DataWriteError, dataset.addData, data)
+        dataset.addData(data)
+        clock.advance(datavault.WRITE_BUFFER_DELAY)
+        self.hub.onDataAvailable.assert_called_once_with(None, set(['listener']))
+        data_in_dataset, count = dataset.getData(None, 0, simpleOnly=True)
+        self.assertEqual(count, 3)
+        self.assertArrayEqual([[1, 2, 3]] * 3, data_in_dataset)
+
+    def test_add_data_wrong_number_of_columns(self):
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS)
+        data = np.core.records.fromarrays([[1], [2]])
+        self.assertRaises(errors.BadDataError, dataset.addData, data)
+
 
 if __name__ == '__main__':
     pytest.main(['-v', '-s', __file__])
@@ -0,0 +1,264 @@
+import mock
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from datavault import Session, SessionStore, backend, errors, server
+from datavault.executor import IOExecutor
+
+
+class MockContext(dict):
+    def __init__(self, name='test-context'):
+        self.ID = name
+
+
+class _Key(object):
+    pass
+
+
+def setUpModule():
+    # trial fails tests that leave delayed calls on the global reactor, so
+    # pause the sweeps of the pools shared with other test modules
+    backend.get_file_pool().stop()
+    backend.get_data_cache().stop()
+
+
+def tearDownModule():
+    backend.get_file_pool().start()
+    backend.get_data_cache().start()
+
+
+def _use_own_pools(test):
+    """Give the backend files of a test their own FilePool and DataCache.
+
+    Their periodic sweeps run on the global reactor, so they are stopped
+    when the test ends, leaving the shared pools of other tests running.
+    """
+    pools = weakref.WeakKeyDictionary()
+    caches = weakref.WeakKeyDictionary()
+    for name, registry in [('_file_pools', pools), ('_data_caches', caches)]:
+        patcher = mock.patch.object(backend, name, registry)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    def stop():
+        for pool in pools.values() + caches.values():
+            pool.stop()
+    test.addCleanup(stop)
+
+
+class IOExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = IOExecutor(threads=4)
+        self.executor.start()
+        self.addCleanup(self.executor.stop)
+
+    @defer.inlineCallbacks
+    def test_calls_with_same_key_run_in_order(self):
+        key = _Key()
+        calls = []
+        def call(i):
+            time.sleep(0.001 * (5 - i))
+            calls.append(i)
+            return i
+        results = yield defer.gatherResults(
+                [self.executor.run(key, call, i) for i in range(5)])
+        self.assertEqual(range(5), results)
+        self.assertEqual(range(5), calls)
+
+    @defer.inlineCallbacks
+    def test_calls_with_different_keys_run_concurrently(self):
+        started = threading.Event()
+        def first():
+            # only finishes if the second call runs while this one waits
+            return started.wait(5)
+        d1 = self.executor.run(_Key(), first)
+        d2 = self.executor.run(_Key(), started.set)
+        first_finished = yield d1
+        yield d2
+        self.assertTrue(first_finished)
+
+    def test_errors_are_returned(self):
+        d = self.executor.run(_Key(), lambda: 1 // 0)
+        return self.assertFailure(d, ZeroDivisionError)
+
+
+class ExecutorServerTest(unittest.TestCase):
+    """Tests for server settings that do their file I/O in the executor."""
+
+    def setUp(self):
+        _use_own_pools(self)
+        self.datadir = tempfile.mkdtemp(prefix='dvtest_')
+        self.store = SessionStore(self.datadir, mock.MagicMock())
+        self.store.io_executor = IOExecutor(threads=2)
+        self.store.io_executor.start()
+        self.datavault = server.DataVault(self.store)
+        self.datavault.initServer()
+        self.c = MockContext()
+        self.datavault.initContext(self.c)
+        self.datavault.new(self.c, 'foo', [('x', 's')], [('y', 'y', 'V')])
+        self.datavault.add(self.c, [(1, 2), (3, 4)])
+        self.datavault.mkdir(self.c, 'dest')
+        # record the threads that dataset files are written in
+        self.threads = []
+        stage = Session._stageFiles
+        def staged(session, sources):
+            self.threads.append(threading.current_thread())
+            return stage(session, sources)
+        patcher = mock.patch.object(Session, '_stageFiles', staged)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        d = self.store.flush()
+        def cleanup(_):
+            self.store.io_executor.stop()
+            shutil.rmtree(self.datadir)
+        return d.addCallback(cleanup)
+
+    @defer.inlineCallbacks
+    def test_copy_dataset(self):
+        path, name = yield self.datavault.copy_dataset(self.c, ['', 'dest'])
+        self.assertEqual((['', 'dest'], '00001 - foo'), (path, name))
+        self.assertTrue(self.threads)
+        self.assertNotIn(threading.current_thread(), self.threads)
+        self.datavault.cd(self.c, 'dest')
+        self.datavault.open(self.c, name)
+        data = yield self.datavault.get(self.c)
+        self.assertEqual([[1, 2], [3, 4]], np.asarray(data).tolist())
+
+    @defer.inlineCallbacks
+    def test_import_dataset(self):
+        export = yield self.datavault.export_dataset(self.c, 0, 1 << 20)
+        self.datavault.cd(self.c, 'dest')
+        path, name = yield self.datavault.import_dataset(self.c, export)
+        self.assertEqual((['', 'dest'], '00001 - foo'), (path, name))
+        self.assertTrue(self.threads)
+        self.assertNotIn(threading.current_thread(), self.threads)
+        data = yield self.datavault.get(self.c)
+        self.assertEqual([[1, 2], [3, 4]], np.asarray(data).tolist())
+        yield self.assertFailure(self.datavault.import_dataset(self.c, 'junk'),
+                                 errors.DatasetImportError)
+
+    def _record_threads(self, obj, *names):
+        def record(method):
+            def recorded(*args, **kw):
+                self.threads.append(threading.current_thread())
+                return method(*args, **kw)
+            return recorded
+        for name in names:
+            setattr(obj, name, record(getattr(obj, name)))
+
+    @defer.inlineCallbacks
+    def test_parameters_and_comments(self):
+        data = self.datavault.getDataset(self.c).data
+        self._record_threads(data, 'addParam', 'getParameter', 'addComment',
+                             'getComments', 'numComments')
+        yield self.datavault.add_parameter(self.c, 'a', 1.0)
+        yield self.datavault.add_parameters(self.c, (('b', 2.0),))
+        params = yield self.datavault.get_parameters(self.c)
+        self.assertEqual((('a', 1.0), ('b', 2.0)), params)
+        value = yield self.datavault.get_parameter(self.c, 'b')
+        self.assertEqual(2.0, value)
+        yield self.datavault.add_comment(self.c, 'hello', 'me')
+        comments = yield self.datavault.get_comments(self.c)
+        self.assertEqual([('me', 'hello')], [c[1:] for c in comments])
+        self.assertEqual(1, self.c['commentpos'])
+        self.assertTrue(self.threads)
+        self.assertNotIn(threading.current_thread(), self.threads)
+
+
+class ConcurrentAccessTest(unittest.TestCase):
+    """Stress test with concurrent writers and readers of several datasets.
+
+    Checks that all rows are read back, and that the reactor stays
+    responsive while I/O runs in the executor.
+    """
+
+    # generous bound on the 99th percentile of reactor lag, in seconds
+    MAX_REACTOR_LAG = 0.5
+
+    WRITERS = 4
+    READERS_PER_WRITER = 2
+    BATCHES = 40
+    ROWS_PER_BATCH = 250
+
+    def setUp(self):
+        _use_own_pools(self)
+        self.datadir = tempfile.mkdtemp(prefix='dvtest_')
+        self.store = SessionStore(self.datadir, mock.MagicMock())
+        self.store.io_executor = IOExecutor(threads=4)
+        self.store.io_executor.start()
+        self.datavault = server.DataVault(self.store)
+        self.datavault.initServer()
+
+    def tearDown(self):
+        d = self.store.flush()
+        def cleanup(_):
+            self.store.io_executor.stop()
+            shutil.rmtree(self.datadir)
+        return d.addCallback(cleanup)
+
+    def _context(self, name):
+        c = MockContext(name)
+        self.datavault.initContext(c)
+        return c
+
+    @defer.inlineCallbacks
+    def _write(self, c):
+        for i in range(self.BATCHES):
+            start = i * self.ROWS_PER_BATCH
+            x = np.arange(start, start + self.ROWS_PER_BATCH, dtype=float)
+            self.datavault.add(c, np.vstack((x, 2 * x)).T)
+            yield task.deferLater(reactor, 0, lambda: None)
+        yield self.datavault.getDataset(c).flush()
+
+    @defer.inlineCallbacks
+    def _read(self, c, name):
+        self.datavault.open(c, name)
+        total = self.BATCHES * self.ROWS_PER_BATCH
+        rows = []
+        while sum(len(r) for r in rows) < total:
+            data = yield defer.maybeDeferred(self.datavault.get, c)
+            rows.append(np.asarray(data).reshape(-1, 2))
+            yield task.deferLater(reactor, 0.001, lambda: None)
+        data = np.vstack(rows)
+        self.assertTrue(np.array_equal(np.arange(total), data[:, 0]))
+        self.assertTrue(np.array_equal(2 * data[:, 0], data[:, 1]))
+
+    @defer.inlineCallbacks
+    def test_concurrent_readers_and_writers(self):
+        writers = []
+        for i in range(self.WRITERS):
+            c = self._context('writer-{}'.format(i))
+            self.datavault.new(c, 'stress {}'.format(i), [('x', 's')],
+                               [('y', 'y', 'V')])
+            writers.append(c)
+        reactor_lags = []
+        last = [time.time()]
+        def beat():
+            now = time.time()
+            reactor_lags.append(now - last[0])
+            last[0] = now
+        heartbeat = task.LoopingCall(beat)
+        heartbeat.start(0.001)
+        try:
+            jobs = [self._write(c) for c in writers]
+            for i, c in enumerate(writers):
+                for j in range(self.READERS_PER_WRITER):
+                    reader = self._context('reader-{}-{}'.format(i, j))
+                    jobs.append(self._read(reader, c['dataset']))
+            yield defer.gatherResults(jobs, consumeErrors=True)
+        finally:
+            heartbeat.stop()
+
+        p99 = np.percentile(reactor_lags, 99)
+        self.assertTrue(p99 < self.MAX_REACTOR_LAG,
+                        'reactor lag p99 {:.3f} s'.format(p99))
@@ -0,0 +1,105 @@
+import mock
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+import unittest
+
+import numpy as np
+
+from datavault import backend, errors
+from datavault.reader import LiveDataset
+
+_READER = """
+import sys
+from datavault.reader import LiveDataset
+with LiveDataset(sys.argv[1]) as ds:
+    print len(ds.tail()), ds.getParamNames(), ds.numComments()
+"""
+
+
+class SWMRTest(unittest.TestCase):
+    """Tests for HDF5 datasets written in SWMR mode, and the reader for them."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='dvtest_')
+        self.base = os.path.join(self.dir, 'live')
+        storage = backend.parse_storage_policy('swmr, growth=2')
+        indep = [backend.Independent('x', (1,), 'v', 's')]
+        dep = [backend.Dependent('y', 'y', (1,), 'v', 'V')]
+        self.data = backend.create_backend(self.base, 'live', indep, dep,
+                                           False, storage)
+        self.reader = LiveDataset(self.base + '.hdf5')
+
+    def tearDown(self):
+        self.reader.close()
+        self.data.file.close()
+        shutil.rmtree(self.dir)
+
+    def _add_rows(self, x):
+        x = np.asarray(x, dtype=float)
+        self.data.addData(np.core.records.fromarrays([x, 2 * x],
+                                                     names='f0,f1'))
+
+    def test_reader_tails_rows(self):
+        self.assertTrue(self.data.swmr)
+        self.assertEqual(0, len(self.reader.tail()))
+        self._add_rows([1, 2, 3])
+        self.assertEqual([1, 2, 3], list(self.reader.tail()['f0']))
+        self._add_rows([4])
+        self.assertEqual([4], list(self.reader.tail()['f0']))
+        self.assertEqual(4, len(self.reader))
+        # growth does not apply; the file holds exactly the rows written
+        self.assertEqual(4, self.data.dataset.shape[0])
+
+    def test_reader_sees_metadata(self):
+        self.assertEqual('live', self.reader.getTitle())
+        self.assertEqual('y', self.reader.getDependents()[0].label)
+        self.data.addParam('gain', 3.5)
+        self.data.addComment('user', 'hello')
+        self.data.access()
+        self.assertRaises(errors.ParameterInUseError,
+                          self.data.addParam, 'gain', 1.0)
+        self.reader.refresh()
+        self.assertEqual(['gain'], self.reader.getParamNames())
+        self.assertEqual(3.5, self.reader.getParameter('gain'))
+        self.assertEqual('hello', self.reader.getComments(None, 0)[0][0][2])
+
+    def test_reopen_for_writing(self):
+        self.data.addParam('gain', 3.5)
+        self._add_rows([1, 2])
+        self.reader.close()
+        self.data.file.close()
+        data = backend.open_backend(self.base)
+        self.assertTrue(data.swmr)
+        self.assertEqual(3.5, data.getParameter('gain'))
+        self.assertEqual(2, len(data))
+        self.data = data
+        self._add_rows([3])
+        self.reader = LiveDataset(self.base + '.hdf5')
+        self.assertEqual(3, len(self.reader))
+
+    def test_open_errors_other_than_locks_are_raised(self):
+        base = os.path.join(self.dir, 'junk')
+        with open(base + '.hdf5', 'wb') as f:
+            f.write('junk')
+        with mock.patch.object(backend, 'open_swmr_file') as open_swmr:
+            self.assertRaises(IOError, backend.open_backend, base)
+        self.assertFalse(open_swmr.called)
+
+    def test_reader_in_another_process(self):
+        self._add_rows(range(5))
+        self.data.addParam('gain', 3.5)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+                [os.path.dirname(os.path.dirname(os.path.dirname(
+                        os.path.abspath(__file__))))] +
+                [p for p in [env.get('PYTHONPATH')] if p])
+        out = subprocess.check_output(
+                [sys.executable, '-c', _READER, self.base + '.hdf5'], env=env)
+        self.assertEqual("5 ['gain'] 0", out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import mock
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from datavault import SessionStore, search
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp(prefix='dvtest_')
+        self.store = SessionStore(self.datadir, mock.MagicMock())
+        self.store.search_index = search.open_index(self.datadir)
+        self.index = self.store.search_index
+
+    def tearDown(self):
+        self.store.flush() # cancels the pending metadata flush
+        self.index.close()
+        shutil.rmtree(self.datadir)
+
+    def _populate(self):
+        root = self.store.get([''])
+        sub = self.store.get(['', 'sub/dir'])
+        dsA = root.newDataset('resonator scan', ['f [GHz]'], ['S21 (mag) [dB]'])
+        dsA.addParameter('power', -20.0)
+        dsA.addParameters([('sample', 'chip 1'), ('n', 3)])
+        dsB = sub.newDataset('qubit scan', ['t [ns]'], ['P1 (prob) []'])
+        dsB.addParameter('sample', 'chip 2')
+        root.updateTags(['good'], [], [dsA.name])
+        return dsA, dsB
+
+    def test_new_index_is_built_from_disk(self):
+        self.index.close()
+        os.remove(os.path.join(self.datadir, search.INDEX_FILENAME))
+        self.index = search.open_index(self.datadir)
+        self.assertEqual(self.index.search(), [])
+
+    def test_existing_index_is_not_built(self):
+        self.index.close()
+        os.remove(os.path.join(self.datadir, search.INDEX_FILENAME))
+        self.assertIsNone(search.open_existing_index(self.datadir))
+        self.index = search.open_index(self.datadir)
+        existing = search.open_existing_index(self.datadir)
+        self.assertEqual(existing.search(), [])
+        existing.close()
+
+    def test_search_filters(self):
+        dsA, dsB = self._populate()
+        A = ([''], dsA.name)
+        B = (['', 'sub/dir'], dsB.name)
+        self.assertEqual(self.index.search(), [A, B])
+        self.assertEqual(self.index.search(titles=['^qubit']), [B])
+        self.assertEqual(self.index.search(titles=['scan', 'reso']), [A])
+        self.assertEqual(self.index.search(tags=['good']), [A])
+        self.assertEqual(self.index.search(tags=['-good']), [B])
+        self.assertEqual(self.index.search(params=[('sample', 'chip 2')]), [B])
+        self.assertEqual(self.index.search(params=[('n', 3.0)]), [A])
+        self.assertEqual(self.index.search(params=[('power', -20)]), [A])
+        self.assertEqual(self.index.search(params=[('power', -10)]), [])
+        self.assertEqual(self.index.search(under=['', 'sub/dir']), [B])
+        self.assertEqual(self.index.search(under=['', 'sub']), [])
+        now = time.time()
+        self.assertEqual(self.index.search(created_after=now - 60), [A, B])
+        self.assertEqual(self.index.search(created_before=now - 60), [])
+
+    def test_update_tags(self):
+        dsA, dsB = self._populate()
+        root = self.store.get([''])
+        root.updateTags(['-good'], [], [dsA.name])
+        self.assertEqual(self.index.search(tags=['good']), [])
+
+    def test_rebuild_matches_incremental_index(self):
+        self._populate()
+        queries = [{}, {'tags': ['good']}, {'params': [('sample', 'chip 1')]},
+                   {'params': [('n', 3)]}, {'under': ['', 'sub/dir']}]
+        before = [self.index.search(**q) for q in queries]
+        self.store.flush()
+        self.index.rebuild(self.datadir)
+        after = [self.index.search(**q) for q in queries]
+        self.assertEqual(before, after)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -58,6 +58,7 @@ class DataVaultTest(unittest.TestCase):
         self.datavault.initServer()
 
     def tearDown(self):
+        self.store.flush() # cancels the pending metadata flush
         _empty_and_remove_dir(self.datadir)
 
     def assertArrayEqual(self, expected, actual, msg=None):
@@ -225,6 +226,8 @@ class DataVaultTest(unittest.TestCase):
         self.datavault.initContext(self.context)
         self.datavault.cd(self.context, path='first', create=True)
         self.datavault.cd(self.context, path=['second', 'third'], create=True)
+        # sessions with unsaved access times are kept alive until flushed
+        self.store.flushMetadata()
         all_sessions = self.datavault.dump_existing_sessions(self.context)
         self.assertEqual(['/first/second/third'], all_sessions)
 
@@ -261,6 +264,388 @@ class DataVaultTest(unittest.TestCase):
                 self.context,
                 startOver=True)
 
+    def test_get_decimated(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        rows = [(i, i % 7) for i in range(100)]
+        self.datavault.add(self.context, rows)
+        data = self.datavault.get_decimated(self.context, 10, 'minmax')
+        # five bins of 20 rows, with a min and a max row for each
+        self.assertEqual((10, 2), data.shape)
+        self.assertArrayEqual([[0, 0], [19, 6]], data[:2])
+
+        # only the reduced tail is returned for new rows
+        self.datavault.add(self.context, [(100, 1), (101, 2)])
+        data = self.datavault.get_decimated(self.context, 10, 'mean')
+        self.assertArrayEqual([[100.5, 1.5]], data)
+        data = self.datavault.get_decimated(self.context, 10, 'mean')
+        self.assertEqual(0, len(data))
+
+        data = self.datavault.get_decimated(
+                self.context, 10, 'stride', startOver=True)
+        self.assertArrayEqual([[0, 0], [11, 4], [22, 1]], data[:3])
+        self.assertRaises(errors.DecimationMethodError,
+                          self.datavault.get_decimated, self.context, 10, 'foo')
+
+    def test_get_range(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('time', 's')], [('y', 'E', 'eV')])
+        self.datavault.add(self.context, [(i, i * 10) for i in range(10)])
+        data = self.datavault.get_range(self.context, 'time', 2.5, 5)
+        self.assertArrayEqual([[3, 30], [4, 40], [5, 50]], data)
+        # get continues from the end of the range
+        data = self.datavault.get(self.context, limit=1)
+        self.assertArrayEqual([[6, 60]], data)
+        data = self.datavault.get_range(self.context, 0, 20, 30)
+        self.assertEqual(0, len(data))
+        self.assertRaises(errors.ColumnNotFoundError,
+                          self.datavault.get_range, self.context, 'x', 0, 1)
+
+    def test_stream_rows(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        dataset = self.datavault.getDataset(self.context)
+        self.datavault.add(self.context, [(1, 10)])
+        self.datavault.stream_rows(self.context, max_rows=3, columns=['y'])
+        # unread rows are pushed right away
+        (start, rows), contexts = self.hub.onDataPushed.call_args[0]
+        self.assertEqual(0, start)
+        self.assertArrayEqual([[10]], rows)
+        self.assertEqual([self.context.ID], contexts)
+        self.datavault.add(self.context, [(2, 20), (3, 30)])
+        dataset.flush()
+        (start, rows), _ = self.hub.onDataPushed.call_args[0]
+        self.assertEqual(1, start)
+        self.assertArrayEqual([[20], [30]], rows)
+        # pushed rows are not returned again by get
+        self.assertEqual(0, len(self.datavault.get(self.context)))
+
+        # too many rows to push; notify and let the client catch up
+        self.hub.reset_mock()
+        self.datavault.add(self.context, [(i, i) for i in range(4, 8)])
+        dataset.flush()
+        self.assertFalse(self.hub.onDataPushed.called)
+        self.hub.onDataAvailable.assert_called_with(None, [self.context.ID])
+        self.assertEqual(4, len(self.datavault.get(self.context)))
+        self.datavault.add(self.context, [(8, 80)])
+        dataset.flush()
+        (start, rows), _ = self.hub.onDataPushed.call_args[0]
+        self.assertEqual(7, start)
+        self.assertArrayEqual([[80]], rows)
+
+        self.hub.reset_mock()
+        self.datavault.stream_rows(self.context, False)
+        self.datavault.add(self.context, [(9, 90)])
+        dataset.flush()
+        self.assertFalse(self.hub.onDataPushed.called)
+
+    def test_stream_rows_extended(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(self.context, 'foo', [('x', [1], 'v', 'ms')],
+                              [('y', 'E', [1], 'v', 'eV')])
+        self.datavault.add_ex(self.context, [(1., 10.)])
+        self.datavault.stream_rows(self.context)
+        (start, rows), contexts = self.hub.onDataPushed.call_args[0]
+        self.assertEqual(0, start)
+        self.assertArrayEqual([[1, 10]], rows)
+        self.assertEqual([self.context.ID], contexts)
+        # only float columns can be pushed
+        self.datavault.new_ex(
+                self.context, 'bar',
+                [('x', [1], 'v', 'ms'), ('n', [1], 'i', '')],
+                [('y', 'E', [1], 'v', 'eV')])
+        self.assertRaises(errors.DataVersionMismatchError,
+                          self.datavault.stream_rows, self.context)
+        self.datavault.stream_rows(self.context, columns=['x', 'y'])
+
+    def test_stream_rows_read_error(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        dataset = self.datavault.getDataset(self.context)
+        self.datavault.stream_rows(self.context)
+        self.datavault.add(self.context, [(1, 10)])
+        with mock.patch.object(dataset.data, 'getData',
+                               side_effect=IOError('read failed')):
+            dataset.flush()
+        # the rows are not pushed, and get still returns them
+        self.assertFalse(self.hub.onDataPushed.called)
+        self.hub.onDataAvailable.assert_called_with(None, [self.context.ID])
+        self.assertArrayEqual([[1, 10]], self.datavault.get(self.context))
+
+    def test_poll(self):
+        writer = MockContext('writer')
+        self.datavault.initContext(writer)
+        self.datavault.mkdir(writer, 'sub')
+        path, name = self.datavault.new(
+                writer, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(writer, [(1, 10), (2, 20)])
+        self.datavault.cd(writer, 'sub')
+        sub_path, _ = self.datavault.new(
+                writer, 'bar', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(writer, [(3, 30)])
+
+        self.datavault.initContext(self.context)
+        results = self.datavault.poll(
+                self.context, [(path, name, 0), (sub_path, 1, 0)])
+        self.assertEqual([2, 1], [pos for pos, _ in results])
+        self.assertArrayEqual([[1, 10], [2, 20]], results[0][1])
+        self.assertArrayEqual([[3, 30]], results[1][1])
+        self.assertNotIn('dataset', self.context)
+
+        # listening for more rows of both datasets
+        self.hub.reset_mock()
+        self.datavault.add(writer, [(4, 40)])
+        self.store.flush()
+        self.hub.onDataAvailable.assert_called_with(None, set([self.context.ID]))
+        results = self.datavault.poll(
+                self.context, [(path, name, 2), (sub_path, 1, 1)],
+                columns=['y'])
+        self.assertEqual([2, 2], [pos for pos, _ in results])
+        self.assertEqual(0, len(results[0][1]))
+        self.assertArrayEqual([[40]], results[1][1])
+
+        # only the datasets of the last poll are kept and signalled
+        results = self.datavault.poll(self.context, [(sub_path, 1, 1)],
+                                      columns=[0])
+        self.assertArrayEqual([[4]], results[0][1])
+        self.assertEqual([(tuple(sub_path), '00001 - bar')],
+                         self.context['polled'].keys())
+        other = MockContext('other')
+        self.datavault.initContext(other)
+        self.datavault.open(other, name, True)
+        self.hub.reset_mock()
+        self.datavault.add(other, [(5, 50)])
+        self.store.flush()
+        for args, _ in self.hub.onDataAvailable.call_args_list:
+            self.assertNotIn(self.context.ID, args[1])
+
+        # limit, and rows left over are signalled right away
+        self.hub.reset_mock()
+        results = self.datavault.poll(self.context, [(path, name, 0)], limit=1)
+        self.assertEqual(1, results[0][0])
+        self.hub.onDataAvailable.assert_called_with(None, [self.context.ID])
+
+        self.assertRaises(errors.DirectoryNotFoundError, self.datavault.poll,
+                          self.context, [(['', 'nope'], name, 0)])
+        self.assertRaises(errors.DatasetNotFoundError, self.datavault.poll,
+                          self.context, [(path, 'nope', 0)])
+
+    def test_export_import_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(self.context, [(i, i * 10) for i in range(100)])
+        self.datavault.add_parameter(self.context, 'gain', 3.5)
+        self.datavault.add_comment(self.context, 'hello', 'me')
+        self.datavault.update_tags(self.context, 'good', [], '00001 - foo')
+        chunks = []
+        while True:
+            offset = sum(len(chunk) for chunk in chunks)
+            chunk = self.datavault.export_dataset(self.context, offset, 1000)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertTrue(len(chunks) > 1)
+        self.assertRaises(errors.DatasetExportError,
+                          self.datavault.export_dataset, self.context, 1000)
+
+        self.datavault.mkdir(self.context, 'copies')
+        self.datavault.cd(self.context, 'copies')
+        for chunk in chunks[:-1]:
+            self.datavault.import_chunk(self.context, chunk)
+        path, name = self.datavault.import_dataset(self.context, chunks[-1])
+        self.assertEqual(['', 'copies'], path)
+        self.assertEqual('00001 - foo', name)
+        data = self.datavault.get(self.context)
+        self.assertArrayEqual([[i, i * 10] for i in range(100)], data)
+        self.assertEqual(3.5, self.datavault.get_parameter(self.context, 'gain'))
+        comments = self.datavault.get_comments(self.context)
+        self.assertEqual('hello', comments[0][2])
+        self.assertEqual(([], [(name, ['good'])]),
+                         self.datavault.get_tags(self.context, [], name))
+        self.assertRaises(errors.DatasetImportError,
+                          self.datavault.import_dataset, self.context, 'junk')
+
+    def test_export_restarts_at_offset_zero(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(self.context, [(1, 2)])
+        # an export given up after its first piece
+        self.datavault.export_dataset(self.context, 0, 100)
+        chunks = [self.datavault.export_dataset(self.context, 0, 100)]
+        while chunks[-1]:
+            chunks.append(self.datavault.export_dataset(
+                    self.context, len(''.join(chunks)), 100))
+        path, name = self.datavault.import_dataset(self.context,
+                                                   ''.join(chunks))
+        self.assertArrayEqual([[1, 2]], self.datavault.get(self.context))
+
+    def test_export_uses_directory_of_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.mkdir(self.context, 'other')
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(self.context, [(1, 2)])
+        self.datavault.update_tags(self.context, 'good', [], '00001 - foo')
+        # a dataset of the same name in another directory
+        other = MockContext('other')
+        self.datavault.initContext(other)
+        self.datavault.cd(other, 'other')
+        self.datavault.new(other, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(other, [(3, 4)])
+        self.datavault.update_tags(other, 'bad', [], '00001 - foo')
+
+        # export a piece of the first dataset, then the other from the same
+        # context after changing directory
+        first = self.datavault.export_dataset(self.context, 0, 100)
+        self.datavault.cd(self.context, 'other')
+        self.datavault.open(self.context, '00001 - foo')
+        self.datavault.cd(self.context, 1)
+        self.assertRaises(errors.DatasetExportError,
+                          self.datavault.export_dataset, self.context,
+                          len(first), 100)
+        chunks = [self.datavault.export_dataset(self.context, 0, 100)]
+        while chunks[-1]:
+            chunks.append(self.datavault.export_dataset(
+                    self.context, len(''.join(chunks)), 100))
+        self.datavault.cd(self.context, 'other')
+        path, name = self.datavault.import_dataset(self.context,
+                                                   ''.join(chunks))
+        self.assertArrayEqual([[3, 4]], self.datavault.get(self.context))
+        self.assertEqual(([], [(name, ['bad'])]),
+                         self.datavault.get_tags(self.context, [], name))
+
+    def test_copy_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.mkdir(self.context, 'dest')
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        self.datavault.add(self.context, [(1, 2), (3, 4)])
+        self.datavault.add_parameter(self.context, 'gain', 3.5)
+        path, name = self.datavault.copy_dataset(self.context, ['', 'dest'])
+        self.assertEqual((['', 'dest'], '00001 - foo'), (path, name))
+        # the copy includes buffered data, and the context is unchanged
+        self.assertEqual([''], self.datavault.cd(self.context))
+        self.datavault.cd(self.context, 'dest')
+        self.datavault.open(self.context, 1)
+        self.assertArrayEqual([[1, 2], [3, 4]], self.datavault.get(self.context))
+        self.assertEqual(3.5, self.datavault.get_parameter(self.context, 'gain'))
+        self.assertRaises(errors.DirectoryNotFoundError,
+                          self.datavault.copy_dataset, self.context,
+                          ['', 'nowhere'])
+
+    def test_file_pool_stats(self):
+        self.datavault.initContext(self.context)
+        before = self.datavault.file_pool_stats(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        after = self.datavault.file_pool_stats(self.context)
+        self.assertEqual(6, len(after))
+        self.assertEqual(before[3] + 1, after[3]) # opened the new file
+        self.assertTrue(after[2] > before[2])
+
+    def test_data_cache_stats(self):
+        stats = self.datavault.data_cache_stats(self.context)
+        self.assertEqual(7, len(stats))
+        self.assertEqual(backend.CSV_CACHE_BYTES, stats[2])
+
+    def test_new_with_storage_policy(self):
+        self.datavault.initContext(self.context)
+        self.store.storage_policy = backend.parse_storage_policy('growth=2')
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')],
+                'chunk=8, gzip')
+        dataset = self.datavault.getDataset(self.context)
+        self.assertEqual((8,), dataset.data.dataset.chunks)
+        self.assertEqual('gzip', dataset.data.dataset.compression)
+        self.datavault.add(self.context, [(.1, .2), (.3, .4), (.5, .6)])
+        dataset.flush()
+        self.datavault.add(self.context, [(.7, .8)])
+        data = self.datavault.get(self.context)
+        self.assertArrayEqual([[.1, .2], [.3, .4], [.5, .6], [.7, .8]], data)
+        # storage grew geometrically from 3 rows to 6
+        self.assertEqual(6, dataset.data.dataset.shape[0])
+
+    def test_new_binary_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')],
+                'format=binary')
+        self.assertEqual('4.0.0', self.datavault.get_version(self.context))
+        self.datavault.add(self.context, [(.1, .2), (.3, .4)])
+        self.datavault.add_parameter(self.context, 'gain', 3.5)
+        self.store.flush()
+        # reopened from disk
+        self.store = SessionStore(self.datadir, self.hub)
+        self.datavault = server.DataVault(self.store)
+        self.context = MockContext()
+        self.datavault.initContext(self.context)
+        self.datavault.open(self.context, 1)
+        self.assertEqual('4.0.0', self.datavault.get_version(self.context))
+        data = self.datavault.get(self.context)
+        self.assertArrayEqual([[.1, .2], [.3, .4]], data)
+        self.assertEqual(3.5, self.datavault.get_parameter(self.context, 'gain'))
+
+    def test_stop_checkpoints_binary_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')],
+                'format=binary')
+        self.datavault.add(self.context, [(.1, .2), (.3, .4)])
+        data = self.datavault.getDataset(self.context).data
+        self.datavault.stopServer()
+        self.assertEqual(2, data._checkpoint)
+
+    def test_new_swmr_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')], 'swmr')
+        self.datavault.add(self.context, [(.1, .2), (.3, .4)])
+        self.datavault.add_parameter(self.context, 'gain', 3.5)
+        self.datavault.add_comment(self.context, 'hello')
+        self.assertEqual(3.5, self.datavault.get_parameter(self.context, 'gain'))
+        self.assertArrayEqual([[.1, .2], [.3, .4]],
+                              self.datavault.get(self.context))
+        self.assertEqual(1, len(self.datavault.get_comments(self.context)))
+
+    def test_grid_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_grid(
+                self.context, 'map', [('flux', 'V', []), ('freq', 'GHz', [4, 5])],
+                ['amp (I) [mV]'])
+        self.assertEqual('5.0.0', self.datavault.get_version(self.context))
+        self.datavault.add_parameter(self.context, 'gain', 3.5)
+        other = MockContext('other')
+        self.datavault.initContext(other)
+        self.datavault.open(other, 1)
+        self.assertEqual(0, len(self.datavault.get(other)))
+        self.hub.reset_mock()
+        self.datavault.put_slab(self.context, [0], [[1, 2], [3, 4]],
+                                axis_values=[0.5, 0.6])
+        self.hub.onDataAvailable.assert_called_with(None, set([other.ID]))
+        self.datavault.put_slab(self.context, [1, 1], [[5]])
+        self.assertArrayEqual([[[1], [2]], [[3], [5]]],
+                              self.datavault.get_slice(self.context))
+        self.assertArrayEqual([[[2]], [[5]]], self.datavault.get_slice(
+                self.context, [(0, 5), (1, 2)], columns=['I']))
+        (flux, _, flux_values), (freq, _, freq_values) = \
+                self.datavault.grid_axes(self.context)
+        self.assertEqual(('flux', 'freq'), (flux, freq))
+        self.assertArrayEqual([0.5, 0.6], flux_values)
+        self.assertArrayEqual([4, 5], freq_values)
+        # rows of the grid
+        self.assertArrayEqual([[0.5, 4, 1], [0.5, 5, 2], [0.6, 4, 3], [0.6, 5, 5]],
+                              self.datavault.get(other))
+        self.assertRaises(errors.GridDataError, self.datavault.add,
+                          self.context, [0.7, 4, 1])
+        self.assertRaises(errors.GridDataError, self.datavault.get_slice,
+                          self.context, columns=['flux'])
+
     def test_add_extended_data(self):
         self.datavault.initContext(self.context)
         # Create a root dataset.
@@ -345,5 +730,63 @@ class DataVaultTest(unittest.TestCase):
                 self.datavault.get,
                 self.context)
 
+    def test_get_columns(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')],
+                [('y', 'A', 'V'), ('y', 'B', 'V')])
+        self.datavault.add(self.context, [(1, 2, 3), (4, 5, 6)])
+        data = self.datavault.get(self.context, limit=1, columns=['x', 'B'])
+        self.assertArrayEqual([[1, 3]], data)
+        # the read position is shared with reads of all columns
+        data = self.datavault.get(self.context)
+        self.assertArrayEqual([[4, 5, 6]], data)
+        data = self.datavault.get_ex(self.context, startOver=True,
+                                     columns=[2, 0])
+        self.assertArrayEqual([[3, 1], [6, 4]], data)
+        self.assertRaises(errors.ColumnNotFoundError, self.datavault.get,
+                          self.context, startOver=True, columns=['C'])
+
+    def test_statistics_and_histogram(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'A', 'V')])
+        self.datavault.add(self.context, [(i, i * i) for i in range(5)])
+        stats = self.datavault.get_statistics(self.context, ['x', 'A'])
+        self.assertEqual((5, 2, 0, 4), tuple(stats[0][i] for i in [0, 1, 3, 4]))
+        self.assertEqual((5, 6, 0, 16), tuple(stats[1][i] for i in [0, 1, 3, 4]))
+        stats = self.datavault.get_statistics(self.context, [0], 1, 3)
+        self.assertEqual((2, 1.5), tuple(stats[0][:2]))
+        edges, counts = self.datavault.get_histogram(self.context, 'A', 2)
+        self.assertArrayEqual([0, 8, 16], edges)
+        self.assertArrayEqual([3, 2], counts)
+
+    def test_get_columns_extended(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [2, 2], 'v', 'ms'), ('y', [1], 'i', '')],
+                [('z', 'E',  [1, 2], 'c', 'eV')])
+        x = [[[.1, .5], [.5, .9]], [[.3, .4], [.4, .8]]]
+        y = [2, 3]
+        z =  [[[.1j, 2j]], [[.3j, 5j]]]
+        self.datavault.add_ex_t(self.context, [x, y, z])
+
+        data_t = self.datavault.get_ex_t(self.context, columns=['E', 'y'])
+        self.assertEqual(2, len(data_t))
+        self.assertArrayEqual(z, data_t[0])
+        self.assertArrayEqual(y, data_t[1])
+        data = self.datavault.get_ex(self.context, startOver=True,
+                                     columns=[1])
+        self.assertEqual([(2,), (3,)], data)
+        # only float columns can be read as simple data
+        self.assertRaises(
+                errors.DataVersionMismatchError,
+                self.datavault.get,
+                self.context,
+                startOver=True,
+                columns=['y'])
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
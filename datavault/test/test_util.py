@@ -51,6 +51,89 @@ class Testutil(unittest.TestCase):
         self.assertEqual(expected.dtype, actual.dtype, msg='dtype mismatch')
         self.assertTrue(np.array_equal(expected, actual), msg='array mismatch')
 
+    def test_from_record_array_empty(self):
+        data = np.recarray((0, ), dtype=[('f0', '<f8'), ('f1', '<f8')])
+        actual = util.from_record_array(data)
+        self.assertEqual((0, 2), actual.shape, msg='shape mismatch')
+
+    def test_records_from_rows(self):
+        dtype = np.dtype([('f0', '<i8'), ('f1', '(2,)f8'), ('f2', object)])
+        rows = [(1, [0.5, 1.5], 'a'), (2, np.array([2.5, 3.5]), 'b')]
+        for rows in [rows, [list(row) for row in rows]]:
+            actual = util.records_from_rows(rows, dtype)
+            self.assertEqual(dtype, actual.dtype, msg='dtype mismatch')
+            self.assertEqual([1, 2], list(actual['f0']))
+            self.assertTrue(np.array_equal([[0.5, 1.5], [2.5, 3.5]],
+                                           actual['f1']))
+            self.assertEqual(['a', 'b'], list(actual['f2']))
+        self.assertEqual((0,), util.records_from_rows([], dtype).shape)
+        dtype = np.dtype([('f0', '<f8'), ('f1', '<f8')])
+        actual = util.records_from_rows([[1, 2], [3, 4]], dtype)
+        self.assertEqual((2,), actual.shape)
+        self.assertEqual([2, 4], list(actual['f1']))
+        actual = util.records_from_rows(np.array([[1, 2], [3, 4]]), dtype)
+        self.assertEqual([1, 3], list(actual['f0']))
+
+    def test_records_from_rows_bad_rows(self):
+        dtype = np.dtype([('f0', '<f8'), ('f1', '<f8')])
+        for rows in [[(1, 2), (3,)], [(1, 2, 3)], [[1, 2], [3]]]:
+            self.assertRaises(ValueError, util.records_from_rows, rows, dtype)
+
+    def test_parse_csv(self):
+        text = '1, 2.5E-3, NAN\r\n-INF, 4, 5\r\n'
+        actual = util.parse_csv(text)
+        self.assertEqual((2, 3), actual.shape)
+        self.assertEqual(2.5e-3, actual[0, 1])
+        self.assertTrue(np.isnan(actual[0, 2]))
+        self.assertEqual(-np.inf, actual[1, 0])
+
+    def test_parse_csv_single_column(self):
+        actual = util.parse_csv('1\n2\n3\n')
+        self.assertEqual((3, 1), actual.shape)
+
+    def test_parse_csv_blank_lines(self):
+        actual = util.parse_csv('1, 2\n\n3, 4\n')
+        self.assertTrue(np.array_equal([[1, 2], [3, 4]], actual))
+
+    def test_parse_csv_bad_line(self):
+        self.assertRaises(ValueError, util.parse_csv, '1, 2\n3, x\n')
+
+    def test_decimate_stride(self):
+        data = np.arange(20.).reshape(10, 2)
+        actual = util.decimate(data, 4, 'stride')
+        self.assertTrue(np.array_equal(data[[0, 4, 8]], actual))
+
+    def test_decimate_mean(self):
+        data = np.arange(10.).reshape(5, 2)
+        actual = util.decimate(data, 2, 'mean')
+        self.assertTrue(np.array_equal([[1, 2], [5, 6], [8, 9]], actual))
+
+    def test_decimate_minmax(self):
+        data = np.array([[0, 3], [1, -1], [2, 5], [3, 4], [4, 0]], dtype=float)
+        actual = util.decimate(data, 2, 'minmax')
+        expected = [[0, -1], [1, 3], [2, 4], [3, 5], [4, 0], [4, 0]]
+        self.assertTrue(np.array_equal(expected, actual))
+
+    def test_decimate_bad_method(self):
+        self.assertRaises(ValueError, util.decimate, [[1.0]], 2, 'median')
+
+    def test_running_stats(self):
+        values = np.random.RandomState(0).normal(1e6, 3, 1000)
+        stats = util.RunningStats()
+        for chunk in np.array_split(values, 7):
+            stats.update(chunk)
+        stats.update([np.nan])
+        count, mean, std, lo, hi = stats.result()
+        self.assertEqual(1000, count)
+        self.assertAlmostEqual(values.mean(), mean, places=6)
+        self.assertAlmostEqual(values.std(), std, places=6)
+        self.assertEqual((values.min(), values.max()), (lo, hi))
+
+    def test_running_stats_empty(self):
+        count, mean, std, lo, hi = util.RunningStats().result()
+        self.assertEqual(0, count)
+        self.assertTrue(np.isnan(mean))
+
     def test_braced(self):
         actual = util.braced('foo')
         expected = '{' + 'foo' + '}'
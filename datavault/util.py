@@ -1,6 +1,9 @@
 import ConfigParser as cp
+import StringIO
+import warnings
 
 import numpy as np
+from twisted.python import failure
 
 
 class DVSafeConfigParser(cp.SafeConfigParser):
@@ -36,9 +39,154 @@ def to_record_array(data):
 def from_record_array(data):
     """Take a 1-D array of records and convert to a 2-D array.
 
-    The records must be homogeneous.
+    The records must be homogeneous.  The conversion is done one column at
+    a time, so the cost does not depend on per-row python overhead.
     """
-    return np.vstack([np.array(tuple(row)) for row in data])
+    data = np.asarray(data)
+    if data.dtype.names is None:
+        return np.atleast_2d(data)
+    return np.column_stack([data[name] for name in data.dtype.names])
+
+
+def records_from_rows(rows, dtype):
+    """Convert a list of rows, such as the clusters given to add_ex, to records.
+
+    Rows that are all tuples, as unflattened from labrad clusters, are
+    converted by numpy in a single call.  Other rows are copied to tuples
+    first, as np.core.records.fromrecords needs.
+    """
+    try:
+        records = np.array(rows, dtype=dtype)
+        if records.shape == (len(rows),):
+            return records.view(np.recarray)
+    except (TypeError, ValueError):
+        pass # not all rows are tuples of the right length
+    return np.core.records.fromrecords([tuple(row) for row in rows],
+                                       dtype=dtype)
+
+
+def parse_csv(text, ncols=None):
+    """Parse lines of comma-separated floats into a 2-D array.
+
+    text must consist of whole lines.  All values are parsed in a single
+    call into numpy rather than one python float at a time.  If the text
+    does not parse into a rectangular array this way (for example because
+    of blank or malformed lines), we fall back to np.loadtxt, which skips
+    blank lines and gives a useful error for bad ones.  If ncols is not
+    given, it is taken from the first line.
+    """
+    if ncols is None:
+        first = text[:text.find('\n')]
+        ncols = first.count(',') + 1 if first.strip() else 0
+    nlines = text.count('\n')
+    if text and not text.endswith('\n'):
+        nlines += 1
+    if not nlines:
+        return np.zeros((0, ncols))
+    with warnings.catch_warnings():
+        # numpy warns when it cannot parse the string to the end
+        warnings.simplefilter('ignore', DeprecationWarning)
+        values = np.fromstring(text.replace(',', ' '), sep=' ')
+    if ncols and values.size == nlines * ncols:
+        return values.reshape(nlines, ncols)
+    return np.loadtxt(StringIO.StringIO(text), delimiter=',', ndmin=2)
+
+
+DECIMATION_METHODS = ('stride', 'mean', 'minmax')
+
+def decimate(data, binsize, method='stride'):
+    """Reduce a 2-D array by combining each run of binsize rows.
+
+    The last bin may hold fewer than binsize rows.  method is one of:
+        'stride': keep the first row of each bin
+        'mean':   the mean of each column over the bin
+        'minmax': two rows per bin, holding the minimum and then the
+                  maximum of each column over the bin
+    """
+    if method not in DECIMATION_METHODS:
+        raise ValueError('Unknown decimation method: {!r}'.format(method))
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    if binsize <= 1 or data.size == 0:
+        return data
+    if method == 'stride':
+        return data[::binsize]
+    nfull = len(data) // binsize * binsize
+    bins = data[:nfull].reshape(-1, binsize, data.shape[1])
+    tail = data[nfull:]
+    if method == 'mean':
+        parts = [bins.mean(axis=1)]
+        if len(tail):
+            parts.append(tail.mean(axis=0)[np.newaxis])
+        return np.concatenate(parts)
+    lo, hi = [bins.min(axis=1)], [bins.max(axis=1)]
+    if len(tail):
+        lo.append(tail.min(axis=0)[np.newaxis])
+        hi.append(tail.max(axis=0)[np.newaxis])
+    lo, hi = np.concatenate(lo), np.concatenate(hi)
+    out = np.empty((2 * len(lo), data.shape[1]))
+    out[0::2] = lo
+    out[1::2] = hi
+    return out
+
+
+class RunningStats(object):
+    """Count, mean, standard deviation, min and max of a stream of values.
+
+    Values are added in chunks with update; NaNs are ignored.  Chunks are
+    merged with the pairwise formula of Chan et al., which is numerically
+    stable for long streams.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared deviations from the mean
+        self.min = np.nan
+        self.max = np.nan
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        n = len(values)
+        if not n:
+            return
+        mean = values.mean()
+        m2 = ((values - mean)**2).sum()
+        total = self.count + n
+        delta = mean - self.mean
+        self.m2 += m2 + delta**2 * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+
+    def result(self):
+        """Get (count, mean, std, min, max); the std is the population one."""
+        if not self.count:
+            return (0, np.nan, np.nan, np.nan, np.nan)
+        std = np.sqrt(self.m2 / self.count)
+        return (self.count, self.mean, std, self.min, self.max)
+
+
+def sync_result(d):
+    """Get the result of a Deferred if it has already fired, or else d itself.
+
+    Calls that may run in the I/O executor return Deferreds.  Without an
+    executor these fire immediately, and this lets callers return plain
+    results in that case.  A failure is raised.
+    """
+    results = []
+    def grab(result):
+        results.append(result)
+        return result
+    d.addBoth(grab)
+    if not results:
+        return d
+    result = results[0]
+    if isinstance(result, failure.Failure):
+        d.addErrback(lambda _: None) # we raise it instead
+        result.raiseException()
+    return result
 
 
 def braced(s):